@@ -0,0 +1,273 @@
+# batch evaluation of many positions at once with NumPy, for labelling datasets and scoring
+# lists of candidate positions. a batch is an (N, 64) array of piece codes (indices into
+# ChessEngine.PIECE_NAMES, square = row * 8 + col) and an (N,) array of sides to move; planes()
+# turns the codes into (N, 12, 64) one-hot piece planes for anything that wants those instead.
+# the score is ChessSearch's material plus piece-square tables, and optionally a mobility term:
+# squares every knight, bishop, rook and queen can move to (sliders stop at the first piece),
+# weighted per piece type. evaluateScalar computes the same score one GameState at a time.
+#
+#   python ChessBatchEval.py --positions 20000      positions/s, batch against scalar
+#
+# NumPy is only needed by the batch functions, the rest of the engine runs without it
+
+import sys
+import time
+
+import ChessEngine
+import ChessSearch
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PIECE_NAMES = ChessEngine.PIECE_NAMES
+PIECE_CODES = ChessEngine.PIECE_CODES
+# centipawns per square a piece can move to
+MOBILITY_WEIGHTS = {'N': 4, 'B': 4, 'R': 2, 'Q': 1}
+CHUNK = 2048  # positions evaluated per set of array operations, bounds the temporary arrays
+
+
+def requireNumpy():
+    if np is None:
+        raise ImportError("batch evaluation needs NumPy, install it with 'pip install numpy'")
+
+
+# mobility of piece (a name like "wN") on r,c: squares it can move to that don't hold an own
+# piece, sliders stopping at the first piece in every direction
+def pieceMobility(board, r, c, piece):
+    color, type = piece
+    if type == 'N':
+        return sum(1 for endRow, endCol in ChessEngine.KNIGHT_TARGETS[r][c] if board[endRow][endCol][0] != color)
+    count = 0
+    rays = ChessEngine.RAYS[r][c]
+    for j in ChessEngine.SLIDER_DIRECTIONS[type]:
+        for endRow, endCol in rays[j]:
+            endPiece = board[endRow][endCol]
+            if endPiece == "--":
+                count += 1
+            else:
+                count += endPiece[0] != color
+                break
+    return count
+
+
+# the batch score of one position in plain Python, for the side to move
+def evaluateScalar(gs, mobility=True):
+    score = ChessSearch.evaluate(gs)
+    if mobility:
+        board = gs.board
+        balance = 0
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece[1] in MOBILITY_WEIGHTS:
+                    value = MOBILITY_WEIGHTS[piece[1]] * pieceMobility(board, r, c, piece)
+                    balance += value if piece[0] == 'w' else -value
+        score += balance if gs.whiteToMove else -balance
+    return score
+
+
+# tables for the batch evaluator, built at import when NumPy is there.
+# SCORE_TABLE[code, square]: ChessSearch.SQUARE_SCORES as a (13, 64) array, row 0 for empty squares.
+# KNIGHT_MATRIX[from, to]: 1 where a knight steps from one square to the other.
+# POPCOUNT[byte]: bits set in every byte value
+def buildTables():
+    scoreTable = np.zeros((13, 64), dtype=np.int32)
+    for code in range(1, 13):
+        scoreTable[code] = ChessSearch.SQUARE_SCORES[PIECE_NAMES[code]]
+    knightMatrix = np.zeros((64, 64), dtype=np.float32)
+    for r in range(8):
+        for c in range(8):
+            for endRow, endCol in ChessEngine.KNIGHT_TARGETS[r][c]:
+                knightMatrix[r * 8 + c, endRow * 8 + endCol] = 1
+    popcount = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+    return scoreTable, knightMatrix, popcount
+
+
+# (shift, mask) per direction for moving a bitboard (bit = row * 8 + col) one square along it:
+# shifted left by shift (right when negative), then masked so nothing wraps around to the other
+# side of the board. SLIDER_GROUPS: the sliders moving along the rook and the bishop directions
+def buildShifts(directions):
+    fileA = sum(1 << (r * 8) for r in range(8))
+    full = (1 << 64) - 1
+    masks = {-1: full ^ (fileA << 7), 0: full, 1: full ^ fileA}
+    return tuple((dr * 8 + dc, masks[dc]) for dr, dc in directions)
+
+
+if np is not None:
+    SCORE_TABLE, KNIGHT_MATRIX, POPCOUNT = buildTables()
+    SLIDER_GROUPS = ((buildShifts(ChessEngine.DIRECTIONS[:4]), ('R', 'Q')),
+                     (buildShifts(ChessEngine.DIRECTIONS[4:]), ('B', 'Q')))
+
+
+# (codes, whiteToMove) batch of an iterable of GameStates
+def encodeGameStates(states):
+    requireNumpy()
+    boards = []
+    sides = []
+    for gs in states:
+        boards.append([PIECE_CODES[piece] for row in gs.board for piece in row])
+        sides.append(gs.whiteToMove)
+    return np.array(boards, dtype=np.int8).reshape(-1, 64), np.array(sides, dtype=bool)
+
+
+# (codes, whiteToMove) batch of an iterable of FEN strings, read straight into the array
+# without building GameStates. raises ValueError for a malformed board field
+def encodeFens(fens):
+    requireNumpy()
+    boards = []
+    sides = []
+    for fen in fens:
+        fields = fen.split()
+        board = []
+        for ch in fields[0]:
+            if ch in "12345678":
+                board.extend([0] * int(ch))
+            elif ch in ChessEngine.FEN_PIECES:
+                board.append(PIECE_CODES[ChessEngine.FEN_PIECES[ch]])
+            elif ch != "/":
+                raise ValueError("bad character '%s' in FEN '%s'" % (ch, fen))
+        if len(board) != 64:
+            raise ValueError("FEN '%s' does not have 64 squares" % fen)
+        boards.append(board)
+        sides.append(len(fields) < 2 or fields[1] == "w")
+    return np.array(boards, dtype=np.int8).reshape(-1, 64), np.array(sides, dtype=bool)
+
+
+# (N, 12, 64) one-hot planes of a batch of codes, plane i for piece code i + 1
+def planes(codes):
+    requireNumpy()
+    return (codes[:, None, :] == np.arange(1, 13, dtype=np.int8)[None, :, None]).astype(np.uint8)
+
+
+# (n,) uint64 bitboards of the squares where mask is true, mask an (n, 64) bool array
+def bitboards(mask):
+    return np.packbits(mask, axis=1, bitorder="little").view("<u8").reshape(-1)
+
+
+# mobility of white minus that of black, (n,) array, for a chunk of codes.
+# sliders are filled along one direction at a time, for all positions and piece kinds at once:
+# the bitboard of the pieces steps one square at a time and stops on occupied squares. two
+# pieces' rays in the same direction never share a square, so counting the squares reached
+# in a direction counts the moves of every piece along it
+def mobilityBalance(codes):
+    n = len(codes)
+    ownMask = {'w': (codes >= 1) & (codes <= 6), 'b': codes >= 7}
+    balance = np.zeros(n, dtype=np.int32)
+    for color, sign in (('w', 1), ('b', -1)):
+        knights = (codes == PIECE_CODES[color + 'N']).astype(np.float32)
+        knightSteps = (knights @ KNIGHT_MATRIX) * ~ownMask[color]  # knights of this color reaching every square
+        balance += sign * MOBILITY_WEIGHTS['N'] * knightSteps.sum(axis=1).astype(np.int32)
+
+    empty = bitboards(codes == 0)[:, None]
+    notOwn = {color: ~bitboards(mask) for color, mask in ownMask.items()}
+    for shifts, types in SLIDER_GROUPS:
+        kinds = [(color, type) for color in 'wb' for type in types]
+        sources = np.stack([bitboards(codes == PIECE_CODES[color + type]) for color, type in kinds], axis=1)
+        targets = np.stack([notOwn[color] for color, type in kinds], axis=1)  # (n, kinds)
+        counts = np.zeros((n, len(kinds)), dtype=np.int32)
+        for shift, mask in shifts:
+            mask = np.uint64(mask)
+            amount = np.uint64(abs(shift))
+            frontier = sources
+            reached = np.zeros_like(sources)
+            for step in range(7):
+                frontier = (frontier << amount if shift > 0 else frontier >> amount) & mask
+                reached |= frontier & targets
+                frontier &= empty
+                if not frontier.any():
+                    break
+            counts += POPCOUNT[reached.view(np.uint8)].reshape(n, len(kinds), 8).sum(axis=2, dtype=np.int32)
+        weights = np.array([MOBILITY_WEIGHTS[type] if color == 'w' else -MOBILITY_WEIGHTS[type]
+                            for color, type in kinds], dtype=np.int32)
+        balance += counts @ weights
+    return balance
+
+
+# scores of a batch for the side to move, an (N,) int32 array equal to evaluateScalar of every
+# position (ChessSearch.evaluate with mobility=False)
+def evaluateBatch(codes, whiteToMove, mobility=True):
+    requireNumpy()
+    codes = np.asarray(codes)
+    scores = np.empty(len(codes), dtype=np.int32)
+    squares = np.arange(64)
+    for start in range(0, len(codes), CHUNK):
+        chunk = codes[start:start + CHUNK]
+        score = SCORE_TABLE[chunk, squares].sum(axis=1, dtype=np.int32)
+        if mobility:
+            score += mobilityBalance(chunk)
+        scores[start:start + CHUNK] = score
+    return np.where(whiteToMove, scores, -scores)
+
+
+# positions reached by random games from the start position, for the benchmark
+def randomPositions(count, seed=1, backend="mailbox"):
+    import random
+
+    rng = random.Random(seed)
+    fens = []
+    gs = ChessEngine.newGameState(backend)
+    while len(fens) < count:
+        moves = gs.getValidMoveCodes()
+        if not moves or gs.halfmoveClock >= 100:
+            gs.loadFen(ChessEngine.START_FEN)
+            continue
+        gs.makeMove(rng.choice(moves))
+        fens.append(gs.getFen())
+    return fens
+
+
+# positions/s of the scalar and the batch evaluator on the same positions, checking they agree
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="batch NumPy evaluation against the scalar evaluator")
+    parser.add_argument("--positions", type=int, default=20000, help="random positions evaluated")
+    parser.add_argument("--epd", metavar="PATH", help="evaluate the positions of an EPD file instead")
+    parser.add_argument("--no-mobility", action="store_true", help="material and piece-square tables only")
+    parser.add_argument("--backend", choices=ChessEngine.BACKENDS, default="mailbox",
+                        help="position backend behind GameState")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    requireNumpy()
+    mobility = not args.no_mobility
+
+    if args.epd:
+        import ChessEpd
+        fens = [fen for number, fen, operations in ChessEpd.readPositions(args.epd)]
+    else:
+        fens = randomPositions(args.positions, args.seed, args.backend)
+    states = [ChessEngine.newGameState(args.backend, fen) for fen in fens]
+
+    start = time.perf_counter()
+    expected = [evaluateScalar(gs, mobility) for gs in states]
+    scalarSeconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    codes, whiteToMove = encodeGameStates(states)
+    encodeSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    fenCodes, fenWhiteToMove = encodeFens(fens)
+    fenSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    scores = evaluateBatch(codes, whiteToMove, mobility)
+    batchSeconds = time.perf_counter() - start
+
+    agree = scores.tolist() == expected and np.array_equal(fenCodes, codes) and np.array_equal(fenWhiteToMove, whiteToMove)
+
+    def rate(seconds):
+        return len(fens) / seconds if seconds > 0 else 0
+
+    print("%d positions, %s" % (len(fens), "mobility on" if mobility else "material and piece-square tables"))
+    print("scalar            %8.3fs %10d positions/s" % (scalarSeconds, rate(scalarSeconds)))
+    print("encode GameState  %8.3fs %10d positions/s" % (encodeSeconds, rate(encodeSeconds)))
+    print("encode FEN        %8.3fs %10d positions/s" % (fenSeconds, rate(fenSeconds)))
+    print("batch evaluate    %8.3fs %10d positions/s  %.1fx scalar" % (batchSeconds, rate(batchSeconds),
+                                                                     scalarSeconds / batchSeconds if batchSeconds > 0 else 0))
+    print("scores %s" % ("agree" if agree else "DIFFER"))
+    return 0 if agree else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,370 @@
+# bitboard position backend for GameState
+# keeps one 64 bit integer per piece (color + type) and per color next to the board,
+# and generates legal moves with set-wise bit operations instead of per-square string tests.
+# squares are numbered row * 8 + col, so bit 0 is a8 and bit 63 is h1.
+# the board view (gs.board) is still kept up to date for ChessMain.drawPieces and for the
+# piece fields of the move codes
+
+import ChessEngine
+
+FULL = (1 << 64) - 1
+FILE_A = sum(1 << (r * 8) for r in range(8))
+FILE_H = FILE_A << 7
+SQUARES = ChessEngine.SQUARES  # square number -> (row, col)
+PIECE_CODES = ChessEngine.PIECE_CODES
+CAPTURE_MOVES = ChessEngine.CAPTURE_MOVES
+QUIET_MOVES = ChessEngine.QUIET_MOVES
+ALL_MOVES = ChessEngine.ALL_MOVES
+PIECES = ("wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK")
+
+
+# bitboard of the squares reached from every square by a single step in each direction
+def buildStepTable(steps):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        bb = 0
+        for dr, dc in steps:
+            if 0 <= r + dr < 8 and 0 <= c + dc < 8:
+                bb |= 1 << ((r + dr) * 8 + c + dc)
+        table.append(bb)
+    return table
+
+
+KNIGHT_ATTACKS = buildStepTable(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_ATTACKS = buildStepTable(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+# squares attacked by a pawn of that color standing on the square
+PAWN_ATTACKS = {
+    "w": buildStepTable(((-1, -1), (-1, 1))),
+    "b": buildStepTable(((1, -1), (1, 1))),
+}
+
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+# RAYS[d][sq]: every square from sq (exclusive) to the edge of the board in direction d
+# BETWEEN[a][b]: the squares strictly between a and b if they share a line, else 0
+def buildRays():
+    rays = {}
+    between = [[0] * 64 for sq in range(64)]
+    for d in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+        table = []
+        for sq in range(64):
+            r, c = divmod(sq, 8)
+            bb = 0
+            r, c = r + d[0], c + d[1]
+            while 0 <= r < 8 and 0 <= c < 8:
+                between[sq][r * 8 + c] = bb
+                bb |= 1 << (r * 8 + c)
+                r, c = r + d[0], c + d[1]
+            table.append(bb)
+        rays[d] = table
+    return rays, between
+
+
+RAYS, BETWEEN = buildRays()
+# (ray table, whether the direction goes towards higher square numbers) per direction.
+# along a ray going up the nearest blocker is the lowest set bit, going down it is the highest
+ROOK_RAYS = tuple((RAYS[d], d[0] > 0 or (d[0] == 0 and d[1] > 0)) for d in ROOK_DIRECTIONS)
+BISHOP_RAYS = tuple((RAYS[d], d[0] > 0) for d in BISHOP_DIRECTIONS)
+
+
+# squares attacked by a slider on sq along the given rays, stopping at (and including) the first blocker
+def slidingAttacks(rays, sq, occupied):
+    attacks = 0
+    for table, ascending in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            if ascending:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= table[first]
+        attacks |= ray
+    return attacks
+
+
+class BitboardGameState(ChessEngine.GameState):
+    def __init__(self, fen=ChessEngine.START_FEN):
+        self.pieceBitboards = {}
+        self.colorBitboards = {}
+        super().__init__(fen)
+
+    # rebuild the bitboards, king locations and key history from the board view
+    def boardChanged(self):
+        self.pieceBitboards = dict.fromkeys(PIECES, 0)
+        self.colorBitboards = {"w": 0, "b": 0}
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    self.pieceBitboards[piece] |= 1 << (r * 8 + c)
+                    self.colorBitboards[piece[0]] |= 1 << (r * 8 + c)
+                    if piece == "wK":
+                        self.whiteKingLocation = (r, c)
+                    elif piece == "bK":
+                        self.blackKingLocation = (r, c)
+        self.zobristHistory = [self.computeZobristKey()]
+
+    # the board primitives used by makeMove / undoMove update the bitboards instead of attack maps
+    def removePiece(self, r, c):
+        bit = 1 << (r * 8 + c)
+        piece = self.board[r][c]
+        self.pieceBitboards[piece] ^= bit
+        self.colorBitboards[piece[0]] ^= bit
+        self.board[r][c] = "--"
+
+    def putPiece(self, r, c, piece):
+        bit = 1 << (r * 8 + c)
+        previous = self.board[r][c]
+        if previous != "--":
+            self.pieceBitboards[previous] ^= bit
+            self.colorBitboards[previous[0]] ^= bit
+        self.pieceBitboards[piece] |= bit
+        self.colorBitboards[piece[0]] |= bit
+        self.board[r][c] = piece
+        if piece == "wK":
+            self.whiteKingLocation = (r, c)
+        elif piece == "bK":
+            self.blackKingLocation = (r, c)
+
+    def positionCopy(self):
+        return (self.snapshot(), self.whiteKingLocation, self.blackKingLocation,
+                dict(self.pieceBitboards), dict(self.colorBitboards))
+
+    # bitboard of the pieces of color byColor attacking sq
+    def attackersTo(self, sq, byColor, occupied):
+        pieces = self.pieceBitboards
+        queens = pieces[byColor + "Q"]
+        return (KNIGHT_ATTACKS[sq] & pieces[byColor + "N"]) | \
+            (KING_ATTACKS[sq] & pieces[byColor + "K"]) | \
+            (PAWN_ATTACKS["b" if byColor == "w" else "w"][sq] & pieces[byColor + "p"]) | \
+            (slidingAttacks(ROOK_RAYS, sq, occupied) & (pieces[byColor + "R"] | queens)) | \
+            (slidingAttacks(BISHOP_RAYS, sq, occupied) & (pieces[byColor + "B"] | queens))
+
+    # own pieces pinned to the king on sq, mapped to the squares they may still move to
+    def pinnedPieces(self, sq, own, enemyColor, occupied):
+        pieces = self.pieceBitboards
+        pinned = {}
+        queens = pieces[enemyColor + "Q"]
+        for rays, sliders in ((ROOK_RAYS, pieces[enemyColor + "R"] | queens),
+                              (BISHOP_RAYS, pieces[enemyColor + "B"] | queens)):
+            for table, ascending in rays:
+                ray = table[sq]
+                if not ray & sliders:
+                    continue
+                blockers = ray & occupied
+                if ascending:
+                    first = blockers & -blockers
+                    rest = blockers ^ first
+                    second = rest & -rest
+                else:
+                    first = 1 << (blockers.bit_length() - 1) if blockers else 0
+                    rest = blockers ^ first
+                    second = 1 << (rest.bit_length() - 1) if rest else 0
+                if first & own and second & sliders:
+                    pinnerSq = second.bit_length() - 1
+                    pinned[first.bit_length() - 1] = BETWEEN[sq][pinnerSq] | second
+        return pinned
+
+    # the GameState methods below read the attack maps, which this backend doesn't keep,
+    # so they are answered from the bitboards
+    def squareUnderAttack(self, r, c):
+        enemyColor = "b" if self.whiteToMove else "w"
+        occupied = self.colorBitboards["w"] | self.colorBitboards["b"]
+        return self.attackersTo(r * 8 + c, enemyColor, occupied) != 0
+
+    # king moves of the kinds in moveKinds, tested against the occupancy without the king so it
+    # can't hide behind itself
+    def getKingMoves(self, r, c, moves):
+        board = self.board
+        allyColor = "w" if self.whiteToMove else "b"
+        enemyColor = "b" if self.whiteToMove else "w"
+        kinds = self.moveKinds
+        kingSq = r * 8 + c
+        occupied = self.colorBitboards["w"] | self.colorBitboards["b"]
+        wanted = (self.colorBitboards[enemyColor] if kinds & CAPTURE_MOVES else 0) | \
+            (~occupied & FULL if kinds & QUIET_MOVES else 0)
+        kingStart = kingSq | PIECE_CODES[board[r][c]] << 12
+        withoutKing = occupied ^ (1 << kingSq)
+        targets = KING_ATTACKS[kingSq] & wanted
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            to = bit.bit_length() - 1
+            if not self.attackersTo(to, enemyColor, withoutKing):
+                endRow, endCol = SQUARES[to]
+                moves.append(kingStart | to << 6 | PIECE_CODES[board[endRow][endCol]] << 16)
+        if self.castlingRights and kinds & QUIET_MOVES and not self.attackersTo(kingSq, enemyColor, occupied):
+            self.getBitboardCastleMoves(kingSq, kingStart, allyColor, enemyColor, occupied, moves)
+
+    def getValidMoveCodes(self, moves=None, kinds=ALL_MOVES):
+        if moves is None:
+            moves = []
+        else:
+            del moves[:]
+        self.generateCodes(moves, kinds, False)
+        if kinds == ALL_MOVES:
+            self.checkMate = len(moves) == 0 and self.inCheck
+            self.staleMate = len(moves) == 0 and not self.inCheck
+        return moves
+
+    def hasLegalMove(self):
+        found = self.generateCodes([], ALL_MOVES, True)
+        self.checkMate = not found and self.inCheck
+        self.staleMate = not found and not self.inCheck
+        return found
+
+    # adds the legal moves of the given kinds to moves. with firstOnly it stops after the first
+    # group of pieces (king, knights, diagonal sliders, straight sliders, pawns) that has a move.
+    # returns whether any move was found
+    def generateCodes(self, moves, kinds, firstOnly):
+        board = self.board
+        pieces = self.pieceBitboards
+        allyColor = "w" if self.whiteToMove else "b"
+        enemyColor = "b" if self.whiteToMove else "w"
+        own = self.colorBitboards[allyColor]
+        enemy = self.colorBitboards[enemyColor]
+        occupied = own | enemy
+        # the squares moves of the wanted kinds end on
+        wanted = (enemy if kinds & CAPTURE_MOVES else 0) | (~occupied & FULL if kinds & QUIET_MOVES else 0)
+        kingBB = pieces[allyColor + "K"]
+        kingSq = kingBB.bit_length() - 1
+        checkers = self.attackersTo(kingSq, enemyColor, occupied)
+        self.inCheck = checkers != 0
+
+        # king moves, tested against the occupancy without the king so it can't hide behind itself
+        kingStart = kingSq | PIECE_CODES[allyColor + "K"] << 12
+        withoutKing = occupied ^ kingBB
+        targets = KING_ATTACKS[kingSq] & wanted
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            to = bit.bit_length() - 1
+            if not self.attackersTo(to, enemyColor, withoutKing):
+                endRow, endCol = SQUARES[to]
+                moves.append(kingStart | to << 6 | PIECE_CODES[board[endRow][endCol]] << 16)
+        if self.castlingRights and not checkers and kinds & QUIET_MOVES:
+            self.getBitboardCastleMoves(kingSq, kingStart, allyColor, enemyColor, occupied, moves)
+        if moves and firstOnly:
+            return True
+
+        if checkers & (checkers - 1) == 0:  # not a double check, other pieces may move
+            if checkers:
+                # capture the checking piece or block between it and the king
+                allowed = checkers | BETWEEN[kingSq][checkers.bit_length() - 1]
+            else:
+                allowed = FULL
+            pinned = self.pinnedPieces(kingSq, own, enemyColor, occupied)
+            targets = wanted & allowed
+            for bb, attacks in ((pieces[allyColor + "N"], lambda sq: KNIGHT_ATTACKS[sq]),
+                                (pieces[allyColor + "B"] | pieces[allyColor + "Q"],
+                                 lambda sq: slidingAttacks(BISHOP_RAYS, sq, occupied)),
+                                (pieces[allyColor + "R"] | pieces[allyColor + "Q"],
+                                 lambda sq: slidingAttacks(ROOK_RAYS, sq, occupied))):
+                self.getBitboardPieceMoves(bb, attacks, targets, pinned, moves)
+                if moves and firstOnly:
+                    return True
+            self.getBitboardPawnMoves(allyColor, enemyColor, kingSq, checkers, allowed, pinned, kinds, moves)
+        return len(moves) > 0
+
+    # castling: the squares between king and rook are empty, the ones the king crosses and lands on
+    # not attacked. the caller tests that the king isn't in check
+    def getBitboardCastleMoves(self, kingSq, kingStart, allyColor, enemyColor, occupied, moves):
+        row = kingSq & ~7
+        for right, kingEndCol, rookCol, rookEndCol in ChessEngine.CASTLES[allyColor]:
+            if self.castlingRights & right and not BETWEEN[kingSq][row + rookCol] & occupied and \
+                    not self.attackersTo(row + rookEndCol, enemyColor, occupied) and \
+                    not self.attackersTo(row + kingEndCol, enemyColor, occupied):
+                moves.append(kingStart | (row + kingEndCol) << 6 | ChessEngine.CASTLE_FLAG)
+
+    # moves of the non-pawn pieces in bb; attacks(sq) gives the squares the piece on sq reaches
+    def getBitboardPieceMoves(self, bb, attacks, targets, pinned, moves):
+        board = self.board
+        while bb:
+            bit = bb & -bb
+            bb ^= bit
+            sq = bit.bit_length() - 1
+            to = attacks(sq) & targets
+            if sq in pinned:
+                to &= pinned[sq]  # a knight's moves never stay on the pin line, so it ends up with none
+            r, c = SQUARES[sq]
+            start = sq | PIECE_CODES[board[r][c]] << 12
+            while to:
+                toBit = to & -to
+                to ^= toBit
+                endSq = toBit.bit_length() - 1
+                endRow, endCol = SQUARES[endSq]
+                moves.append(start | endSq << 6 | PIECE_CODES[board[endRow][endCol]] << 16)
+
+    # pawn moves of the given kinds, promotions going with the captures
+    def getBitboardPawnMoves(self, allyColor, enemyColor, kingSq, checkers, allowed, pinned, kinds, moves):
+        board = self.board
+        pieces = self.pieceBitboards
+        pawns = pieces[allyColor + "p"]
+        pawnCode = PIECE_CODES[allyColor + "p"] << 12
+        promotions = ChessEngine.PROMOTION_CODES[allyColor]
+        enemy = self.colorBitboards[enemyColor]
+        empty = ~(self.colorBitboards[allyColor] | enemy) & FULL
+        if allyColor == "w":
+            forward = -8
+            pushes = (pawns >> 8) & empty
+            doubles = ((pushes & (0xFF << 40)) >> 8) & empty
+            leftCaptures = ((pawns & ~FILE_A) >> 9) & enemy
+            rightCaptures = ((pawns & ~FILE_H) >> 7) & enemy
+            backRow = 0
+        else:
+            forward = 8
+            pushes = (pawns << 8) & empty
+            doubles = ((pushes & (0xFF << 16)) << 8) & empty
+            leftCaptures = ((pawns & ~FILE_A) << 7) & enemy
+            rightCaptures = ((pawns & ~FILE_H) << 9) & enemy
+            backRow = 7
+        backRank = 0xFF << (backRow * 8)
+        if not kinds & QUIET_MOVES:
+            pushes &= backRank
+            doubles = 0
+        if not kinds & CAPTURE_MOVES:
+            pushes &= ~backRank
+            leftCaptures = rightCaptures = 0
+
+        # (targets, distance from the start square to the target square)
+        for targets, step in ((pushes, forward), (doubles, 2 * forward),
+                              (leftCaptures, forward - 1), (rightCaptures, forward + 1)):
+            targets &= allowed
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                to = bit.bit_length() - 1
+                sq = to - step
+                if sq in pinned and not bit & pinned[sq]:
+                    continue
+                endRow, endCol = SQUARES[to]
+                code = sq | to << 6 | pawnCode | PIECE_CODES[board[endRow][endCol]] << 16
+                if endRow == backRow:
+                    moves.extend(code | promotion for promotion in promotions)
+                else:
+                    moves.append(code)
+
+        if self.enPassantPossible and kinds & CAPTURE_MOVES:
+            epSq = self.enPassantPossible[0] * 8 + self.enPassantPossible[1]
+            capturedBit = 1 << (epSq - forward)
+            capturers = PAWN_ATTACKS[enemyColor][epSq] & pawns
+            queens = pieces[enemyColor + "Q"]
+            while capturers:
+                bit = capturers & -capturers
+                capturers ^= bit
+                # the capture removes two pawns from the same rank at once, so test the resulting
+                # position directly: no checker may survive apart from the captured pawn and
+                # no slider may see the king through the squares that were cleared
+                occupied = (self.colorBitboards[allyColor] | enemy) ^ bit ^ capturedBit | (1 << epSq)
+                if checkers & ~capturedBit & (pieces[enemyColor + "N"] | pieces[enemyColor + "p"]):
+                    continue
+                if slidingAttacks(ROOK_RAYS, kingSq, occupied) & (pieces[enemyColor + "R"] | queens):
+                    continue
+                if slidingAttacks(BISHOP_RAYS, kingSq, occupied) & (pieces[enemyColor + "B"] | queens):
+                    continue
+                moves.append((bit.bit_length() - 1) | epSq << 6 | pawnCode | PIECE_CODES[enemyColor + "p"] << 16
+                             | ChessEngine.ENPASSANT_FLAG)
@@ -0,0 +1,191 @@
+# opening book: a binary file of (position key, move, weight) entries built from a PGN collection,
+# sorted by key and looked up by binary search over a memory mapped view of the file.
+# nothing is read into Python objects when a book is opened, so it costs no load time, and every
+# process using the same book shares its pages through the OS file cache.
+#
+# file format:
+#   header   HEADER: magic, version, number of entries, offset of the index
+#   entries  ENTRY: Zobrist key of the position, move (code & MOVE_ID_MASK), weight; sorted by
+#            key, the moves of a position by weight, highest first
+#   index    the key of every INDEX_STRIDE-th entry, a page of entries apart, so a lookup bisects
+#            the small index and then only one page of entries
+# a move's weight is the score of the games it was played in, for the side that played it:
+# 2 for a win, 1 for a draw (or an unknown result), 0 for a loss.
+#
+#   python ChessBook.py build games.pgn.gz book.bin --plies 20
+#   python ChessBook.py probe book.bin --fen "<fen>"
+
+import mmap
+import os
+import struct
+import sys
+import time
+
+import ChessEngine
+
+MAGIC = b"CBK1"
+VERSION = 1
+HEADER = struct.Struct("<4sB3xQQ")  # magic, version, entries, index offset
+ENTRY = struct.Struct("<QII")  # key, move, weight
+KEY = struct.Struct("<Q")
+INDEX_STRIDE = 4096 // ENTRY.size  # entries per page
+DEFAULT_PLIES = 20  # plies of every game that go into the book
+MAX_WEIGHT = (1 << 32) - 1
+# points of a result for (white, black)
+RESULT_POINTS = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}
+UNKNOWN_POINTS = (1, 1)
+
+
+# {(key, move): weight} of the first plies of every game of source, a PGN path or open file, and
+# the number of games read. games starting from a set up position are left out
+def collectMoves(source, plies=DEFAULT_PLIES, backend="mailbox"):
+    import ChessPgn
+
+    weights = {}
+    games = 0
+    gs = ChessEngine.newGameState(backend)
+    for text in ChessPgn.readGameTexts(source):
+        headers, moves, result = ChessPgn.parseGame(text)
+        if "FEN" in headers:
+            continue
+        points = RESULT_POINTS.get(headers.get("Result", result), UNKNOWN_POINTS)
+        gs.loadFen(ChessEngine.START_FEN)
+        for san in moves[:plies]:
+            try:
+                code = gs.sanToMove(san)
+            except ValueError:
+                break  # the rest of a game with an illegal move isn't trusted
+            entry = (gs.zobristKey, code & ChessEngine.MOVE_ID_MASK)
+            weights[entry] = weights.get(entry, 0) + points[0 if gs.whiteToMove else 1]
+            gs.makeMove(code)
+        games += 1
+    return weights, games
+
+
+# write the book of weights ({(key, move): weight}) to path, leaving out the moves weighing less
+# than minWeight. returns the number of entries
+def writeBook(path, weights, minWeight=1):
+    entries = sorted(((key, move, min(weight, MAX_WEIGHT)) for (key, move), weight in weights.items()
+                      if weight >= minWeight), key=lambda entry: (entry[0], -entry[2], entry[1]))
+    indexOffset = HEADER.size + len(entries) * ENTRY.size
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(entries), indexOffset))
+        for entry in entries:
+            f.write(ENTRY.pack(*entry))
+        for i in range(0, len(entries), INDEX_STRIDE):
+            f.write(KEY.pack(entries[i][0]))
+    os.replace(path + ".tmp", path)
+    return len(entries)
+
+
+class OpeningBook():
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.indexOffset = HEADER.unpack_from(self.data)
+        if magic != MAGIC or version != VERSION:
+            self.data.close()
+            raise ValueError("%s is not a version %d opening book" % (path, VERSION))
+        self.indexCount = (self.count + INDEX_STRIDE - 1) // INDEX_STRIDE
+
+    def close(self):
+        self.data.close()
+
+    # (move, weight) of every entry of the position with key, highest weight first
+    def entries(self, key):
+        data = self.data
+        # the index keys before key: the first entry of key is after the last of their pages' starts
+        lo, hi = 0, self.indexCount
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if KEY.unpack_from(data, self.indexOffset + mid * KEY.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        lo, hi = max(lo - 1, 0) * INDEX_STRIDE, min(lo * INDEX_STRIDE, self.count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if KEY.unpack_from(data, HEADER.size + mid * ENTRY.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        for i in range(lo, self.count):
+            entryKey, move, weight = ENTRY.unpack_from(data, HEADER.size + i * ENTRY.size)
+            if entryKey != key:
+                break
+            found.append((move, weight))
+        return found
+
+    # (move code, weight) of the book moves of gs that are legal there, highest weight first.
+    # the legality check keeps a key collision from ever playing a move of another position
+    def bookMoves(self, gs):
+        found = self.entries(gs.zobristKey)
+        if not found:
+            return []
+        legal = {code & ChessEngine.MOVE_ID_MASK: code for code in gs.getValidMoveCodes()}
+        return [(legal[move], weight) for move, weight in found if move in legal and weight > 0]
+
+    # code of a book move of gs picked at random in proportion to the weights (the heaviest one
+    # when best), or None when the position isn't in the book
+    def chooseMove(self, gs, rng=None, best=False):
+        moves = self.bookMoves(gs)
+        if not moves:
+            return None
+        if best:
+            return moves[0][0]
+        if rng is None:
+            import random  # only a game that reaches the book pays for importing it
+
+            rng = random
+        return rng.choices([code for code, weight in moves], [weight for code, weight in moves])[0]
+
+
+# the book at path, or None when there is no such file, for callers where a book is optional
+def openBook(path):
+    if path is None or not os.path.exists(path):
+        return None
+    return OpeningBook(path)
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="build and probe opening books")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from a PGN file")
+    build.add_argument("pgn", help="PGN file, .gz files are decompressed on the fly")
+    build.add_argument("book", help="book file written")
+    build.add_argument("--plies", type=int, default=DEFAULT_PLIES, help="plies of every game put in the book")
+    build.add_argument("--min-weight", type=int, default=1, help="moves weighing less are left out")
+    build.add_argument("--backend", choices=ChessEngine.BACKENDS, default="mailbox",
+                       help="position backend behind GameState")
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book", help="book file")
+    probe.add_argument("--fen", default=ChessEngine.START_FEN, help="position looked up (default: the start)")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        weights, games = collectMoves(args.pgn, args.plies, args.backend)
+        count = writeBook(args.book, weights, args.min_weight)
+        print("%d games, %d positions, %d entries, %d bytes in %.2fs"
+              % (games, len({key for key, move in weights}), count, os.path.getsize(args.book),
+                 time.perf_counter() - start))
+        return 0
+
+    book = OpeningBook(args.book)
+    gs = ChessEngine.newGameState("mailbox", args.fen)
+    moves = book.bookMoves(gs)
+    total = sum(weight for code, weight in moves)
+    for code, weight in moves:
+        print("%-8s %8d %5.1f%%" % (gs.moveToSan(code, check=False), weight, 100.0 * weight / total))
+    if not moves:
+        print("not in the book")
+    book.close()
+    return 0 if moves else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,151 @@
 # class to store data related to current state of the game
 # determines valid moves and logs of the moves
+# importing it only builds a few small tables (see ChessUCI for the import time budget)
+
+# position backends that can sit behind the GameState API, see newGameState
+BACKENDS = ("mailbox", "bitboard")
+
+# the 8 line directions: 0-3 are rook directions, 4-7 bishop directions
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_STEPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+
+
+# compact move encoding. move generation packs every move into one int:
+#   bits 0-5 start square, bits 6-11 end square (square = row * 8 + col),
+#   bits 12-15 piece moved, bits 16-19 piece captured (index into PIECE_NAMES),
+#   bit 20 en passant, bit 21 pawn promotion, bits 22-25 piece promoted to, bit 26 castling.
+# Move objects are only built from the codes when the UI or notation needs them
+PIECE_NAMES = ("--", "wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+PIECE_CODES = {name: i for i, name in enumerate(PIECE_NAMES)}
+SQUARE_MASK = 0xFFF  # start and end square
+ENPASSANT_FLAG = 1 << 20
+PROMOTION_FLAG = 1 << 21
+PROMOTION_SHIFT = 22
+MOVE_ID_MASK = SQUARE_MASK | 15 << PROMOTION_SHIFT  # squares and promotion piece, what two moves are compared by
+PROMOTION_PIECES = ('Q', 'R', 'B', 'N')
+# PROMOTION_CODES[color]: the promotion bits of the four promotions of a pawn of that color
+PROMOTION_CODES = {color: tuple(PROMOTION_FLAG | PIECE_CODES[color + piece] << PROMOTION_SHIFT for piece in PROMOTION_PIECES)
+                   for color in 'wb'}
+CASTLE_FLAG = 1 << 26  # a king move two squares along its rank, the rook moves with it
+# kinds of moves a generator call produces: captures (en passant included) and promotions, the
+# other (quiet) moves, or both
+CAPTURE_MOVES = 1
+QUIET_MOVES = 2
+ALL_MOVES = CAPTURE_MOVES | QUIET_MOVES
+SQUARES = [divmod(sq, 8) for sq in range(64)]  # square number -> (row, col)
+
+# castling rights, one bit each
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+CASTLING_LETTERS = (("K", WHITE_KINGSIDE), ("Q", WHITE_QUEENSIDE), ("k", BLACK_KINGSIDE), ("q", BLACK_QUEENSIDE))
+# CASTLES[color]: (right, column the king ends on, rook start column, rook end column) per side.
+# the rook ends on the square the king passes over
+CASTLES = {'w': ((WHITE_KINGSIDE, 6, 7, 5), (WHITE_QUEENSIDE, 2, 0, 3)),
+           'b': ((BLACK_KINGSIDE, 6, 7, 5), (BLACK_QUEENSIDE, 2, 0, 3))}
+# CASTLING_MASK[square]: the rights left after a move from or to that square (king and rook squares)
+CASTLING_MASK = [15] * 64
+CASTLING_MASK[7 * 8 + 4] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASK[7 * 8 + 7] = 15 & ~WHITE_KINGSIDE
+CASTLING_MASK[7 * 8 + 0] = 15 & ~WHITE_QUEENSIDE
+CASTLING_MASK[0 * 8 + 4] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASK[0 * 8 + 7] = 15 & ~BLACK_KINGSIDE
+CASTLING_MASK[0 * 8 + 0] = 15 & ~BLACK_QUEENSIDE
+
+# lookup tables built once at import so the move generators never do bounds checks.
+# KNIGHT_TARGETS[r][c] / KING_TARGETS[r][c]: squares a knight / king on (r, c) can step to
+# RAYS[r][c][j]: squares from (r, c) to the edge of the board in DIRECTIONS[j], nearest first
+# BETWEEN[r1 * 8 + c1][r2 * 8 + c2]: set of squares (as row * 8 + col) strictly between two squares on a shared line
+def buildTables():
+    def onBoard(r, c):
+        return 0 <= r < 8 and 0 <= c < 8
+
+    knightTargets = [[tuple((r + dr, c + dc) for dr, dc in KNIGHT_STEPS if onBoard(r + dr, c + dc))
+                      for c in range(8)] for r in range(8)]
+    kingTargets = [[tuple((r + dr, c + dc) for dr, dc in DIRECTIONS if onBoard(r + dr, c + dc))
+                    for c in range(8)] for r in range(8)]
+    rays = [[tuple(tuple((r + dr * i, c + dc * i) for i in range(1, 8) if onBoard(r + dr * i, c + dc * i))
+                   for dr, dc in DIRECTIONS) for c in range(8)] for r in range(8)]
+    between = [[frozenset()] * 64 for sq in range(64)]
+    for r in range(8):
+        for c in range(8):
+            row = between[r * 8 + c]
+            for ray in rays[r][c]:
+                squares = [endRow * 8 + endCol for endRow, endCol in ray]
+                for i in range(len(squares)):
+                    row[squares[i]] = frozenset(squares[:i])
+    return knightTargets, kingTargets, rays, between
+
+
+KNIGHT_TARGETS, KING_TARGETS, RAYS, BETWEEN = buildTables()
+# PAWN_ATTACK_TARGETS[color][r][c]: the squares a pawn of that color on (r, c) attacks
+PAWN_ATTACK_TARGETS = {
+    color: [[tuple((r + forward, c + dc) for dc in (-1, 1) if 0 <= r + forward < 8 and 0 <= c + dc < 8)
+             for c in range(8)] for r in range(8)]
+    for color, forward in (('w', -1), ('b', 1))
+}
+# indices into DIRECTIONS each sliding piece moves along, and the index of the reverse direction
+SLIDER_DIRECTIONS = {'R': range(0, 4), 'B': range(4, 8), 'Q': range(0, 8)}
+OPPOSITE = (2, 3, 0, 1, 7, 6, 5, 4)
+
+
+# Zobrist keys: a random 64 bit number per (piece code, square), one for black to move, one
+# per en passant file and one per castling right. a position's key is the xor of the numbers
+# for everything in it.
+# the fixed seed gives every process the same keys, so keys can be stored and compared across runs.
+# the numbers come from splitmix64 rather than the random module, which costs more to import
+# than building every table here
+def buildZobristKeys(seed=0x5EED):
+    state = seed
+    mask = (1 << 64) - 1
+
+    def nextKey():
+        nonlocal state
+        state = (state + 0x9E3779B97F4A7C15) & mask
+        z = state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & mask
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & mask
+        return z ^ (z >> 31)
+
+    pieces = [0] * 64 + [nextKey() for i in range(64 * (len(PIECE_NAMES) - 1))]  # "--" hashes to 0
+    side = nextKey()
+    enPassant = [nextKey() for col in range(8)]
+    rights = [nextKey() for right in range(4)]
+    castling = [0] * 16
+    for mask in range(16):
+        for bit in range(4):
+            if mask & (1 << bit):
+                castling[mask] ^= rights[bit]
+    return pieces, side, enPassant, castling
+
+
+# ZOBRIST_PIECES[pieceCode * 64 + square], ZOBRIST_CASTLING[castling rights]
+ZOBRIST_PIECES, ZOBRIST_BLACK_TO_MOVE, ZOBRIST_EN_PASSANT, ZOBRIST_CASTLING = buildZobristKeys()
+
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+FEN_PIECES = {"P": "wp", "N": "wN", "B": "wB", "R": "wR", "Q": "wQ", "K": "wK",
+              "p": "bp", "n": "bN", "b": "bB", "r": "bR", "q": "bQ", "k": "bK"}
+PIECE_LETTERS = {piece: letter for letter, piece in FEN_PIECES.items()}
+
+
+# create a GameState using the given backend, set up from a FEN string
+# "mailbox" is the plain 8x8 board below, "bitboard" is ChessBitboard.BitboardGameState
+def newGameState(backend="mailbox", fen=START_FEN):
+    if backend == "mailbox":
+        return GameState(fen)
+    if backend == "bitboard":
+        import ChessBitboard  # imported here, ChessBitboard itself imports this module
+        return ChessBitboard.BitboardGameState(fen)
+    raise ValueError("unknown backend '%s', expected one of %s" % (backend, ", ".join(BACKENDS)))
+
 
 class GameState():
-    def __init__(self):
+    def __init__(self, fen=START_FEN):
         # 8x8 board, 2d list, name of piece in 2 characters(color, type)
-        # "--" represents empty block
-        self.board = [
-            ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
-            ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["--", "--", "--", "--", "--", "--", "--", "--"],
-            ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
-            ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"],
-        ]
+        # "--" represents empty block. set up from fen by loadFen below
+        self.board = [["--"] * 8 for r in range(8)]
         self.length = len(self.board)
         self.moveFunction = {
             'p': self.getPawnMoves,
@@ -26,6 +157,12 @@ class GameState():
         }
 
         self.moveLog = []
+        # irreversible state from before every move in moveLog, which undoMove can't work out from
+        # the move code: (en passant square, halfmove clock, castling rights). the captured piece and
+        # the piece moved are part of the code, and putPiece tracks the king squares
+        self.stateLog = []
+        self.checkUnmake = False  # debug mode: undoMove checks the position is exactly the one before makeMove
+        self.unmakeLog = []  # full copies of the position for checkUnmake
         self.whiteToMove = True
         self.whiteKingLocation = (7, 4)  # Tracking kings' location for checking if they are under attack
         self.blackKingLocation = (0, 4)
@@ -38,54 +175,426 @@ class GameState():
         # if (self.pieceMoved =- 'wp' and self.endRow == 0) or (self.pieceMoved == 'bp' and self.endRow == 7):
         #     self.isPawnPromotion = True
         self.enPassantPossible = ()  # coordinates for the square where enpassant capture is possible
+        self.halfmoveClock = 0  # plies since the last capture or pawn move, for the fifty move rule
+        self.fullmoveNumber = 1  # starts at 1 and goes up after every black move, like in FEN
+        self.castlingRights = 0  # WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+        self.moveKinds = ALL_MOVES  # what the piece move functions produce, set by getValidMoveCodes
+        self.attackCounts = {}
+        self.zobristHistory = []  # key of every position in the game so far, the current one last
+        self.loadFen(fen)
+
+    # set up the position from a FEN string: pieces, side to move, castling rights, en passant
+    # square and the move counters. a castling right whose king or rook isn't on its starting
+    # square is dropped. raises ValueError for a malformed string
+    def loadFen(self, fen):
+        fields = fen.split()
+        if len(fields) < 2:
+            raise ValueError("FEN '%s' needs at least the board and the side to move" % fen)
+        ranks = fields[0].split("/")
+        if len(ranks) != 8:
+            raise ValueError("FEN '%s' does not have 8 ranks" % fen)
+        board = []
+        for rank in ranks:
+            row = []
+            for ch in rank:
+                if ch in "12345678":
+                    row.extend(["--"] * int(ch))
+                elif ch in FEN_PIECES:
+                    row.append(FEN_PIECES[ch])
+                else:
+                    raise ValueError("bad character '%s' in FEN '%s'" % (ch, fen))
+            if len(row) != 8:
+                raise ValueError("bad rank '%s' in FEN '%s'" % (rank, fen))
+            board.append(row)
+        kings = [piece for row in board for piece in row if piece[1] == "K"]
+        if sorted(kings) != ["bK", "wK"]:
+            raise ValueError("FEN '%s' needs exactly one king of each color" % fen)
+        if fields[1] not in ("w", "b"):
+            raise ValueError("bad side to move '%s' in FEN '%s'" % (fields[1], fen))
+
+        castlingRights = 0
+        if len(fields) > 2 and fields[2] != "-":
+            for ch in fields[2]:
+                rights = [right for letter, right in CASTLING_LETTERS if letter == ch]
+                if not rights:
+                    raise ValueError("bad castling rights '%s' in FEN '%s'" % (fields[2], fen))
+                castlingRights |= rights[0]
+            for color, row in (('w', 7), ('b', 0)):
+                for right, kingEndCol, rookCol, rookEndCol in CASTLES[color]:
+                    if board[row][4] != color + "K" or board[row][rookCol] != color + "R":
+                        castlingRights &= ~right
+
+        enPassant = ()
+        if len(fields) > 3 and fields[3] != "-":
+            square = fields[3]
+            if len(square) != 2 or square[0] not in Move.filesToCols or square[1] not in ("3", "6"):
+                raise ValueError("bad en passant square '%s' in FEN '%s'" % (square, fen))
+            enPassant = (Move.ranksToRows[square[1]], Move.filesToCols[square[0]])
+        try:
+            halfmoveClock = int(fields[4]) if len(fields) > 4 else 0
+            fullmoveNumber = int(fields[5]) if len(fields) > 5 else 1
+        except ValueError:
+            raise ValueError("bad move counters in FEN '%s'" % fen)
+
+        self.board = board
+        self.whiteToMove = fields[1] == "w"
+        self.castlingRights = castlingRights
+        self.enPassantPossible = enPassant
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = max(fullmoveNumber, 1)
+        self.moveLog = []
+        self.stateLog = []
+        self.unmakeLog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.boardChanged()
+        return self
+
+    # FEN string of the current position
+    def getFen(self):
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                else:
+                    if empty:
+                        rank += str(empty)
+                        empty = 0
+                    rank += PIECE_LETTERS[piece]
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        enPassant = "-"
+        if self.enPassantPossible:
+            r, c = self.enPassantPossible
+            enPassant = Move.colsToFiles[c] + Move.rowsToRanks[r]
+        castling = "".join(letter for letter, right in CASTLING_LETTERS if self.castlingRights & right) or "-"
+        return "%s %s %s %s %d %d" % ("/".join(ranks), "w" if self.whiteToMove else "b", castling, enPassant,
+                                      self.halfmoveClock, self.fullmoveNumber)
+
+    # standard algebraic notation (e4, Nbd7, exd6, e8=Q+, O-O-O#) of a legal move code in the
+    # current position. legal is the list of legal move codes, if the caller already has it.
+    # the check suffix costs a make / generate / undo, check=False leaves it off
+    def moveToSan(self, code, legal=None, check=True):
+        startRow, startCol = SQUARES[code & 63]
+        endRow, endCol = SQUARES[(code >> 6) & 63]
+        piece = PIECE_NAMES[(code >> 12) & 15][1]
+        capture = (code >> 16) & 15 or code & ENPASSANT_FLAG
+        target = Move.colsToFiles[endCol] + Move.rowsToRanks[endRow]
+        if code & CASTLE_FLAG:
+            san = "O-O" if endCol == 6 else "O-O-O"
+        elif piece == 'p':
+            san = (Move.colsToFiles[startCol] + "x" if capture else "") + target
+            if code & PROMOTION_FLAG:
+                san += "=" + PIECE_NAMES[(code >> PROMOTION_SHIFT) & 15][1]
+        else:
+            if legal is None:
+                legal = self.getValidMoveCodes()
+            # the same kind of piece on other squares reaching the same square: name the file if
+            # that tells them apart, else the rank, else both
+            rivals = [SQUARES[other & 63] for other in legal
+                      if other & 0xFFC0 == code & 0xFFC0 and other & 63 != code & 63]
+            disambiguation = ""
+            if rivals:
+                if all(c != startCol for r, c in rivals):
+                    disambiguation = Move.colsToFiles[startCol]
+                elif all(r != startRow for r, c in rivals):
+                    disambiguation = Move.rowsToRanks[startRow]
+                else:
+                    disambiguation = Move.colsToFiles[startCol] + Move.rowsToRanks[startRow]
+            san = piece + disambiguation + ("x" if capture else "") + target
+        if check:
+            # generating moves sets the game end flags, the ones of this position are put back after
+            flags = self.inCheck, self.checkMate, self.staleMate
+            self.makeMove(code)
+            if self.hasLegalMove():
+                san += "+" if self.inCheck else ""
+            else:
+                san += "#" if self.inCheck else ""
+            self.undoMove()
+            self.inCheck, self.checkMate, self.staleMate = flags
+        return san
+
+    # code of the legal move written in standard algebraic notation. accepts the usual variations
+    # seen in game files: check and annotation marks, 0-0 for O-O, e8Q for e8=Q and over
+    # disambiguated moves like Ngf3. raises ValueError for a move that's malformed, illegal or ambiguous
+    def sanToMove(self, san, legal=None):
+        if legal is None:
+            legal = self.getValidMoveCodes()
+        text = san.rstrip("+#!?")
+        if text.replace("0", "O") in ("O-O", "O-O-O"):
+            endCol = 6 if len(text) == 3 else 2
+            matches = [code for code in legal if code & CASTLE_FLAG and (code >> 6) & 7 == endCol]
+        else:
+            promotion = None
+            if "=" in text:
+                text, promotion = text.split("=", 1)
+            elif len(text) > 2 and text[-1] in "QRBNqrbn" and text[-2] in "18":
+                text, promotion = text[:-1], text[-1]
+            if promotion is not None and (len(promotion) != 1 or promotion.upper() not in PROMOTION_PIECES):
+                raise ValueError("bad promotion piece in move '%s'" % san)
+            piece = 'p'
+            if text[:1] in ('N', 'B', 'R', 'Q', 'K'):
+                piece, text = text[0], text[1:]
+            target = text[-2:]
+            if len(target) != 2 or target[0] not in Move.filesToCols or target[1] not in Move.ranksToRows:
+                raise ValueError("bad move '%s'" % san)
+            end = Move.ranksToRows[target[1]] * 8 + Move.filesToCols[target[0]]
+            fromFile = fromRank = None
+            for ch in text[:-2].replace("x", ""):
+                if ch in Move.filesToCols and fromFile is None:
+                    fromFile = Move.filesToCols[ch]
+                elif ch in Move.ranksToRows and fromRank is None:
+                    fromRank = Move.ranksToRows[ch]
+                else:
+                    raise ValueError("bad move '%s'" % san)
+            promoted = PROMOTION_PIECES.index(promotion.upper()) if promotion is not None else None
+            matches = []
+            for code in legal:
+                if (code >> 6) & 63 != end or PIECE_NAMES[(code >> 12) & 15][1] != piece:
+                    continue
+                startRow, startCol = SQUARES[code & 63]
+                if fromFile is not None and startCol != fromFile or fromRank is not None and startRow != fromRank:
+                    continue
+                if code & PROMOTION_FLAG:
+                    if promoted is None or PIECE_NAMES[(code >> PROMOTION_SHIFT) & 15][1] != PROMOTION_PIECES[promoted]:
+                        continue
+                elif promoted is not None:
+                    continue
+                matches.append(code)
+        if not matches:
+            raise ValueError("illegal move '%s'" % san)
+        if len(matches) > 1:
+            raise ValueError("ambiguous move '%s'" % san)
+        return matches[0]
+
+    # called after the board was set up directly instead of through makeMove:
+    # rebuilds the king locations and attack maps from the board and starts a new key history.
+    # backends keeping their own copy of the position rebuild it here instead
+    def boardChanged(self):
+        board = self.board
+        self.zobristHistory = [self.computeZobristKey()]
+        self.attackCounts = {'w': [0] * 64, 'b': [0] * 64}
+        for r in range(8):
+            for c in range(8):
+                piece = board[r][c]
+                if piece != "--":
+                    self.addAttacks(r, c, piece, 1)
+                    if piece == 'wK':
+                        self.whiteKingLocation = (r, c)
+                    elif piece == 'bK':
+                        self.blackKingLocation = (r, c)
+
+    # 64 bit Zobrist key of the current position: pieces, side to move, castling rights and en passant file.
+    # makeMove updates it from the previous key and undoMove drops back to the previous one
+    @property
+    def zobristKey(self):
+        return self.zobristHistory[-1]
+
+    # the key from scratch, for a position set up directly
+    def computeZobristKey(self):
+        key = ZOBRIST_BLACK_TO_MOVE if not self.whiteToMove else 0
+        for r in range(8):
+            for c in range(8):
+                key ^= ZOBRIST_PIECES[PIECE_CODES[self.board[r][c]] * 64 + r * 8 + c]
+        return key ^ ZOBRIST_CASTLING[self.castlingRights] ^ self.enPassantKey()
+
+    # the en passant file only counts when a pawn can actually capture there, so a double
+    # pawn push that allows no capture still transposes to the same position
+    def enPassantKey(self):
+        if not self.enPassantPossible:
+            return 0
+        r, c = self.enPassantPossible
+        pawnRow = r + 1 if self.whiteToMove else r - 1  # row of the pawn that just moved two squares
+        capturer = 'wp' if self.whiteToMove else 'bp'
+        row = self.board[pawnRow]
+        if (c > 0 and row[c - 1] == capturer) or (c < 7 and row[c + 1] == capturer):
+            return ZOBRIST_EN_PASSANT[c]
+        return 0
+
+    # compact picklable copy of the position for sending to another process: the board as a
+    # 64 character string of piece codes, side to move, castling rights, en passant square, move
+    # counters and the key history (for repetition detection). the move log stays behind
+    def snapshot(self):
+        board = ''.join(chr(48 + PIECE_CODES[piece]) for row in self.board for piece in row)
+        return (board, self.whiteToMove, self.castlingRights, self.enPassantPossible, self.halfmoveClock,
+                self.fullmoveNumber, tuple(self.zobristHistory))
+
+    # set the position from a snapshot
+    def loadSnapshot(self, snapshot):
+        board, whiteToMove, castlingRights, enPassant, halfmoveClock, fullmoveNumber, history = snapshot
+        self.board = [[PIECE_NAMES[ord(ch) - 48] for ch in board[r * 8:r * 8 + 8]] for r in range(8)]
+        self.whiteToMove = whiteToMove
+        self.castlingRights = castlingRights
+        self.enPassantPossible = enPassant
+        self.halfmoveClock = halfmoveClock
+        self.fullmoveNumber = fullmoveNumber
+        self.moveLog = []
+        self.stateLog = []
+        self.unmakeLog = []
+        self.checkMate = False
+        self.staleMate = False
+        self.boardChanged()
+        self.zobristHistory = list(history)
+        return self
+
+    # attackCounts[color][r * 8 + c] is the number of pieces of that color attacking (r, c),
+    # counting defended own pieces too. makeMove and undoMove keep them up to date through
+    # removePiece / putPiece, which only touch the moved pieces and the sliders whose rays
+    # run through the changed squares
+
+    # add amount (1 or -1) to every square attacked by piece standing on r, c
+    def addAttacks(self, r, c, piece, amount):
+        counts = self.attackCounts[piece[0]]
+        type = piece[1]
+        if type == 'p':
+            targets = PAWN_ATTACK_TARGETS[piece[0]][r][c]
+        elif type == 'N':
+            targets = KNIGHT_TARGETS[r][c]
+        elif type == 'K':
+            targets = KING_TARGETS[r][c]
+        else:
+            board = self.board
+            rays = RAYS[r][c]
+            for j in SLIDER_DIRECTIONS[type]:
+                for endRow, endCol in rays[j]:
+                    counts[endRow * 8 + endCol] += amount
+                    if board[endRow][endCol] != "--":  # the ray stops at the first piece
+                        break
+            return
+        for endRow, endCol in targets:
+            counts[endRow * 8 + endCol] += amount
+
+    # a piece appeared on (amount -1) or left (amount 1) the square r, c:
+    # sliders looking at the square lose or gain the part of their ray behind it
+    def updateRaysThrough(self, r, c, amount):
+        board = self.board
+        rays = RAYS[r][c]
+        for j in range(8):
+            for endRow, endCol in rays[j]:
+                piece = board[endRow][endCol]
+                if piece != "--":
+                    if j in SLIDER_DIRECTIONS.get(piece[1], ()):
+                        counts = self.attackCounts[piece[0]]
+                        for behindRow, behindCol in rays[OPPOSITE[j]]:
+                            counts[behindRow * 8 + behindCol] += amount
+                            if board[behindRow][behindCol] != "--":
+                                break
+                    break
 
+    # take the piece off r, c, leaving the square empty
+    def removePiece(self, r, c):
+        self.addAttacks(r, c, self.board[r][c], -1)
+        self.board[r][c] = "--"
+        self.updateRaysThrough(r, c, 1)
+
+    # put piece on r, c, replacing whatever stood there
+    def putPiece(self, r, c, piece):
+        previous = self.board[r][c]
+        if previous == "--":
+            self.updateRaysThrough(r, c, -1)
+        else:
+            self.addAttacks(r, c, previous, -1)
+        self.board[r][c] = piece
+        self.addAttacks(r, c, piece, 1)
+        # update king's location if moved
+        if piece == 'wK':
+            self.whiteKingLocation = (r, c)
+        elif piece == 'bK':
+            self.blackKingLocation = (r, c)
+
+    # move is a Move or a move code; the log keeps the move codes
     def makeMove(self, move):
-        self.board[move.endRow][move.endCol] = move.pieceMoved
-        self.board[move.startRow][move.startCol] = "--"
-        self.moveLog.append(move)  # adding it to the list of previous moves
+        code = move if type(move) is int else move.code
+        startRow, startCol = SQUARES[code & 63]
+        endRow, endCol = SQUARES[(code >> 6) & 63]
+        pieceMoved = PIECE_NAMES[(code >> 12) & 15]
+        placed = pieceMoved
+        # pawn promotion: the piece promoted to is part of the move
+        if code & PROMOTION_FLAG:
+            placed = PIECE_NAMES[(code >> PROMOTION_SHIFT) & 15]
+        start = code & 63
+        end = (code >> 6) & 63
+        key = self.zobristHistory[-1] ^ self.enPassantKey() ^ ZOBRIST_BLACK_TO_MOVE ^ \
+            ZOBRIST_PIECES[((code >> 12) & 15) * 64 + start] ^ ZOBRIST_PIECES[PIECE_CODES[placed] * 64 + end]
+        if self.checkUnmake:
+            self.unmakeLog.append(self.positionCopy())
+        rights = self.castlingRights
+        self.stateLog.append((self.enPassantPossible, self.halfmoveClock, rights))
+        self.removePiece(startRow, startCol)
+        if code & ENPASSANT_FLAG:
+            self.removePiece(startRow, endCol)
+            key ^= ZOBRIST_PIECES[((code >> 16) & 15) * 64 + startRow * 8 + endCol]
+        else:
+            key ^= ZOBRIST_PIECES[((code >> 16) & 15) * 64 + end]
+        self.putPiece(endRow, endCol, placed)
+        if code & CASTLE_FLAG:
+            rookCol, rookEndCol = (7, 5) if endCol == 6 else (0, 3)
+            rook = self.board[endRow][rookCol]
+            self.removePiece(endRow, rookCol)
+            self.putPiece(endRow, rookEndCol, rook)
+            key ^= ZOBRIST_PIECES[PIECE_CODES[rook] * 64 + endRow * 8 + rookCol] ^ \
+                ZOBRIST_PIECES[PIECE_CODES[rook] * 64 + endRow * 8 + rookEndCol]
+        if rights:
+            self.castlingRights = rights & CASTLING_MASK[start] & CASTLING_MASK[end]
+            key ^= ZOBRIST_CASTLING[rights] ^ ZOBRIST_CASTLING[self.castlingRights]
+        self.moveLog.append(code)  # adding it to the list of previous moves
         self.whiteToMove = not self.whiteToMove  # swapping the player
-        # update king's location if moved
-        if move.pieceMoved == 'wK':
-            self.whiteKingLocation = (move.endRow, move.endCol)
-        elif move.pieceMoved == 'bK':
-            self.blackKingLocation = (move.endRow, move.endCol)
+        if pieceMoved[1] == 'p' or (code >> 16) & 15:
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+        if self.whiteToMove:
+            self.fullmoveNumber += 1
         # if pawn moves twice, next move can capture enpassant
-        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-            self.enPassantPossible = ((move.endRow + move.startRow)//2, move.endCol)
+        if pieceMoved[1] == 'p' and abs(startRow - endRow) == 2:
+            self.enPassantPossible = ((endRow + startRow)//2, endCol)
+            key ^= self.enPassantKey()
         else:
             self.enPassantPossible = ()
-
-        if move.enPassant:
-            self.board[move.startRow][move.endCol] = '--'
-
-        # # pawn promotion
-        if move.pawnPromotion:
-            promotedPiece = input("Promote to Q, R, B, or N: ")  # later UI part
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + promotedPiece
+        self.zobristHistory.append(key)
 
     '''
     Undo the last move made
     '''
     def undoMove(self):
         if len(self.moveLog) != 0:  # making sure there is atleast 1 move to undo
-            move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            code = self.moveLog.pop()
+            self.zobristHistory.pop()
+            startRow, startCol = SQUARES[code & 63]
+            endRow, endCol = SQUARES[(code >> 6) & 63]
+            pieceMoved = PIECE_NAMES[(code >> 12) & 15]
+            pieceCaptured = PIECE_NAMES[(code >> 16) & 15]
+            enPassant = code & ENPASSANT_FLAG
+            if pieceCaptured == "--" or enPassant:
+                self.removePiece(endRow, endCol)
+            else:
+                self.putPiece(endRow, endCol, pieceCaptured)
+            self.putPiece(startRow, startCol, pieceMoved)  # also takes back a promotion
+            if enPassant:
+                self.putPiece(startRow, endCol, pieceCaptured)  # puts the pawn back on the correct square it was captured from
+            if code & CASTLE_FLAG:
+                rookCol, rookEndCol = (7, 5) if endCol == 6 else (0, 3)
+                rook = self.board[endRow][rookEndCol]
+                self.removePiece(endRow, rookEndCol)
+                self.putPiece(endRow, rookCol, rook)
             self.whiteToMove = not self.whiteToMove
-            # update the king's position if needed
-            if move.pieceMoved == 'wk':
-                self.whiteKingLocation = (move.startRow, move.startCol)
-            elif move.pieceMoved == 'bk':
-                self.blackKingLocation = (move.startRow, move.startCol)
-
-            # if pawn moves twice, next move can capture enpassant
-            if move.enPassant:
-                self.board[move.endRow][move.endCol] = '--'  # removes the pawn that was added in the wrong square
-                self.board[move.startRow][move.endCol] = move.pieceCaptured  # puts the pawn back on the correct square it was captured from
-                self.enPassantPossible = (move.endRow, move.endCol)  # allow an enpassant to happen on the next move
-                # undo a 2 square pawn advance should make enPassantPossible = () again
-                if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2:
-                    self.enPassantPossible = ()
+            if not self.whiteToMove:
+                self.fullmoveNumber -= 1
+            self.enPassantPossible, self.halfmoveClock, self.castlingRights = self.stateLog.pop()
+            if self.checkUnmake:
+                expected = self.unmakeLog.pop()
+                if self.positionCopy() != expected:
+                    raise AssertionError("undoMove of %s did not restore the position:\n%s\n!=\n%s"
+                                         % (Move.codeNotation(code), self.positionCopy(), expected))
+
+    # everything makeMove and undoMove change, for the checkUnmake debug mode
+    def positionCopy(self):
+        return (self.snapshot(), self.whiteKingLocation, self.blackKingLocation,
+                {color: counts[:] for color, counts in self.attackCounts.items()})
 
 
     # All moves considering checks
@@ -96,8 +605,19 @@ class GameState():
     # 4. if king is safe it is valid, add it to list
     # 5. return list of valid moves only
     def getValidMoves(self):
-        moves = []
+        return [Move.fromCode(code) for code in self.getValidMoveCodes()]
+
+    # same as getValidMoves, as compact move codes (see Move) instead of Move objects.
+    # the codes are written into moves when a list is given so callers can reuse one buffer per ply.
+    # kinds (CAPTURE_MOVES, QUIET_MOVES or ALL_MOVES) picks which legal moves are generated; only a
+    # call for all of them can tell checkmate and stalemate apart from "no captures"
+    def getValidMoveCodes(self, moves=None, kinds=ALL_MOVES):
+        if moves is None:
+            moves = []
+        else:
+            del moves[:]
         self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        self.moveKinds = kinds
         if self.whiteToMove:
             kingRow = self.whiteKingLocation[0]
             kingCol = self.whiteKingLocation[1]
@@ -107,66 +627,75 @@ class GameState():
         if self.inCheck:
             # print("incheck")
             if len(self.checks) == 1:  # only 1 check, block check or move king
-                moves = self.getAllPossibleMoves()
-                # to block a check you must move a piece into one of the squares between the enemy squares and the king
-                check = self.checks[0]
-                checkRow = check[0]
-                checkCol = check[1]
-                pieceChecking = self.board[checkRow][checkCol]  # enemy piece causing the check
-                validSquares = []  # squares that the pieces can move to
-                # if knight, must capture knight or move king, other pieces can be blocked
-                if pieceChecking[1] == 'N':
-                    validSquares = [(checkRow, checkCol)]
-                else:
-                    for i in range(1, self.length):
-                        validSquare = (kingRow + check[2] * i, kingCol + check[3] * i)  # check[2] and check[3] are the check directions
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol:  # once you get to a piece and checks
-                            break
-                # get rid of any moves that don't block check or move king
-                for i in range(len(moves)-1, -1, -1): # go through backwards when u r removing from a list as iterating
-                    if moves[i].pieceMoved[1] != 'K':
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])
+                self.getAllPossibleMoves(moves)
+                self.removeMovesLeavingCheck(moves, kingRow, kingCol)
             else:   # double check, king has to move
                 self.getKingMoves(kingRow, kingCol, moves)
         else:
             # print("notincheck")
-            moves = self.getAllPossibleMoves()
+            self.getAllPossibleMoves(moves)
+        self.moveKinds = ALL_MOVES
 
-        if len(moves) == 0:
-            if self.inCheck:
-                self.checkMate = True
-            else:
-                self.staleMate = True
+        if kinds == ALL_MOVES:
+            self.checkMate = len(moves) == 0 and self.inCheck
+            self.staleMate = len(moves) == 0 and not self.inCheck
+        return moves
 
-        else:
-            self.checkMate = False
-            self.staleMate = False
+    # with the king in a single check: keeps the king moves and the moves that capture the checking
+    # piece or block between it and the king, dropping the rest from moves
+    def removeMovesLeavingCheck(self, moves, kingRow, kingCol):
+        check = self.checks[0]
+        checkSquare = check[0] * 8 + check[1]
+        # squares that the pieces can move to: capture the checking piece or block between it and the king
+        # (nothing lies between a checking knight and the king so it can only be captured)
+        validSquares = BETWEEN[kingRow * 8 + kingCol][checkSquare] | {checkSquare}
+        # an en passant capture takes the pawn beside the square it lands on, which may be the checking one
+        kingCode = PIECE_CODES[self.board[kingRow][kingCol]]
+        moves[:] = [m for m in moves if (m >> 12) & 15 == kingCode or (m >> 6) & 63 in validSquares or
+                    m & ENPASSANT_FLAG and (m & 56) | ((m >> 6) & 7) == checkSquare]
+
+    # legal moves in stages, as a generator: captures and promotions first, then quiet moves.
+    # the quiet moves aren't generated until the captures are used up, so a search cutting off on
+    # a capture never pays for them. a stage is generated from the position as it is when the
+    # stage starts, so any move the caller made must be taken back before asking for the next one
+    def generateMoves(self):
+        yield from self.getValidMoveCodes(None, CAPTURE_MOVES)
+        yield from self.getValidMoveCodes(None, QUIET_MOVES)
+
+    # true if the side to move has a legal move: tries the king first, then one piece at a time,
+    # and returns at the first piece that can move instead of building the whole move list.
+    # sets inCheck, checkMate and staleMate like getValidMoveCodes
+    def hasLegalMove(self):
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        moves = []
+        self.getKingMoves(kingRow, kingCol, moves)
+        if not moves and len(self.checks) < 2:  # in double check only the king can move
+            allyColor = 'w' if self.whiteToMove else 'b'
+            board = self.board
+            for r, c in SQUARES:
+                piece = board[r][c]
+                if piece[0] == allyColor and piece[1] != 'K':
+                    self.moveFunction[piece[1]](r, c, moves)
+                    if self.inCheck:
+                        self.removeMovesLeavingCheck(moves, kingRow, kingCol)
+                    if moves:
+                        break
+        self.checkMate = not moves and self.inCheck
+        self.staleMate = not moves and not self.inCheck
+        return len(moves) > 0
 
-        return moves
     '''
     Determine if the enemy can attack the square r, c
     '''
+    def squareUnderAttack(self, r, c):
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        return self.attackCounts[enemyColor][r * 8 + c] > 0
 
-    # def inCheck(self):
-    #     if self.whiteToMove:
-    #         return self.squareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
-    #     else:
-    #         return self.squareUnderAttack(self.whiteKingLocation[0], self.whiteKingLocation[1])
-    #
-    # def squareUnderAttack(self, r, c):
-    #     self.whiteToMove = not self.whiteToMove  # switch to opponent's turn
-    #     oppMoves = self.getAllPossibleMoves()
-    #     self.whiteToMove = not self.whiteToMove  # switch turns back
-    #     for move in oppMoves:
-    #         if move.endRow == r and move.endCol == c:  # means the square is under attack
-    #             return True
-    #     return False
-
-    # All moves with considering checks
-    def getAllPossibleMoves(self):
-        moves = []
+    # All moves with considering checks, as move codes added to moves
+    def getAllPossibleMoves(self, moves=None):
+        if moves is None:
+            moves = []
         # print(self.whiteToMove)
         for r in range(len(self.board)):
             for c in range(len(self.board[r])):
@@ -211,48 +740,42 @@ class GameState():
             startRow = self.blackKingLocation[0]
             startCol = self.blackKingLocation[1]
         # check outward from king for pins and checks, keep track of pins
-        directions = ((-1, 0), (0,  -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            d = directions[j]
+        board = self.board
+        rays = RAYS[startRow][startCol]
+        for j in range(8):
+            d = DIRECTIONS[j]
             possiblePin = ()   # reset possible pin
-            for i in range(1, self.length):
-                endRow = startRow + d[0] * i
-                endCol = startCol + d[1] * i
-                if 0 <= endRow < self.length and 0 <= endCol < self.length:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] == allyColor and endPiece[1] != 'K':
-                        if possiblePin == ():
-                            possiblePin = (endRow, endCol, d[0], d[1])
-                        else:
+            i = 0
+            for endRow, endCol in rays[j]:
+                i += 1
+                endPiece = board[endRow][endCol]
+                if endPiece[0] == allyColor and endPiece[1] != 'K':
+                    if possiblePin == ():
+                        possiblePin = (endRow, endCol, d[0], d[1])
+                    else:
+                        break
+                elif endPiece[0] == enemyColor:
+                    type = endPiece[1]
+                    if (0 <= j <= 3 and type == 'R') or \
+                            (4 <= j <= 7 and type == 'B') or \
+                            (i == 1 and type == 'p' and ((enemyColor == 'w' and 6 <= j <= 7) or (enemyColor == 'b' and 4 <= j <= 5))) or \
+                            (type == 'Q') or (i == 1 and type == 'K'):
+                        if possiblePin == ():  # no piece blocking, so it's a check
+                            inCheck = True
+                            checks.append((endRow, endCol, d[0], d[1]))
                             break
-                    elif endPiece[0] == enemyColor:
-                        type = endPiece[1]
-                        if (0 <= j <= 3 and type == 'R') or \
-                                (4 <= j <= 7 and type == 'B') or \
-                                (i == 1 and type == 'p' and ((enemyColor == 'w' and 6 <= j <= 7) or (enemyColor == 'b' and 4 <= j <= 5))) or \
-                                (type == 'Q') or (i == 1 and type == 'K'):
-                            if possiblePin == ():  # no piece blocking, so it's a check
-                                inCheck = True
-                                checks.append((endRow, endCol, d[0], d[1]))
-                                break
-                            else:        # a piece blocking, that is, a pin
-                                pins.append(possiblePin)
-                                break
-                        else:
+                        else:        # a piece blocking, that is, a pin
+                            pins.append(possiblePin)
                             break
-                else:
-                    break  # off board
+                    else:
+                        break
 
         # check for knight checks
-        knightMoves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        for m in knightMoves:
-            endRow = startRow + m[0]
-            endCol = startCol + m[1]
-            if 0 <= endRow < 8 and 0 <= endCol < 8:
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] == enemyColor and endPiece[1] == 'N': # enemy knight attacking king
-                    inCheck = True
-                    checks.append((endRow, endCol, m[0], m[1]))
+        for endRow, endCol in KNIGHT_TARGETS[startRow][startCol]:
+            endPiece = board[endRow][endCol]
+            if endPiece[0] == enemyColor and endPiece[1] == 'N':  # enemy knight attacking king
+                inCheck = True
+                checks.append((endRow, endCol, endRow - startRow, endCol - startCol))
         return inCheck, pins, checks
 
 
@@ -277,35 +800,60 @@ class GameState():
             startRow = 1
             backRow = 7
             enemyColor = 'w'
-        pawnPromotion = False
+        board = self.board
+        start = r * 8 + c | PIECE_CODES[board[r][c]] << 12
+        endRow = r + moveAmount
+        # if piece gets to back rank then it is a pawn promotion, one move per piece it can become
+        promotions = PROMOTION_CODES[board[r][c][0]] if endRow == backRow else None
 
+        # promotions are generated with the captures
+        kinds = self.moveKinds
         # if self.whiteToMove:  # white pawn's move
-        # print(c, r+moveAmount,)
-        if self.board[r+moveAmount][c] == "--":  # single square pawn advance
-            if not piecePinned or pinDirection == (moveAmount, 0):
-                if r+moveAmount == backRow: #if piece gets to bank rank then it is a pawn promotion
-                    pawnPromotion = True
-                moves.append(Move((r, c), (r+moveAmount, c), self.board, pawnPromotion=pawnPromotion))
-                if r == startRow and self.board[r+2*moveAmount][c] == "--":  # two square pawn advance
-                    moves.append(Move((r, c), (r+2*moveAmount, c), self.board))
-
-        if c-1 >= 0:  # capturing piece to the left
-            if not piecePinned or pinDirection == (moveAmount, -1):
-                if self.board[r+moveAmount][c - 1][0] == enemyColor:
-                    if r + moveAmount == backRow: #if piece gets to bank rank then it is a pawn promotion
-                        pawnPromotion = True
-                    moves.append(Move((r, c), (r+moveAmount, c - 1), self.board, pawnPromotion=pawnPromotion))
-                if(r+moveAmount, c-1) == self.enPassantPossible:
-                    moves.append(Move((r, c), (r+moveAmount, c - 1), self.board, enPassant=True))
-
-        if c + 1 <= 7:  # capturing piece to the right
-            if not piecePinned or pinDirection == (moveAmount, 1):
-                if self.board[r+moveAmount][c + 1][0] == enemyColor:
-                    if r + moveAmount == backRow: #if piece gets to bank rank then it is a pawn promotion
-                        pawnPromotion = True
-                    moves.append(Move((r, c), (r+moveAmount, c + 1), self.board, pawnPromotion=pawnPromotion))
-                if (r+moveAmount, c + 1) == self.enPassantPossible:
-                    moves.append(Move((r, c), (r+moveAmount, c + 1), self.board, enPassant=True))
+        # a pin holds the pawn on the line through its king, which it may move along in either direction
+        if board[endRow][c] == "--":  # single square pawn advance
+            if not piecePinned or pinDirection in ((moveAmount, 0), (-moveAmount, 0)):
+                if promotions:
+                    if kinds & CAPTURE_MOVES:
+                        code = start | (endRow * 8 + c) << 6
+                        moves.extend(code | promotion for promotion in promotions)
+                elif kinds & QUIET_MOVES:
+                    moves.append(start | (endRow * 8 + c) << 6)
+                    if r == startRow and board[r+2*moveAmount][c] == "--":  # two square pawn advance
+                        moves.append(start | ((r + 2 * moveAmount) * 8 + c) << 6)
+
+        for dc in (-1, 1):  # capturing piece to the left, then to the right
+            endCol = c + dc
+            if kinds & CAPTURE_MOVES and 0 <= endCol <= 7 and (not piecePinned or pinDirection in ((moveAmount, dc), (-moveAmount, -dc))):
+                endPiece = board[endRow][endCol]
+                if endPiece[0] == enemyColor:
+                    code = start | (endRow * 8 + endCol) << 6 | PIECE_CODES[endPiece] << 16
+                    if promotions:
+                        moves.extend(code | promotion for promotion in promotions)
+                    else:
+                        moves.append(code)
+                if (endRow, endCol) == self.enPassantPossible and not self.enPassantExposesKing(r, c, endRow, endCol):
+                    moves.append(start | (endRow * 8 + endCol) << 6 | PIECE_CODES[enemyColor + 'p'] << 16 | ENPASSANT_FLAG)
+
+    # an en passant capture takes two pawns off the capturer's rank at once, and the pin check
+    # only sees one of them: true if a slider gets a line onto the king with both gone and the
+    # capturing pawn on its new square
+    def enPassantExposesKing(self, r, c, endRow, endCol):
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        enemyColor = 'b' if self.whiteToMove else 'w'
+        emptied = ((r, c), (r, endCol))
+        for j, ray in enumerate(RAYS[kingRow][kingCol]):
+            sliders = ('R', 'Q') if j < 4 else ('B', 'Q')
+            for square in ray:
+                if square in emptied:
+                    continue
+                if square == (endRow, endCol):
+                    break
+                piece = self.board[square[0]][square[1]]
+                if piece != "--":
+                    if piece[0] == enemyColor and piece[1] in sliders:
+                        return True
+                    break
+        return False
 
     # Get all the moves for rook located at r,c and add them to the list
     def getRookMoves(self, r, c, moves):
@@ -318,24 +866,7 @@ class GameState():
                 if self.board[r][c][1] != 'Q':
                     self.pins.remove(self.pins[i])
                 break
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))  # up, down, left, right
-        enemyColor = 'b' if self.whiteToMove else 'w'
-        for d in directions:
-            for i in range(1, self.length):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow < self.length and 0 <= endCol < self.length:  # inside the board
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == '--':  # empty space
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemyColor:  # enemy piece
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                            break  # can't move ahead of a piece
-                        else:  # own piece
-                            break
-                else:  # outside the board
-                    break
+        self.getSlidingMoves(r, c, 0, piecePinned, pinDirection, moves)  # up, left, down, right
 
     # Get all the moves for knight located at r,c and add them to the list
     def getKnightMoves(self, r, c, moves):
@@ -346,16 +877,17 @@ class GameState():
                 self.pins.remove(self.pins[i])
                 break
 
-        knightMoves = ((-2, 1), (-2, -1), (2, 1), (2, -1), (-1, -2), (-1, 2), (1, -2), (1, 2))
+        if piecePinned:
+            return  # a knight can never move along its pin line
+        board = self.board
         allyColor = "w" if self.whiteToMove else "b"
-        for k in knightMoves:
-            endRow = r + k[0]
-            endCol = c + k[1]
-            if 0 <= endRow < self.length and 0 <= endCol < self.length:  # inside the board
-                if not piecePinned:
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece[0] != allyColor:  # either empty square of opposition's piece
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
+        kinds = self.moveKinds
+        start = r * 8 + c | PIECE_CODES[board[r][c]] << 12
+        for endRow, endCol in KNIGHT_TARGETS[r][c]:
+            endPiece = board[endRow][endCol]
+            # either empty square of opposition's piece, if that kind of move is wanted
+            if endPiece[0] != allyColor and kinds & (QUIET_MOVES if endPiece == '--' else CAPTURE_MOVES):
+                moves.append(start | (endRow * 8 + endCol) << 6 | PIECE_CODES[endPiece] << 16)
 
     # Get all the moves for bishop located at r,c and add them to the list
     def getBishopMoves(self, r, c, moves):
@@ -368,23 +900,30 @@ class GameState():
                 self.pins.remove(self.pins[i])
                 break
 
-        directions = ((-1, -1), (1, -1), (1, 1), (-1, 1))  # top left, bottom left, bottom right, top right
+        self.getSlidingMoves(r, c, 4, piecePinned, pinDirection, moves)  # top left, top right, bottom left, bottom right
+
+    # moves along DIRECTIONS[first:first + 4] for the rook (first = 0) or bishop (first = 4) on r,c
+    def getSlidingMoves(self, r, c, first, piecePinned, pinDirection, moves):
+        board = self.board
         enemyColor = 'b' if self.whiteToMove else 'w'
-        for d in directions:
-            for i in range(1, self.length):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow < self.length and 0 <= endCol < self.length:  # inside the board
-                    if not piecePinned or pinDirection == d or pinDirection == (-d[0], -d[1]):
-                        endPiece = self.board[endRow][endCol]
-                        if endPiece == '--':  # empty space
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                        elif endPiece[0] == enemyColor:  # enemy piece
-                            moves.append(Move((r, c), (endRow, endCol), self.board))
-                            break  # can't move ahead of a piece
-                        else:  # own piece
-                            break
-                else:  # outside the board
+        rays = RAYS[r][c]
+        quiets = self.moveKinds & QUIET_MOVES
+        captures = self.moveKinds & CAPTURE_MOVES
+        start = r * 8 + c | PIECE_CODES[board[r][c]] << 12
+        for j in range(first, first + 4):
+            d = DIRECTIONS[j]
+            if piecePinned and pinDirection != d and pinDirection != (-d[0], -d[1]):
+                continue  # moving off the pin line would expose the king
+            for endRow, endCol in rays[j]:
+                endPiece = board[endRow][endCol]
+                if endPiece == '--':  # empty space
+                    if quiets:
+                        moves.append(start | (endRow * 8 + endCol) << 6)
+                elif endPiece[0] == enemyColor:  # enemy piece
+                    if captures:
+                        moves.append(start | (endRow * 8 + endCol) << 6 | PIECE_CODES[endPiece] << 16)
+                    break  # can't move ahead of a piece
+                else:  # own piece
                     break
 
     # Get all the moves for queen located at r,c and add them to the list
@@ -395,31 +934,35 @@ class GameState():
 
     # Get all the moves for king located at r,c and add them to the list
     def getKingMoves(self, r, c, moves):
-        rowMoves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        colMoves = (-1, 0, 1, -1, 1, -1, 0, 1)
         allyColor = 'w' if self.whiteToMove else 'b'
-        for i in range(self.length):
-            endRow = r + rowMoves[i]
-            endCol = c + colMoves[i]
-            if 0 <= endRow < self.length and 0 <= endCol < self.length:  # inside the board
-                endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor:  # either empty square of opposition's piece
-                    # place king on end square and check fo checks
-                    if allyColor == "w":
-                        self.whiteKingLocation = (endRow, endCol)
-                    else:
-                        self.blackKingLocation = (endRow, endCol)
-                    inCheck, pins, checks = self.checkForPinsAndChecks()
-                    if not inCheck:
-                        moves.append(Move((r,c), (endRow, endCol), self.board))
-                    # place king back on original location
-                    if allyColor == "w":
-                        self.whiteKingLocation = (r, c)
-                    else:
-                        self.blackKingLocation = (r, c)
+        attacked = self.attackCounts['b' if self.whiteToMove else 'w']
+        # the king itself hides the square behind it from a checking slider, so stepping back along the line stays in check
+        behind = [(r - check[2], c - check[3]) for check in self.checks if self.board[check[0]][check[1]][1] in 'RBQ']
+        kinds = self.moveKinds
+        start = r * 8 + c | PIECE_CODES[self.board[r][c]] << 12
+        for endRow, endCol in KING_TARGETS[r][c]:
+            endPiece = self.board[endRow][endCol]
+            # either empty square of opposition's piece, if that kind of move is wanted
+            if endPiece[0] != allyColor and kinds & (QUIET_MOVES if endPiece == '--' else CAPTURE_MOVES):
+                if attacked[endRow * 8 + endCol] == 0 and (endRow, endCol) not in behind:
+                    moves.append(start | (endRow * 8 + endCol) << 6 | PIECE_CODES[endPiece] << 16)
+        if self.castlingRights and not self.inCheck and kinds & QUIET_MOVES:
+            self.getCastleMoves(r, c, start, attacked, moves)
+
+    # castling: the right is still there, the squares between king and rook are empty, and the king
+    # isn't in check (tested by the caller) and neither passes over nor lands on an attacked square
+    def getCastleMoves(self, r, c, start, attacked, moves):
+        row = self.board[r]
+        for right, kingEndCol, rookCol, rookEndCol in CASTLES[row[c][0]]:
+            if self.castlingRights & right and attacked[r * 8 + rookEndCol] == 0 and attacked[r * 8 + kingEndCol] == 0:
+                if all(row[col] == "--" for col in range(min(c, rookCol) + 1, max(c, rookCol))):
+                    moves.append(start | (r * 8 + kingEndCol) << 6 | CASTLE_FLAG)
 
 
+# full move object built from a move code, for the UI and for notation
 class Move():
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured",
+                 "enPassant", "pawnPromotion", "promotionPiece", "castle", "moveID", "code")
     ranksToRows = {
         "1": 7, "2": 6, "3": 5, "4": 4, "5": 3, "6": 2, "7": 1, "8": 0
     }
@@ -429,7 +972,9 @@ class Move():
     }
     colsToFiles = {v: k for k, v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board, enPassant = False, pawnPromotion = False):
+    # promotionPiece is the type ('Q', 'R', 'B' or 'N') a promoting pawn becomes.
+    # a king moving two squares is castling
+    def __init__(self, startSq, endSq, board, enPassant = False, pawnPromotion = False, promotionPiece = 'Q'):
         self.startRow = startSq[0]
         self.startCol = startSq[1]
         self.endRow = endSq[0]
@@ -439,26 +984,72 @@ class Move():
         self.enPassant = enPassant
         # pawn promotion
         self.pawnPromotion = pawnPromotion
+        self.promotionPiece = promotionPiece if pawnPromotion else None
         # self.isPawnPromotion = (self.pieceMoved == 'wp' and self.endRow == 0) or (self.pieceMoved == 'bp' and self.endRow == 7)
 
         # enpassant
         if enPassant:
             self.pieceCaptured = 'bp' if self.pieceMoved == 'wp' else 'wp'  # enpassant captures opposite colored pawn
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
-        # print(self.moveID)
+        self.code = (self.startRow * 8 + self.startCol) | (self.endRow * 8 + self.endCol) << 6 | \
+            PIECE_CODES[self.pieceMoved] << 12 | PIECE_CODES[self.pieceCaptured] << 16
+        if enPassant:
+            self.code |= ENPASSANT_FLAG
+        if pawnPromotion:
+            self.code |= PROMOTION_FLAG | PIECE_CODES[self.pieceMoved[0] + promotionPiece] << PROMOTION_SHIFT
+        self.castle = self.pieceMoved[1:] == 'K' and abs(self.endCol - self.startCol) == 2
+        if self.castle:
+            self.code |= CASTLE_FLAG
+        self.moveID = self.code & MOVE_ID_MASK
+
+    # Move for a move code, without looking at the board
+    @classmethod
+    def fromCode(cls, code):
+        move = cls.__new__(cls)
+        move.startRow, move.startCol = SQUARES[code & 63]
+        move.endRow, move.endCol = SQUARES[(code >> 6) & 63]
+        move.pieceMoved = PIECE_NAMES[(code >> 12) & 15]
+        move.pieceCaptured = PIECE_NAMES[(code >> 16) & 15]
+        move.enPassant = code & ENPASSANT_FLAG != 0
+        move.pawnPromotion = code & PROMOTION_FLAG != 0
+        move.promotionPiece = PIECE_NAMES[(code >> PROMOTION_SHIFT) & 15][1] if move.pawnPromotion else None
+        move.castle = code & CASTLE_FLAG != 0
+        move.moveID = code & MOVE_ID_MASK
+        move.code = code
+        return move
 
     # overriding the equals method
+    # a Move also equals the code of the same move
     def __eq__(self, other):
         if isinstance(other, Move):
             return self.moveID == other.moveID
+        if isinstance(other, int):
+            return self.moveID == other & MOVE_ID_MASK
         return False
 
-    def getChessNotation(self):
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+    def __hash__(self):
+        return self.moveID
+
+    # start and end square, followed by the piece promoted to in lower case for promotions (e7e8q)
+    # coordinate notation (e2e4, e7e8q), or standard algebraic notation when given the GameState
+    # the move is about to be played in
+    def getChessNotation(self, gs=None):
+        if gs is not None:
+            return gs.moveToSan(self.code)
+        return Move.codeNotation(self.code)
 
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
 
+    # getChessNotation for a move code
+    @staticmethod
+    def codeNotation(code):
+        startRow, startCol = SQUARES[code & 63]
+        endRow, endCol = SQUARES[(code >> 6) & 63]
+        notation = Move.colsToFiles[startCol] + Move.rowsToRanks[startRow] + Move.colsToFiles[endCol] + Move.rowsToRanks[endRow]
+        if code & PROMOTION_FLAG:
+            notation += PIECE_NAMES[(code >> PROMOTION_SHIFT) & 15][1].lower()
+        return notation
+
 
 # isPawnPromotion became pawnPromotion
 # isEnpassantMove became enPassant from the 8th YT video
\ No newline at end of file
@@ -0,0 +1,86 @@
+# streaming reader for EPD / FEN position files
+# one position per line, read lazily so files with millions of positions never sit in memory.
+# a line is a FEN string (4 to 6 fields) optionally followed by EPD operations separated by ';',
+# e.g.   rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - bm e4; id "start";
+# or the perft suite style   8/8/8/8/8/8/8/K6k w - - 0 1 ;D1 3 ;D2 9
+# blank lines and lines starting with '#' are skipped. files ending in .gz are decompressed on the fly
+
+import ChessEngine
+
+
+# (fen, operations) for one line, or None for a blank or comment line.
+# operations maps every EPD opcode to its operands as one string, quotes removed.
+# raises ValueError when the line doesn't start with a FEN
+def parseEpdLine(line):
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("expected at least 4 FEN fields in '%s'" % line)
+    fen = fields[:4]
+    rest = fields[4] if len(fields) > 4 else ""
+    # FEN move counters, if the line has them, come before any operation
+    counters = rest.split(None, 2)
+    if len(counters) >= 2 and counters[0].isdigit() and counters[1].isdigit():
+        fen += counters[:2]
+        rest = counters[2] if len(counters) > 2 else ""
+    return " ".join(fen), parseOperations(rest)
+
+
+def parseOperations(text):
+    operations = {}
+    operation = ""
+    quoted = False
+    for ch in text + ";":
+        if ch == '"':
+            quoted = not quoted
+        elif ch == ";" and not quoted:
+            words = operation.split(None, 1)
+            if words:
+                operations[words[0]] = words[1].strip() if len(words) > 1 else ""
+            operation = ""
+        else:
+            operation += ch
+    return operations
+
+
+def openSource(source):
+    if source.endswith(".gz"):
+        import gzip
+        return gzip.open(source, "rt")
+    return open(source)
+
+
+# generator of (line number, fen, operations) for every position in source, a path or an open
+# text file. with strict=False malformed lines are skipped instead of raising ValueError
+def readPositions(source, strict=True):
+    f = openSource(source) if isinstance(source, str) else source
+    try:
+        for number, line in enumerate(f, 1):
+            try:
+                record = parseEpdLine(line)
+            except ValueError as e:
+                if strict:
+                    raise ValueError("line %d: %s" % (number, e))
+                continue
+            if record is not None:
+                yield number, record[0], record[1]
+    finally:
+        if f is not source:
+            f.close()
+
+
+# generator of (line number, gs, operations) with the positions of source loaded into one reused
+# GameState, which is only valid until the next position is read.
+# positions the engine can't load are skipped when strict is False
+def readGameStates(source, backend="mailbox", strict=True):
+    gs = ChessEngine.newGameState(backend)
+    for number, fen, operations in readPositions(source, strict):
+        try:
+            gs.loadFen(fen)
+        except ValueError as e:
+            if strict:
+                raise ValueError("line %d: %s" % (number, e))
+            continue
+        yield number, gs, operations
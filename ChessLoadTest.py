@@ -0,0 +1,99 @@
+# load test for ChessServer: N concurrent sessions each play random legal moves and time every
+# "move" round trip, then the p50 / p99 move validation latency is reported.
+# runs the server in the same process on a free port unless --port points at a running one
+#
+#   python ChessLoadTest.py --sessions 500 --moves 40
+
+import asyncio
+import random
+import sys
+import time
+
+import ChessServer
+from ChessStats import percentile
+
+
+# one client session: plays moves random legal moves (restarting the game when it ends) and
+# returns the latency of every move command in seconds and the session's memory at the end
+async def playSession(host, port, moves, rng, engineEvery, engineMs):
+    reader, writer = await asyncio.open_connection(host, port)
+    latencies = []
+    try:
+        await reader.readline()  # ok session <id>
+
+        async def command(line):
+            writer.write((line + "\n").encode())
+            await writer.drain()
+            return (await reader.readline()).decode().split()
+
+        for i in range(moves):
+            if engineEvery and i % engineEvery == engineEvery - 1:
+                reply = await command("engine %d" % engineMs)
+            else:
+                legal = (await command("moves"))[1:]
+                if not legal:
+                    await command("new")
+                    continue
+                start = time.perf_counter()
+                reply = await command("move " + rng.choice(legal))
+                latencies.append(time.perf_counter() - start)
+            if reply[0] != "ok":
+                raise RuntimeError("server answered " + " ".join(reply))
+            if reply[-1] in ("checkmate", "stalemate"):
+                await command("new")
+        memory = int((await command("memory"))[1])
+        await command("quit")
+    finally:
+        writer.close()
+    return latencies, memory
+
+
+async def run(args):
+    server = None
+    host, port = args.host, args.port
+    if port is None:
+        server = ChessServer.ChessServer(args.backend)
+        port = await server.start(host, 0)
+    try:
+        rng = random.Random(args.seed)
+        start = time.perf_counter()
+        sessions = [playSession(host, port, args.moves, random.Random(rng.random()), args.engine_every, args.engine_ms)
+                    for i in range(args.sessions)]
+        results = await asyncio.gather(*sessions)
+        seconds = time.perf_counter() - start
+    finally:
+        if server is not None:
+            await server.close()
+
+    latencies = [latency for result, memory in results for latency in result]
+    memory = [memory for result, memory in results]
+    print("%d sessions, %d moves validated in %.2fs (%d moves/s)"
+          % (args.sessions, len(latencies), seconds, len(latencies) / seconds if seconds > 0 else 0))
+    print("move latency p50 %.2f ms  p99 %.2f ms  max %.2f ms"
+          % (percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000,
+             max(latencies) * 1000 if latencies else 0))
+    print("session memory mean %d bytes  max %d bytes  total %.1f MB"
+          % (sum(memory) / len(memory), max(memory), sum(memory) / 1024.0 / 1024.0))
+    return 0
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="concurrent session load test for ChessServer")
+    parser.add_argument("--sessions", type=int, default=200, help="concurrent sessions")
+    parser.add_argument("--moves", type=int, default=40, help="moves played per session")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=None, help="port of a running server (default: start one here)")
+    parser.add_argument("--backend", choices=ChessServer.ChessEngine.BACKENDS, default="mailbox",
+                        help="backend of the server started here")
+    parser.add_argument("--engine-every", type=int, default=0,
+                        help="ask for an engine reply instead of a move every N moves (0: never)")
+    parser.add_argument("--engine-ms", type=int, default=50, help="engine thinking time per reply")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
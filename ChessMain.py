@@ -2,14 +2,26 @@
 # user input and current gameState
 
 import pygame as p
+import ChessBook
 import ChessEngine
+import ChessSearch
 
 # from Chess import ChessEngine
 
 WIDTH = HEIGHT = 512
 DIMENSION = 8  # 8*8
 SQ_SIZE = HEIGHT // DIMENSION
-MAX_FPS = 15  # for animation
+BACKEND = "mailbox"  # position backend behind GameState, one of ChessEngine.BACKENDS
+PLAYER_ONE = True  # white is played by a human if True, by the computer if False
+PLAYER_TWO = False  # same for black
+AI_TIME_MS = 1000  # thinking time per computer move
+HASH_MB = 16  # memory cap of the computer's transposition table
+BOOK_PATH = "book.bin"  # opening book the computer plays from while it has moves (see ChessBook), if the file exists
+BOARD_COLORS = ("white", "gray")  # light and dark squares
+HIGHLIGHT_COLORS = {"selected": "blue", "lastMove": "yellow"}
+HIGHLIGHT_ALPHA = 90  # 0 transparent to 255 opaque
+# the only events the main loop wakes up for, everything else (mouse motion above all) is dropped
+EVENTS = (p.QUIT, p.MOUSEBUTTONDOWN, p.KEYDOWN, p.VIDEOEXPOSE, p.WINDOWEXPOSED)
 IMAGES = {}
 
 
@@ -17,30 +29,53 @@ IMAGES = {}
 def loadImages():
     pieces = ["wp", "wR", "wN", "wB", "wK", "wQ", "bp", "bR", "bN", "bB", "bK", "bQ"]
     for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
+        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE)).convert_alpha()
 
 
 # main driver. handles user input and graphics
+# nothing is drawn on a timer: the loop sleeps in p.event.wait() until the player does something,
+# and only the squares that changed since the last frame are redrawn
 def main():
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))
-    clock = p.time.Clock()
-    screen.fill(p.Color("white"))
-    gs = ChessEngine.GameState()
+    p.event.set_blocked(None)
+    p.event.set_allowed(EVENTS)
+    gs = ChessEngine.newGameState(BACKEND)
     validMoves = gs.getValidMoves()
     moveMade = False  # flag variable when move is made
+    searcher = ChessSearch.Searcher(HASH_MB)  # kept for the whole game so its table is reused
+    searcher.book = ChessBook.openBook(BOOK_PATH)
 
     loadImages()  # only doing it once, before while loop
+    renderer = BoardRenderer(screen)
     running = True
     sqSelected = ()  # no square is selected initially. keeps track of last click made by the user (row, col)
     playerClicks = []  # keep tracks of the player clicks
     while running:
-        for e in p.event.get():
+        humanTurn = (gs.whiteToMove and PLAYER_ONE) or (not gs.whiteToMove and PLAYER_TWO)
+        renderer.update(gs, sqSelected)
+
+        # computer move, after the human's move is on screen
+        if not humanTurn and validMoves:
+            move = searcher.search(gs, AI_TIME_MS).getMove()
+            if move is None:
+                move = validMoves[0]
+            gs.makeMove(move)
+            validMoves = gs.getValidMoves()
+            p.event.get(p.MOUSEBUTTONDOWN)  # clicks made while it was thinking don't count
+            if p.event.get((p.VIDEOEXPOSE, p.WINDOWEXPOSED)):
+                renderer.invalidate()
+            running = not p.event.peek(p.QUIT)
+            continue
+
+        for e in [p.event.wait()] + p.event.get():
             if e.type == p.QUIT:
                 running = False
+            elif e.type in (p.VIDEOEXPOSE, p.WINDOWEXPOSED):
+                renderer.invalidate()  # the window was covered, nothing on screen can be trusted
             # mouse handler
-            elif e.type == p.MOUSEBUTTONDOWN:
-                location = p.mouse.get_pos()  # (x,y location of mouse)
+            elif e.type == p.MOUSEBUTTONDOWN and humanTurn:
+                location = e.pos  # (x,y location of mouse) when the button went down
                 col = location[0] // SQ_SIZE
                 row = location[1] // SQ_SIZE
                 if sqSelected == (row, col):  # user clicked same square twice
@@ -51,14 +86,17 @@ def main():
                     playerClicks.append(sqSelected)  # appends both 1st and 2nd clicks
                 if len(playerClicks) == 2:  # after 2nd click
                     move = ChessEngine.Move(playerClicks[0], playerClicks[1], gs.board)
-                    print(move.getChessNotation())
-                    for i in range(len(validMoves)):
-                        if move == validMoves[i]:
-                            gs.makeMove(validMoves[i])
-                            moveMade = True
-                            sqSelected = ()  # reset the user click
-                            playerClicks = []
-                            # break
+                    # valid moves between the two squares: one, or one per piece for a promotion
+                    candidates = [m for m in validMoves if m.moveID & ChessEngine.SQUARE_MASK == move.moveID]
+                    if candidates and candidates[0].pawnPromotion:
+                        piece = choosePromotion(screen, renderer, gs, candidates[0])
+                        candidates = [m for m in candidates if m.promotionPiece == piece]
+                    if candidates:
+                        print(candidates[0].getChessNotation(gs))
+                        gs.makeMove(candidates[0])
+                        moveMade = True
+                        sqSelected = ()  # reset the user click
+                        playerClicks = []
                     if not moveMade:
                         playerClicks = [sqSelected]
             # key handlers
@@ -66,37 +104,100 @@ def main():
                 if e.key == p.K_z: # undo when z is pressed
                     gs.undoMove()
                     moveMade = True
+
         if moveMade:
             validMoves = gs.getValidMoves()
             moveMade = False
 
-        drawGameState(screen, gs)
-        clock.tick(MAX_FPS)
-        p.display.flip()
-
-
-# Responsible for graphics within current game state
-def drawGameState(screen, gs):
-    drawBoard(screen)  # draw square on the board
-    drawPieces(screen, gs.board)  # draw pieces on top of those squares
 
-
-# drawing the squares on the board
-def drawBoard(screen):
-    colors = [p.Color("white"), p.Color("gray")]
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            color = colors[(r + c) % 2]
-            p.draw.rect(screen, color, p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-
-# drawing the pieces on the board using current game state
-def drawPieces(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != "--":  # not empty square
-                screen.blit(IMAGES[piece], p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE))
+# promotion picker: shows the pieces a pawn can promote to in the column of its target square,
+# starting from the promotion square, and waits for a click on one of them.
+# returns the piece type ('Q', 'R', 'B' or 'N'), or None if the player clicks elsewhere or presses Escape
+def choosePromotion(screen, renderer, gs, move):
+    color = move.pieceMoved[0]
+    step = 1 if move.endRow == 0 else -1  # the column of choices grows away from the edge of the board
+    squares = [(move.endRow + i * step, move.endCol) for i in range(len(ChessEngine.PROMOTION_PIECES))]
+    rects = [p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE) for r, c in squares]
+    try:
+        while True:
+            renderer.update(gs, (move.startRow, move.startCol))
+            for rect, piece in zip(rects, ChessEngine.PROMOTION_PIECES):
+                p.draw.rect(screen, p.Color("light yellow"), rect)
+                p.draw.rect(screen, p.Color("dark gray"), rect, 1)
+                screen.blit(IMAGES[color + piece], rect)
+            p.display.update(rects)
+            e = p.event.wait()
+            if e.type == p.QUIT:
+                p.event.post(e)  # let the main loop close the window
+                return None
+            if e.type == p.KEYDOWN and e.key == p.K_ESCAPE:
+                return None
+            if e.type == p.MOUSEBUTTONDOWN:
+                x, y = e.pos
+                square = (y // SQ_SIZE, x // SQ_SIZE)
+                if square in squares:
+                    return ChessEngine.PROMOTION_PIECES[squares.index(square)]
+                return None
+            renderer.invalidate()  # exposed, draw it all again
+    finally:
+        renderer.invalidate(squares)  # the picker covered these squares
+
+
+# draws the board into the window, touching only the squares whose piece or highlight changed.
+# the empty board is rendered once into its own surface and every redrawn square is copied from
+# it, so a frame costs a few blits and p.display.update of their rectangles
+class BoardRenderer():
+    def __init__(self, screen):
+        self.screen = screen
+        self.rects = [p.Rect(c * SQ_SIZE, r * SQ_SIZE, SQ_SIZE, SQ_SIZE)
+                      for r in range(DIMENSION) for c in range(DIMENSION)]
+        self.board = p.Surface(screen.get_size()).convert()
+        colors = [p.Color(name) for name in BOARD_COLORS]
+        for sq, rect in enumerate(self.rects):
+            self.board.fill(colors[(sq // DIMENSION + sq % DIMENSION) % 2], rect)
+        self.highlights = {}
+        for name, color in HIGHLIGHT_COLORS.items():
+            overlay = p.Surface((SQ_SIZE, SQ_SIZE)).convert()
+            overlay.fill(p.Color(color))
+            overlay.set_alpha(HIGHLIGHT_ALPHA)
+            self.highlights[name] = overlay
+        self.shown = [None] * (DIMENSION * DIMENSION)  # (piece, highlight) on screen per square, None if unknown
+
+    # forget what is on screen for the given (row, col) squares, or all of them, so update redraws them
+    def invalidate(self, squares=None):
+        if squares is None:
+            self.shown = [None] * (DIMENSION * DIMENSION)
+        else:
+            for r, c in squares:
+                if 0 <= r < DIMENSION and 0 <= c < DIMENSION:
+                    self.shown[r * DIMENSION + c] = None
+
+    # bring the window up to date with the position, the selected square and the last move
+    def update(self, gs, selected=()):
+        highlight = {}
+        if gs.moveLog:
+            code = gs.moveLog[-1]
+            highlight[code & 63] = highlight[(code >> 6) & 63] = "lastMove"
+        if selected:
+            highlight[selected[0] * DIMENSION + selected[1]] = "selected"
+        screen = self.screen
+        dirty = []
+        sq = 0
+        for row in gs.board:
+            for piece in row:
+                state = (piece, highlight.get(sq))
+                if self.shown[sq] != state:
+                    rect = self.rects[sq]
+                    screen.blit(self.board, rect, rect)
+                    if state[1] is not None:
+                        screen.blit(self.highlights[state[1]], rect)
+                    if piece != "--":
+                        screen.blit(IMAGES[piece], rect)
+                    self.shown[sq] = state
+                    dirty.append(rect)
+                sq += 1
+        if dirty:
+            p.display.update(dirty)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,290 @@
+# self-play match between two engine configurations, for telling whether an engine change helps.
+# games are played headless on GameState over a process pool. every opening (a few random plies
+# from the start, or the positions of an EPD file) is played twice with the colors swapped.
+# a game ends in checkmate or stalemate, or is drawn by threefold repetition, the fifty move rule,
+# insufficient material or reaching --max-plies. results stream to JSON lines and / or PGN as the
+# games finish, and the run ends with games/s, the engines' move time percentiles and the Elo
+# difference of the first engine with its 95% error bars.
+#
+#   python ChessMatch.py --games 1000 --engine1 "name=new,time=50" --engine2 "name=old,time=50,hash=4"
+#       --random-plies 6 --out results.jsonl --pgn games.pgn
+#
+# engine options, comma separated key=value: name, time (ms per move), depth, nodes, hash (MB),
+# book (ChessBook file)
+
+import concurrent.futures
+import json
+import math
+import os
+import random
+import sys
+import time
+
+import ChessEngine
+import ChessPgn
+import ChessSearch
+from ChessStats import percentile
+
+DEFAULT_TIME_MS = 50
+MAX_PLIES = 400  # game length after which a game is adjudicated a draw
+GAMES_IN_FLIGHT = 2  # games per worker submitted ahead of the results written
+ENGINE_OPTIONS = {"name": str, "time": int, "depth": int, "nodes": int, "hash": float, "book": str}
+
+# state of a match worker process
+worker = {}
+
+
+# engine configuration of an option string like "name=new,time=50,depth=6"
+def parseEngine(spec, name):
+    engine = {"name": name, "time": DEFAULT_TIME_MS, "depth": ChessSearch.MAX_DEPTH, "nodes": None,
+              "hash": 16, "book": None}
+    for option in filter(None, (option.strip() for option in spec.split(","))):
+        key, equals, value = option.partition("=")
+        if not equals or key not in ENGINE_OPTIONS:
+            raise ValueError("bad engine option '%s', expected one of %s as key=value"
+                             % (option, ", ".join(ENGINE_OPTIONS)))
+        engine[key] = ENGINE_OPTIONS[key](value)
+    return engine
+
+
+# true when neither side can ever checkmate: bare kings, a single minor piece, or bishops that
+# all stand on squares of one color
+def insufficientMaterial(board):
+    pieces = [(piece, r, c) for r, row in enumerate(board) for c, piece in enumerate(row) if piece[1] not in "-K"]
+    if not pieces:
+        return True
+    if len(pieces) == 1 and pieces[0][0][1] in "NB":
+        return True
+    return all(piece[1] == "B" for piece, r, c in pieces) and len({(r + c) % 2 for piece, r, c in pieces}) == 1
+
+
+# (result, reason) when the game on gs is over, None while it goes on
+def gameOver(gs, maxPlies):
+    if not gs.hasLegalMove():
+        if gs.inCheck:
+            return ("0-1" if gs.whiteToMove else "1-0"), "checkmate"
+        return "1/2-1/2", "stalemate"
+    if gs.zobristHistory.count(gs.zobristKey) >= 3:
+        return "1/2-1/2", "repetition"
+    if gs.halfmoveClock >= 100:
+        return "1/2-1/2", "fifty moves"
+    if insufficientMaterial(gs.board):
+        return "1/2-1/2", "insufficient material"
+    if len(gs.moveLog) >= maxPlies:
+        return "1/2-1/2", "max plies"
+    return None
+
+
+# the searcher of engine in this worker, one per engine kept between games; its transposition
+# table is cleared for every game so games don't depend on which worker played them
+def workerSearcher(index, engine):
+    searchers = worker.setdefault("searchers", {})
+    if index not in searchers:
+        searcher = ChessSearch.Searcher(engine["hash"])
+        if engine["book"]:
+            import ChessBook
+
+            searcher.book = ChessBook.OpeningBook(engine["book"])
+        searchers[index] = searcher
+    return searchers[index]
+
+
+# runs in a worker: plays one game, engines (white, black) as (index, configuration) pairs,
+# from fen after the opening move codes. returns its record, with the move times in seconds
+def playGame(number, fen, opening, white, black, backend, maxPlies):
+    start = time.perf_counter()
+    gs = ChessEngine.newGameState(backend, fen)
+    for code in opening:
+        gs.makeMove(code)
+    players = {True: white, False: black}
+    for index, engine in players.values():
+        workerSearcher(index, engine).table.clear()
+    moveSeconds = {white[0]: [], black[0]: []}
+    while True:
+        over = gameOver(gs, maxPlies)
+        if over is not None:
+            break
+        index, engine = players[gs.whiteToMove]
+        searcher = workerSearcher(index, engine)
+        moveStart = time.perf_counter()
+        move = searcher.search(gs, engine["time"], engine["depth"], engine["nodes"]).move
+        moveSeconds[index].append(time.perf_counter() - moveStart)
+        gs.makeMove(move)
+    result, reason = over
+    return {"game": number, "white": white[1]["name"], "black": black[1]["name"], "whiteEngine": white[0],
+            "result": result, "reason": reason, "plies": len(gs.moveLog), "fen": fen,
+            "openingPlies": len(opening), "moves": ChessPgn.gameMoves(gs),
+            "seconds": time.perf_counter() - start, "moveSeconds": moveSeconds}
+
+
+# generator of (fen, opening move codes) pairs: randomPlies random legal moves from fen, or
+# the positions of an EPD file in turn (with no moves) when epd is given
+def openings(rng, randomPlies, epd=None, backend="mailbox"):
+    if epd is not None:
+        import ChessEpd
+
+        fens = [fen for number, fen, operations in ChessEpd.readPositions(epd)]
+        if not fens:
+            raise ValueError("no positions in " + epd)
+        while True:
+            for fen in fens:
+                yield fen, []
+    gs = ChessEngine.newGameState(backend)
+    while True:
+        gs.loadFen(ChessEngine.START_FEN)
+        moves = []
+        while len(moves) < randomPlies:
+            legal = gs.getValidMoveCodes()
+            if not legal:
+                break
+            moves.append(rng.choice(legal))
+            gs.makeMove(moves[-1])
+        if len(moves) == randomPlies and gs.hasLegalMove():
+            yield ChessEngine.START_FEN, moves
+
+
+# (Elo difference, 95% error margin) of a score of wins, draws and losses, from the mean score
+# and its standard error. the margin is None when the score is 0 or 1 and the difference infinite
+def eloDifference(wins, draws, losses):
+    games = wins + draws + losses
+    if not games:
+        return 0.0, None
+    score = (wins + draws / 2.0) / games
+
+    def elo(score):
+        return -400.0 * math.log10(1.0 / score - 1.0)
+
+    if score <= 0 or score >= 1:
+        return (math.inf if score >= 1 else -math.inf), None
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    low, high = max(score - margin, 1e-6), min(score + margin, 1 - 1e-6)
+    return elo(score) + 0.0, (elo(high) - elo(low)) / 2  # + 0.0: an even score reads 0, not -0
+
+
+# play games between engines[0] and engines[1] over workers processes (0: in this process),
+# writing every record to out (JSON lines) and pgn as it finishes. returns the summary
+def runMatch(engines, games, workers=None, randomPlies=6, epd=None, seed=1, backend="mailbox",
+             maxPlies=MAX_PLIES, out=None, pgn=None, progress=None):
+    rng = random.Random(seed)
+    source = openings(rng, randomPlies, epd, backend)
+    scores = [0, 0, 0]  # wins, draws, losses of engines[0]
+    reasons = {}
+    moveSeconds = ([], [])
+    plies = 0
+    start = time.perf_counter()
+
+    def tasks():
+        for number in range(1, games + 1):
+            if number % 2:
+                fen, opening = next(source)
+            first = (0, engines[0]), (1, engines[1])
+            white, black = first if number % 2 else first[::-1]  # the second game of a pair swaps colors
+            yield number, fen, opening, white, black, backend, maxPlies
+
+    def record(game):
+        nonlocal plies
+        points = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5}[game["result"]]
+        if game["whiteEngine"] != 0:
+            points = 1.0 - points
+        scores[{1.0: 0, 0.5: 1, 0.0: 2}[points]] += 1
+        reasons[game["reason"]] = reasons.get(game["reason"], 0) + 1
+        for index, seconds in game["moveSeconds"].items():
+            moveSeconds[int(index)].extend(seconds)
+        plies += game["plies"]
+        if out is not None:
+            out.write(json.dumps(game) + "\n")
+            out.flush()
+        if pgn is not None:
+            headers = {"Event": "ChessMatch", "Round": game["game"], "White": game["white"],
+                       "Black": game["black"], "Termination": game["reason"]}
+            pgn.write(ChessPgn.gameToPgn(headers, game["moves"], game["result"], game["fen"]) + "\n")
+            pgn.flush()
+        if progress is not None:
+            done = sum(scores)
+            progress.write("game %d/%d %s %s (%s)  +%d =%d -%d\n"
+                           % (done, games, game["result"], game["reason"], "%s-%s" % (game["white"], game["black"]),
+                              scores[0], scores[1], scores[2]))
+            progress.flush()
+
+    if workers == 0:
+        for task in tasks():
+            record(playGame(*task))
+    else:
+        workers = workers or os.cpu_count() or 1
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            pending = set()
+            for task in tasks():
+                while len(pending) >= workers * GAMES_IN_FLIGHT:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        record(future.result())
+                pending.add(pool.submit(playGame, *task))
+            for future in concurrent.futures.as_completed(pending):
+                record(future.result())
+
+    seconds = time.perf_counter() - start
+    elo, margin = eloDifference(*scores)
+    return {"games": sum(scores), "wins": scores[0], "draws": scores[1], "losses": scores[2],
+            "elo": elo, "eloMargin": margin, "reasons": reasons, "seconds": seconds, "plies": plies,
+            "gamesPerSecond": sum(scores) / seconds if seconds > 0 else 0.0,
+            "moveMs": [{"p50": percentile(times, 0.5) * 1000, "p90": percentile(times, 0.9) * 1000,
+                        "p99": percentile(times, 0.99) * 1000, "max": max(times, default=0) * 1000,
+                        "moves": len(times)} for times in moveSeconds]}
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="self-play match between two engine configurations")
+    parser.add_argument("--games", type=int, default=100, help="games played, in pairs with the colors swapped")
+    parser.add_argument("--engine1", default="", help="options of the first engine, like name=new,time=50")
+    parser.add_argument("--engine2", default="", help="options of the second engine")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="processes playing games (default: one per CPU, 0: play in this process)")
+    parser.add_argument("--random-plies", type=int, default=6, help="random plies every opening starts with")
+    parser.add_argument("--epd", metavar="PATH", help="take the openings from the positions of an EPD file instead")
+    parser.add_argument("--max-plies", type=int, default=MAX_PLIES, help="game length adjudicated a draw")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the random openings")
+    parser.add_argument("--backend", choices=ChessEngine.BACKENDS, default="mailbox",
+                        help="position backend behind GameState")
+    parser.add_argument("--out", metavar="PATH", help="JSON line per game, written as games finish")
+    parser.add_argument("--pgn", metavar="PATH", help="PGN of every game, written as games finish")
+    parser.add_argument("--quiet", action="store_true", help="no line per finished game")
+    args = parser.parse_args(argv)
+    try:
+        engines = (parseEngine(args.engine1, "engine1"), parseEngine(args.engine2, "engine2"))
+    except ValueError as e:
+        parser.error(str(e))
+    if engines[0]["name"] == engines[1]["name"]:
+        parser.error("the engines need different names")
+
+    out = open(args.out, "w") if args.out else None
+    pgn = open(args.pgn, "w") if args.pgn else None
+    try:
+        summary = runMatch(engines, args.games, args.workers, args.random_plies, args.epd, args.seed, args.backend,
+                           args.max_plies, out, pgn, None if args.quiet else sys.stderr)
+    finally:
+        for f in (out, pgn):
+            if f is not None:
+                f.close()
+
+    print("%s vs %s: %d games, +%d =%d -%d, score %.1f%%"
+          % (engines[0]["name"], engines[1]["name"], summary["games"], summary["wins"], summary["draws"],
+             summary["losses"], 100.0 * (summary["wins"] + summary["draws"] / 2.0) / max(summary["games"], 1)))
+    if summary["eloMargin"] is None:
+        print("Elo difference %+.0f" % summary["elo"])
+    else:
+        print("Elo difference %+.1f +/- %.1f (95%%)" % (summary["elo"], summary["eloMargin"]))
+    print("endings: " + ", ".join("%s %d" % (reason, count) for reason, count in sorted(summary["reasons"].items())))
+    print("%.2f games/s, %.1f plies/s, %.2fs" % (summary["gamesPerSecond"],
+                                                 summary["plies"] / summary["seconds"] if summary["seconds"] > 0 else 0,
+                                                 summary["seconds"]))
+    for engine, times in zip(engines, summary["moveMs"]):
+        print("%-10s move time p50 %.1f ms  p90 %.1f ms  p99 %.1f ms  max %.1f ms  (%d moves)"
+              % (engine["name"], times["p50"], times["p90"], times["p99"], times["max"], times["moves"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
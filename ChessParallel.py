@@ -0,0 +1,192 @@
+# parallel search over a process pool
+# the root moves are split between worker processes: every iteration searches the expected best
+# move first with the full window, then the remaining moves in parallel with a null window around
+# its score, and searches again with an open window the moves that beat it.
+# positions go to the workers as GameState.snapshot() tuples, each worker keeps its own Searcher
+# (and transposition table) between tasks, and a shared event stops the stragglers when the
+# time budget runs out
+
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+import time
+
+import ChessEngine
+import ChessSearch
+from ChessSearch import INFINITY, MATE, MAX_DEPTH, SearchResult
+from ChessTransposition import DEFAULT_HASH_MB
+
+# state of the current worker process, set up by initWorker
+worker = {}
+
+
+def initWorker(backend, hashMb, stopEvent):
+    searcher = ChessSearch.Searcher(hashMb)
+    searcher.stopEvent = stopEvent
+    worker["searcher"] = searcher
+    worker["backend"] = backend
+    worker["searchId"] = None
+    worker["gs"] = None
+
+
+# runs in a worker: (move, score, nodes) of move searched to depth inside (alpha, beta).
+# score is None if the search was stopped. the snapshot is only unpacked once per search
+def searchMoveTask(searchId, snapshot, move, depth, alpha, beta, timeMs):
+    searcher = worker["searcher"]
+    if worker["searchId"] != searchId:
+        worker["searchId"] = searchId
+        worker["gs"] = ChessEngine.newGameState(worker["backend"]).loadSnapshot(snapshot)
+        searcher.table.newSearch()
+        searcher.killers = [[0, 0] for ply in range(MAX_DEPTH + 1)]
+        searcher.history = [0] * len(searcher.history)
+    score = searcher.searchMove(worker["gs"], move, depth, alpha, beta, timeMs)
+    return move, score, searcher.nodes
+
+
+class ParallelSearcher():
+    def __init__(self, workers=None, backend="mailbox", hashMb=DEFAULT_HASH_MB):
+        self.workers = workers or os.cpu_count() or 1
+        self.stopEvent = multiprocessing.Event()
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, initializer=initWorker,
+                                                           initargs=(backend, hashMb, self.stopEvent))
+        self.searchCount = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.stopEvent.set()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    # same contract as Searcher.search: iterative deepening until maxDepth or the time budget,
+    # returning the result of the last completed iteration (or a move that an unfinished
+    # iteration already proved better)
+    def search(self, gs, timeMs=None, maxDepth=MAX_DEPTH, onIteration=None):
+        start = time.perf_counter()
+        deadline = start + timeMs / 1000.0 if timeMs is not None else None
+        self.searchCount += 1
+        searchId = (os.getpid(), self.searchCount)
+        self.stopEvent.clear()
+        result = SearchResult()
+
+        rootMoves = list(gs.getValidMoveCodes())
+        if not rootMoves:
+            return result
+        result.move = rootMoves[0]
+        moves = rootMoves
+        snapshot = gs.snapshot()
+
+        def remainingMs():
+            return None if deadline is None else max(0.0, (deadline - time.perf_counter()) * 1000.0)
+
+        for depth in range(1, min(maxDepth, MAX_DEPTH) + 1):
+            completed, best, score, nodes = self.searchIteration(searchId, snapshot, moves, depth, remainingMs)
+            result.nodes += nodes
+            if best is not None:
+                result.move, result.score = best, score
+                moves.remove(best)
+                moves.insert(0, best)
+            if not completed:
+                break
+            result.depth = depth
+            result.seconds = time.perf_counter() - start
+            if onIteration is not None:
+                onIteration(result)
+            if abs(score) >= MATE - MAX_DEPTH:
+                break
+        result.seconds = time.perf_counter() - start
+        return result
+
+    # one iteration over the root moves, moves[0] being the best move of the last one.
+    # returns (completed, best move, score, nodes); best is None when the time ran out before
+    # a move was proven better than the previous best
+    def searchIteration(self, searchId, snapshot, moves, depth, remainingMs):
+        nodes = 0
+        submit = self.pool.submit
+        first = submit(searchMoveTask, searchId, snapshot, moves[0], depth, -INFINITY, INFINITY, remainingMs())
+        done, pending = concurrent.futures.wait([first], timeout=remainingMs())
+        if pending:
+            self.stopStragglers(pending)
+            return False, None, 0, nodes
+        move, alpha, count = first.result()
+        nodes += count
+        if alpha is None:
+            return False, None, 0, nodes
+        firstMove = best = move
+
+        # null window searches only answer "better than alpha or not", the ones that are get
+        # searched again with an open window
+        windows = {}
+        for move in moves[1:]:
+            future = submit(searchMoveTask, searchId, snapshot, move, depth, alpha, alpha + 1, remainingMs())
+            windows[future] = False
+        pending = set(windows)
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=remainingMs(),
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                self.stopStragglers(pending)
+                return False, best if best != firstMove else None, alpha, nodes
+            for future in done:
+                move, score, count = future.result()
+                nodes += count
+                if score is None:
+                    self.stopStragglers(pending)
+                    return False, best if best != firstMove else None, alpha, nodes
+                if score <= alpha:
+                    continue
+                if windows[future]:
+                    alpha, best = score, move
+                else:
+                    research = submit(searchMoveTask, searchId, snapshot, move, depth, alpha, INFINITY, remainingMs())
+                    windows[research] = True
+                    pending.add(research)
+        return True, best, alpha, nodes
+
+    # cancel the tasks that haven't started and wait for the running ones to notice the stop event
+    def stopStragglers(self, pending):
+        self.stopEvent.set()
+        for future in pending:
+            future.cancel()
+        concurrent.futures.wait(pending)
+
+
+# time to reach a fixed depth on the benchmark positions, single process against the pool
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="parallel search speedup over single process search")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("--depth", type=int, default=4, help="depth searched for every position")
+    parser.add_argument("--hash-mb", type=float, default=DEFAULT_HASH_MB,
+                        help="transposition table size of every process in megabytes")
+    parser.add_argument("--backend", choices=ChessEngine.BACKENDS, default="mailbox",
+                        help="position backend behind GameState")
+    args = parser.parse_args(argv)
+
+    with ParallelSearcher(args.workers, args.backend, args.hash_mb) as parallel:
+        # start the workers outside the timed part
+        parallel.search(ChessEngine.newGameState(args.backend, ChessSearch.BENCH_POSITIONS[0][1]),
+                        maxDepth=1)
+        singleTotal = parallelTotal = 0.0
+        for name, fen in ChessSearch.BENCH_POSITIONS:
+            gs = ChessEngine.newGameState(args.backend, fen)
+            single = ChessSearch.Searcher(args.hash_mb).search(gs, maxDepth=args.depth)
+            result = parallel.search(gs, maxDepth=args.depth)
+            singleTotal += single.seconds
+            parallelTotal += result.seconds
+            print("%-14s depth %2d  single %7.2fs %8d nodes %s  parallel %7.2fs %8d nodes %s  speedup %.2fx"
+                  % (name, args.depth, single.seconds, single.nodes, ChessEngine.Move.codeNotation(single.move),
+                     result.seconds, result.nodes, ChessEngine.Move.codeNotation(result.move),
+                     single.seconds / result.seconds if result.seconds > 0 else 0))
+    print("%d workers, total single %.2fs, parallel %.2fs, speedup %.2fx"
+          % (args.workers, singleTotal, parallelTotal, singleTotal / parallelTotal if parallelTotal > 0 else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+# perft (performance test) harness for the move generator
+# walks the game tree to a fixed depth with getValidMoves / makeMove / undoMove,
+# counts the leaf nodes and times every depth, so the counts can be checked
+# against known-good numbers and the speed compared between runs
+
+import itertools
+import sys
+import time
+
+import ChessEngine
+import ChessEpd
+
+# test positions as (name, fen, expected leaf counts for depth 1, 2, 3, ...)
+# the "-no-castling" variants are the same positions with the castling rights taken away
+POSITIONS = [
+    ("startpos", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("kiwipete-no-castling", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w - - 0 1",
+     [46, 1866, 86677, 3504849]),
+    ("rook-endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("illegal-ep-1", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1",
+     [18, 92, 1670, 10138, 185429, 1134888]),
+    ("illegal-ep-2", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1",
+     [13, 102, 1266, 10276, 135655, 1015133]),
+    ("illegal-ep-3", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1",
+     [15, 126, 1928, 13931, 206379, 1440467]),
+    ("ep-check", "8/5bk1/8/2Pp4/8/1K6/8/8 w - d6 0 1",
+     [8, 104, 736, 9287, 62297, 824064]),
+    ("discovered-check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1",
+     [29, 165, 5160, 31961, 1004658]),
+    ("pinned-pawns", "7k/K7/8/PpP5/8/4b3/8/r7 w - b6 0 1",
+     [7, 169, 1009, 24074, 157227]),
+    ("double-check", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1",
+     [37, 183, 6559, 23527]),
+    ("promotion", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1",
+     [9, 40, 472, 2661, 38983, 217342]),
+    ("promotion-capture", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1",
+     [11, 133, 1442, 19174, 266199, 3821001]),
+    ("promotion-stalemate", "8/P1k5/K7/8/8/8/8/8 w - - 0 1",
+     [6, 27, 273, 1329, 18135, 92683]),
+    ("promotion-corner", "K1k5/8/P7/8/8/8/8/8 w - - 0 1",
+     [2, 6, 13, 63, 382, 2217]),
+    ("promotion-race", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1",
+     [10, 25, 268, 926, 10857, 43261, 567584]),
+    ("position-4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position-4-no-castling", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w - - 0 1",
+     [6, 258, 9221, 404587]),
+    ("position-5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+]
+
+
+# number of leaf nodes depth plies below the current position
+# the last ply is bulk counted: the length of the move list instead of making every move.
+# moves are generated as compact codes into one reused buffer per ply
+def perft(gs, depth, buffers=None):
+    if buffers is None:
+        buffers = [[] for i in range(depth + 1)]
+    moves = gs.getValidMoveCodes(buffers[depth])
+    if depth <= 1:
+        return len(moves) if depth == 1 else 1
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1, buffers)
+        gs.undoMove()
+    return nodes
+
+
+# leaf counts split by root move, for tracking down which move a wrong count comes from
+def divide(gs, depth):
+    counts = []
+    for move in gs.getValidMoveCodes():
+        gs.makeMove(move)
+        counts.append((ChessEngine.Move.codeNotation(move), perft(gs, depth - 1)))
+        gs.undoMove()
+    return counts
+
+
+# run perft for depth 1..maxDepth on one position and collect the results
+def runPosition(name, fen, maxDepth, expected=(), backend="mailbox", checkUnmake=False):
+    gs = ChessEngine.newGameState(backend, fen)
+    gs.checkUnmake = checkUnmake
+    result = {"name": name, "fen": fen, "backend": backend, "depths": [], "ok": True}
+    for depth in range(1, maxDepth + 1):
+        start = time.perf_counter()
+        nodes = perft(gs, depth)
+        seconds = time.perf_counter() - start
+        entry = {
+            "depth": depth,
+            "nodes": nodes,
+            "seconds": round(seconds, 6),
+            "nps": int(nodes / seconds) if seconds > 0 else 0,
+        }
+        if depth <= len(expected):
+            entry["expected"] = expected[depth - 1]
+            entry["ok"] = nodes == expected[depth - 1]
+            if not entry["ok"]:
+                result["ok"] = False
+        result["depths"].append(entry)
+    return result
+
+
+# (name, fen, expected counts) for every position of an EPD file, read as the run goes.
+# the expected counts come from the D1, D2, ... operations of the perft suite format
+def epdPositions(path):
+    for number, fen, operations in ChessEpd.readPositions(path):
+        expected = []
+        while "D%d" % (len(expected) + 1) in operations:
+            expected.append(int(operations["D%d" % (len(expected) + 1)]))
+        yield operations.get("id", "%s:%d" % (path, number)), fen, expected
+
+
+def printResult(result, out):
+    out.write("%s  %s\n" % (result["name"], result["fen"]))
+    for entry in result["depths"]:
+        if "expected" not in entry:
+            status = ""
+        elif entry["ok"]:
+            status = "ok"
+        else:
+            status = "FAIL (expected %d)" % entry["expected"]
+        out.write("  depth %2d %12d nodes %9.3fs %10d nps  %s\n"
+                  % (entry["depth"], entry["nodes"], entry["seconds"], entry["nps"], status))
+    out.flush()
+
+
+def main(argv=None):
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="perft correctness and move generation speed harness")
+    parser.add_argument("--depth", type=int, default=3, help="maximum depth searched for every position")
+    parser.add_argument("--position", action="append", default=[],
+                        help="name of a built-in position to run (default: all of them)")
+    parser.add_argument("--fen", action="append", default=[], help="extra position to run, as a FEN string")
+    parser.add_argument("--epd", action="append", default=[],
+                        help="EPD file of positions to run instead of the built-in ones, streamed line by line")
+    parser.add_argument("--backend", choices=ChessEngine.BACKENDS, default="mailbox",
+                        help="position backend behind GameState")
+    parser.add_argument("--check-unmake", action="store_true",
+                        help="debug mode: check that every undoMove restores the exact position (slow)")
+    parser.add_argument("--divide", action="store_true", help="print the per-root-move counts at --depth instead")
+    parser.add_argument("--json", metavar="PATH", help="write machine readable results to PATH ('-' for stdout)")
+    parser.add_argument("--list", action="store_true", help="list the built-in positions and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, fen, expected in POSITIONS:
+            print("%-18s %s  (known to depth %d)" % (name, fen, len(expected)))
+        return 0
+
+    positions = [p for p in POSITIONS if (not args.position and not args.epd) or p[0] in args.position]
+    unknown = set(args.position) - set(p[0] for p in POSITIONS)
+    if unknown:
+        parser.error("unknown position(s): " + ", ".join(sorted(unknown)))
+    positions += [("fen-%d" % (i + 1), fen, []) for i, fen in enumerate(args.fen)]
+    positions = itertools.chain(positions, *(epdPositions(path) for path in args.epd))
+
+    if args.divide:
+        for name, fen, expected in positions:
+            gs = ChessEngine.newGameState(args.backend, fen)
+            gs.checkUnmake = args.check_unmake
+            counts = divide(gs, args.depth)
+            print("%s  %s" % (name, fen))
+            for notation, nodes in counts:
+                print("  %s: %d" % (notation, nodes))
+            print("  total: %d" % sum(nodes for notation, nodes in counts))
+        return 0
+
+    # human readable progress goes to stderr when the JSON report is written to stdout
+    progress = sys.stderr if args.json == "-" else sys.stdout
+    # totals are kept as the positions go by, the results themselves only for the JSON report
+    results = []
+    count = nodes = perftNodes = 0
+    perftSeconds = 0.0
+    ok = True
+    start = time.perf_counter()
+    for name, fen, expected in positions:
+        result = runPosition(name, fen, args.depth, expected, args.backend, args.check_unmake)
+        printResult(result, progress)
+        count += 1
+        if result["depths"]:
+            nodes += result["depths"][-1]["nodes"]
+        perftNodes += sum(e["nodes"] for e in result["depths"])
+        perftSeconds += sum(e["seconds"] for e in result["depths"])
+        ok = ok and result["ok"]
+        if args.json:
+            results.append(result)
+    seconds = time.perf_counter() - start
+
+    summary = {
+        "backend": args.backend,
+        "depth": args.depth,
+        "positions": count,
+        "nodes": nodes,
+        "seconds": round(seconds, 6),
+        "nps": int(perftNodes / perftSeconds) if perftSeconds > 0 else 0,
+        "ok": ok,
+    }
+    progress.write("%d positions, %d nodes at depth %d, %.3fs, %d nps, %s\n"
+                   % (summary["positions"], nodes, args.depth, seconds, summary["nps"],
+                      "all counts match" if summary["ok"] else "COUNT MISMATCH"))
+
+    if args.json:
+        report = {"python": sys.version.split()[0], "summary": summary, "results": results}
+        if args.json == "-":
+            json.dump(report, sys.stdout, indent=2)
+            sys.stdout.write("\n")
+        else:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+    return 0 if summary["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
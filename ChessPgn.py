@@ -0,0 +1,275 @@
+# PGN game files: a streaming reader, a writer, and a multi-process replay pipeline that checks
+# every game move by move against the legal moves and records where it ends up.
+# games are read one at a time, so memory stays flat however large the file is, and are sent to
+# the worker processes in chunks, with only a few chunks in flight at once. files ending in .gz
+# are decompressed on the fly.
+#
+#   python ChessPgn.py games.pgn.gz --workers 4 --out results.jsonl
+#
+# every game gives one JSON line as its chunk completes (so not in file order):
+#   {"game": 12, "ok": true, "plies": 83, "fen": "<final position>", "error": null,
+#    "White": "...", "Black": "...", "Result": "1-0"}
+# with "ok" false, "plies" is the number of moves played before the one in "error"
+
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+import ChessEngine
+from ChessEpd import openSource
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+# the tags every exported game starts with, in this order
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+# headers copied from the game into its replay record
+RECORD_HEADERS = ("White", "Black", "Result")
+DEFAULT_CHUNK = 64  # games per task sent to a worker
+CHUNKS_IN_FLIGHT = 2  # chunks per worker submitted ahead of the results written
+LINE_LENGTH = 80
+
+# state of a replay worker process
+worker = {}
+
+
+# generator of the text of every game in source, a path or an open text file.
+# a game is its header lines and its movetext; a header line after movetext starts the next game
+def readGameTexts(source):
+    f = openSource(source) if isinstance(source, str) else source
+    try:
+        lines = []
+        inMoves = False
+        for line in f:
+            if line.startswith("%"):  # escape mechanism, the rest of the line is ignored
+                continue
+            stripped = line.strip()
+            if stripped.startswith("["):
+                if inMoves:
+                    yield "".join(lines)
+                    lines = []
+                    inMoves = False
+            elif stripped:
+                inMoves = True
+            if stripped or lines:
+                lines.append(line)
+        if inMoves or lines:
+            yield "".join(lines)
+    finally:
+        if f is not source:
+            f.close()
+
+
+# (headers, SAN moves, result) of the text of one game. comments, variations, numeric
+# annotation glyphs and move numbers are dropped; result is None when the movetext doesn't end in one
+def parseGame(text):
+    headers = {}
+    moveText = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("[") and stripped.endswith("]") and not moveText:
+            fields = stripped[1:-1].split(None, 1)
+            if len(fields) == 2 and fields[1].startswith('"') and fields[1].endswith('"'):
+                headers[fields[0]] = fields[1][1:-1].replace('\\"', '"').replace("\\\\", "\\")
+        elif stripped:
+            moveText.append(line)
+
+    moves = []
+    result = None
+    depth = 0  # variation nesting
+    token = ""
+    text = "\n".join(moveText) + "\n"
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if ch == "{":  # comment up to the closing brace
+            end = text.find("}", i)
+            i = len(text) if end < 0 else end + 1
+            ch = " "
+        elif ch == ";":  # comment up to the end of the line
+            i = text.find("\n", i)
+            ch = " "
+        else:
+            i += 1
+        if ch in " \t\r\n()":
+            if token and depth == 0:
+                token = token.split(".")[-1]  # drops move numbers, also the ones run into the move (1.e4)
+                if token in RESULTS:
+                    result = token
+                elif token and not token.startswith("$") and not token.isdigit():
+                    moves.append(token)
+            token = ""
+            if ch == "(":
+                depth += 1
+            elif ch == ")":
+                depth = max(depth - 1, 0)
+        else:
+            token += ch
+    return headers, moves, result
+
+
+# replay record of one game: plays its moves from the start position (or the FEN header) on gs
+def replayGame(number, text, gs):
+    record = {"game": number, "ok": False, "plies": 0, "fen": None, "error": None}
+    try:
+        headers, moves, result = parseGame(text)
+    except ValueError as e:
+        record["error"] = str(e)
+        return record
+    for header in RECORD_HEADERS:
+        record[header] = headers.get(header)
+    try:
+        gs.loadFen(headers.get("FEN", ChessEngine.START_FEN))
+    except ValueError as e:
+        record["error"] = str(e)
+        return record
+    for san in moves:
+        try:
+            code = gs.sanToMove(san)
+        except ValueError as e:
+            record["error"] = "move %d%s: %s" % (gs.fullmoveNumber, "." if gs.whiteToMove else "...", e)
+            break
+        gs.makeMove(code)
+        record["plies"] += 1
+    else:
+        record["ok"] = True
+    record["fen"] = gs.getFen()
+    return record
+
+
+# runs in a worker: replay records of a chunk of (game number, game text).
+# every worker replays on one GameState, reset for every game by loadFen
+def replayChunk(chunk, backend):
+    if worker.get("backend") != backend:
+        worker["gs"] = ChessEngine.newGameState(backend)
+        worker["backend"] = backend
+    return [replayGame(number, text, worker["gs"]) for number, text in chunk]
+
+
+# generator of lists of up to size (game number, game text)
+def chunkGames(source, size):
+    chunk = []
+    for number, text in enumerate(readGameTexts(source), 1):
+        chunk.append((number, text))
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# replay every game of source over workers processes (0: in this process), writing the records
+# to out as JSON lines as they complete. returns (games, games ok, plies)
+def replayPgn(source, out, workers=None, chunkSize=DEFAULT_CHUNK, backend="mailbox"):
+    totals = [0, 0, 0]
+
+    def write(records):
+        for record in records:
+            out.write(json.dumps(record) + "\n")
+            totals[0] += 1
+            totals[1] += record["ok"]
+            totals[2] += record["plies"]
+
+    if workers == 0:
+        for chunk in chunkGames(source, chunkSize):
+            write(replayChunk(chunk, backend))
+        return tuple(totals)
+
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = set()
+        for chunk in chunkGames(source, chunkSize):
+            # reading stays a few chunks ahead of the workers instead of loading the whole file
+            while len(pending) >= workers * CHUNKS_IN_FLIGHT:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    write(future.result())
+            pending.add(pool.submit(replayChunk, chunk, backend))
+        for future in concurrent.futures.as_completed(pending):
+            write(future.result())
+    return tuple(totals)
+
+
+# SAN of the moves played on gs since its last loadFen. the moves are taken back and played
+# again to get the position every one was played in, gs ends where it was
+def gameMoves(gs):
+    codes = list(gs.moveLog)
+    for code in codes:
+        gs.undoMove()
+    moves = []
+    for code in codes:
+        moves.append(gs.moveToSan(code))
+        gs.makeMove(code)
+    return moves
+
+
+# PGN text of a game: the seven tag roster (filled with "?" where headers has nothing), the
+# other headers, then the SAN moves wrapped at LINE_LENGTH. fen is the start position if it isn't
+# the usual one, it goes in the SetUp / FEN headers and decides the first move number
+def gameToPgn(headers, moves, result="*", fen=None):
+    headers = dict(headers)
+    headers["Result"] = result
+    if fen is not None and fen != ChessEngine.START_FEN:
+        headers["SetUp"] = "1"
+        headers["FEN"] = fen
+    lines = []
+    for tag in SEVEN_TAG_ROSTER + tuple(tag for tag in headers if tag not in SEVEN_TAG_ROSTER):
+        value = str(headers.get(tag, "????.??.??" if tag == "Date" else "?"))
+        lines.append('[%s "%s"]' % (tag, value.replace("\\", "\\\\").replace('"', '\\"')))
+    lines.append("")
+
+    fields = fen.split() if fen is not None else ChessEngine.START_FEN.split()
+    whiteToMove = fields[1] == "w"
+    number = int(fields[5]) if len(fields) > 5 else 1
+    tokens = []
+    for i, san in enumerate(moves):
+        if whiteToMove:
+            tokens.append("%d. %s" % (number, san))
+        elif i == 0:
+            tokens.append("%d... %s" % (number, san))
+        else:
+            tokens.append(san)
+        if not whiteToMove:
+            number += 1
+        whiteToMove = not whiteToMove
+    tokens.append(result)
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n"
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="replay and validate every game of a PGN file")
+    parser.add_argument("pgn", help="PGN file, .gz files are decompressed on the fly")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="replay processes (default: one per CPU, 0: replay in this process)")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK, help="games per task sent to a worker")
+    parser.add_argument("--out", default=None, help="file the JSON lines go to (default: stdout)")
+    parser.add_argument("--backend", choices=ChessEngine.BACKENDS, default="mailbox",
+                        help="position backend behind GameState")
+    args = parser.parse_args(argv)
+
+    out = open(args.out, "w") if args.out else sys.stdout
+    try:
+        start = time.perf_counter()
+        games, ok, plies = replayPgn(args.pgn, out, args.workers, max(args.chunk, 1), args.backend)
+        seconds = time.perf_counter() - start
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print("%d games, %d valid, %d invalid, %d plies in %.2fs (%d games/s, %d plies/s)"
+          % (games, ok, games - ok, plies, seconds, games / seconds if seconds > 0 else 0,
+             plies / seconds if seconds > 0 else 0), file=sys.stderr)
+    return 0 if ok == games else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+# optional instrumentation of the move generator: call counts and timings of checkForPinsAndChecks,
+# every get*Moves function, Move construction, makeMove / undoMove and getValidMoves(/Codes), on
+# both backends, without an external profiler.
+# enabling a Profiler puts counting wrappers around those methods on the classes, disabling it puts
+# the original methods back, so a disabled profiler costs nothing at all.
+# timings are kept per label, so they can be told apart per position type or per request:
+#
+#   profiler = ChessProfile.Profiler()
+#   with profiler.enabled(gs), profiler.label("endgame"):
+#       gs.getValidMoveCodes()
+#   profiler.stats()  ->  {"endgame": {"GameState.getKingMoves": {"calls": 1, "seconds": ..., ...}}}
+#
+# and dumped as JSON, or as a cProfile / pstats file:
+#
+#   python ChessProfile.py --depth 3 --json profile.json --pstats profile.prof
+#   python -m pstats profile.prof
+
+import contextlib
+import json
+import marshal
+import sys
+import time
+
+import ChessBitboard
+import ChessEngine
+
+# (class, method names) wrapped by enable, the methods a class only inherits are counted once on the
+# class defining them
+PROFILED = (
+    (ChessEngine.GameState, ("checkForPinsAndChecks", "getPawnMoves", "getRookMoves", "getKnightMoves",
+                             "getBishopMoves", "getQueenMoves", "getKingMoves", "getCastleMoves",
+                             "makeMove", "undoMove", "getValidMoves", "getValidMoveCodes", "hasLegalMove")),
+    (ChessBitboard.BitboardGameState, ("getValidMoveCodes", "hasLegalMove", "generateCodes", "pinnedPieces",
+                                       "getBitboardPieceMoves", "getBitboardPawnMoves")),
+    (ChessEngine.Move, ("__init__", "fromCode")),
+)
+DEFAULT_LABEL = "all"
+
+# the enabled Profiler, only one can have its wrappers on the classes at a time
+active = None
+
+
+# moveFunction holds methods bound when the GameState was made, bind them again so an existing
+# GameState calls the wrapped (or, after disable, the original) ones
+def rebindMoveFunctions(gs):
+    gs.moveFunction = {piece: getattr(gs, method.__name__) for piece, method in gs.moveFunction.items()}
+
+
+class Profiler():
+    def __init__(self):
+        # counters[(label, name)]: [calls, seconds, self seconds, {caller name: [calls, seconds, self seconds]}]
+        # self seconds leave out the time spent in profiled methods called from it
+        self.counters = {}
+        # methods running right now, as [name, seconds spent in profiled methods it called]
+        self.stack = []
+        self.currentLabel = DEFAULT_LABEL
+        self.originals = []  # (class, name, original attribute) while enabled
+        # pstats key (file, line, name) of every profiled method
+        self.locations = {}
+
+    # wrap the profiled methods. states: GameStates made before, whose moveFunction must be bound again
+    def enable(self, *states):
+        global active
+        if active is not None:
+            raise RuntimeError("another Profiler is already enabled")
+        active = self
+        for cls, names in PROFILED:
+            for name in names:
+                if name not in cls.__dict__:
+                    continue
+                original = cls.__dict__[name]
+                self.originals.append((cls, name, original))
+                fullName = cls.__name__ + "." + name
+                if isinstance(original, classmethod):
+                    function = original.__func__
+                    setattr(cls, name, classmethod(self.wrap(fullName, function)))
+                else:
+                    function = original
+                    setattr(cls, name, self.wrap(fullName, function))
+                code = function.__code__
+                self.locations[fullName] = (code.co_filename, code.co_firstlineno, fullName)
+        for gs in states:
+            rebindMoveFunctions(gs)
+
+    # put the original methods back
+    def disable(self, *states):
+        global active
+        for cls, name, original in reversed(self.originals):
+            setattr(cls, name, original)
+        self.originals = []
+        del self.stack[:]
+        if active is self:
+            active = None
+        for gs in states:
+            rebindMoveFunctions(gs)
+
+    @contextlib.contextmanager
+    def enabled(self, *states):
+        self.enable(*states)
+        try:
+            yield self
+        finally:
+            self.disable(*states)
+
+    # the calls made inside the block are counted under name
+    @contextlib.contextmanager
+    def label(self, name):
+        previous = self.currentLabel
+        self.currentLabel = name
+        try:
+            yield
+        finally:
+            self.currentLabel = previous
+
+    def reset(self):
+        self.counters.clear()
+
+    def wrap(self, name, function):
+        stack = self.stack
+        counters = self.counters
+        clock = time.perf_counter
+
+        def profiled(*args, **kwargs):
+            frame = [name, 0.0]
+            stack.append(frame)
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = clock() - start
+                stack.pop()
+                selfSeconds = seconds - frame[1]
+                caller = stack[-1][0] if stack else None
+                if stack:
+                    stack[-1][1] += seconds
+                key = (self.currentLabel, name)
+                counter = counters.get(key)
+                if counter is None:
+                    counter = counters[key] = [0, 0.0, 0.0, {}]
+                counter[0] += 1
+                counter[1] += seconds
+                counter[2] += selfSeconds
+                if caller is not None:
+                    callerCounter = counter[3].get(caller)
+                    if callerCounter is None:
+                        callerCounter = counter[3][caller] = [0, 0.0, 0.0]
+                    callerCounter[0] += 1
+                    callerCounter[1] += seconds
+                    callerCounter[2] += selfSeconds
+
+        profiled.__name__ = function.__name__
+        profiled.__qualname__ = function.__qualname__
+        profiled.__doc__ = function.__doc__
+        profiled.__wrapped__ = function
+        return profiled
+
+    # {label: {method: {"calls", "seconds", "selfSeconds", "callers": {caller: calls}}}}
+    def stats(self):
+        result = {}
+        for (label, name), (calls, seconds, selfSeconds, callers) in sorted(self.counters.items()):
+            result.setdefault(label, {})[name] = {
+                "calls": calls, "seconds": seconds, "selfSeconds": selfSeconds,
+                "callers": {caller: counter[0] for caller, counter in sorted(callers.items())}}
+        return result
+
+    # the stats as JSON, to a path or an open text file
+    def dumpJson(self, out):
+        if isinstance(out, str):
+            with open(out, "w") as f:
+                json.dump(self.stats(), f, indent=2)
+        else:
+            json.dump(self.stats(), out, indent=2)
+
+    # the counters in the marshal format of pstats.Stats.dump_stats, so pstats, snakeviz and the like
+    # read them like a cProfile run. labels is the labels summed (default: all of them)
+    def dumpStats(self, path, labels=None):
+        merged = {}
+        for (label, name), (calls, seconds, selfSeconds, callers) in self.counters.items():
+            if labels is not None and label not in labels:
+                continue
+            entry = merged.setdefault(name, [0, 0.0, 0.0, {}])
+            entry[0] += calls
+            entry[1] += seconds
+            entry[2] += selfSeconds
+            for caller, (callerCalls, callerSeconds, callerSelf) in callers.items():
+                callerEntry = entry[3].setdefault(caller, [0, 0.0, 0.0])
+                callerEntry[0] += callerCalls
+                callerEntry[1] += callerSeconds
+                callerEntry[2] += callerSelf
+        # pstats entries: key -> (primitive calls, calls, self time, cumulative time, callers)
+        stats = {}
+        for name, (calls, seconds, selfSeconds, callers) in merged.items():
+            stats[self.locations[name]] = (calls, calls, selfSeconds, seconds, {
+                self.locations[caller]: (counter[0], counter[0], counter[2], counter[1])
+                for caller, counter in callers.items()})
+        with open(path, "wb") as f:
+            marshal.dump(stats, f)
+
+    # text table of the methods of every label by self time
+    def report(self, out=None, limit=None):
+        out = out if out is not None else sys.stdout
+        for label, methods in self.stats().items():
+            total = sum(method["selfSeconds"] for method in methods.values())
+            out.write("%s\n" % label)
+            out.write("  %-42s %10s %10s %10s %6s %9s\n" % ("method", "calls", "self s", "total s", "self%", "us/call"))
+            rows = sorted(methods.items(), key=lambda item: item[1]["selfSeconds"], reverse=True)
+            for name, method in rows[:limit]:
+                out.write("  %-42s %10d %10.3f %10.3f %5.1f%% %9.2f\n"
+                          % (name, method["calls"], method["selfSeconds"], method["seconds"],
+                             100.0 * method["selfSeconds"] / total if total > 0 else 0,
+                             1e6 * method["seconds"] / method["calls"]))
+
+
+# profile perft of the ChessPerft positions (or of an EPD file), one label per position
+def main(argv=None):
+    import argparse
+
+    import ChessPerft
+
+    parser = argparse.ArgumentParser(description="per position counts and timings of the move generator")
+    parser.add_argument("--depth", type=int, default=3, help="perft depth of every position")
+    parser.add_argument("--position", action="append", help="profile only this ChessPerft position (repeatable)")
+    parser.add_argument("--epd", metavar="PATH", help="profile the positions of an EPD file instead")
+    parser.add_argument("--backend", choices=ChessEngine.BACKENDS, default="mailbox",
+                        help="position backend behind GameState")
+    parser.add_argument("--moves", action="store_true",
+                        help="build Move objects with getValidMoves at every node, to count their construction")
+    parser.add_argument("--json", metavar="PATH", help="write the counters as JSON")
+    parser.add_argument("--pstats", metavar="PATH", help="write the counters as a pstats file")
+    parser.add_argument("--limit", type=int, default=None, help="methods listed per position")
+    args = parser.parse_args(argv)
+
+    if args.epd:
+        positions = [(name, fen) for name, fen, expected in ChessPerft.epdPositions(args.epd)]
+    else:
+        positions = [(name, fen) for name, fen, expected in ChessPerft.POSITIONS
+                     if not args.position or name in args.position]
+    if not positions:
+        parser.error("no positions to profile")
+
+    def walk(gs, depth):
+        moves = gs.getValidMoves() if args.moves else gs.getValidMoveCodes()
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            gs.makeMove(move.code if args.moves else move)
+            nodes += walk(gs, depth - 1)
+            gs.undoMove()
+        return nodes
+
+    profiler = Profiler()
+    with profiler.enabled():
+        for name, fen in positions:
+            gs = ChessEngine.newGameState(args.backend, fen)
+            with profiler.label(name):
+                start = time.perf_counter()
+                nodes = walk(gs, args.depth)
+                print("%-22s depth %d %10d nodes %8.3fs" % (name, args.depth, nodes, time.perf_counter() - start))
+    profiler.report(limit=args.limit)
+    if args.json:
+        profiler.dumpJson(args.json)
+    if args.pstats:
+        profiler.dumpStats(args.pstats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
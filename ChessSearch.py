@@ -0,0 +1,469 @@
+# move search on top of GameState
+# negamax alpha-beta with iterative deepening inside a time / node budget, quiescence search
+# on captures, and move ordering by MVV-LVA, killer moves and the history heuristic
+
+import sys
+import time
+
+import ChessEngine
+from ChessTransposition import TranspositionTable, DEFAULT_HASH_MB, EXACT, LOWER, UPPER
+
+PIECE_NAMES = ChessEngine.PIECE_NAMES
+PIECE_CODES = ChessEngine.PIECE_CODES
+PROMOTION_FLAG = ChessEngine.PROMOTION_FLAG
+PROMOTION_SHIFT = ChessEngine.PROMOTION_SHIFT
+CAPTURE_MOVES = ChessEngine.CAPTURE_MOVES
+QUIET_MOVES = ChessEngine.QUIET_MOVES
+# move generation stages of a node: captures then quiet moves, or all moves at once
+SPLIT_STAGES = (CAPTURE_MOVES, QUIET_MOVES)
+ALL_STAGES = (ChessEngine.ALL_MOVES,)
+
+MATE = 100000  # score of being mated right now; mate in n plies scores MATE - n
+INFINITY = 1000000
+MAX_DEPTH = 64
+CHECK_EVERY = 64  # nodes between two looks at the clock, a few milliseconds at the speed of this search
+REPETITION_WINDOW = 50  # plies looked back for a repeated position
+
+PIECE_VALUES = {'p': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+
+# piece-square tables from white's point of view, row 0 is the 8th rank like GameState.board
+PIECE_SQUARE_TABLES = {
+    'p': [[0, 0, 0, 0, 0, 0, 0, 0],
+          [50, 50, 50, 50, 50, 50, 50, 50],
+          [10, 10, 20, 30, 30, 20, 10, 10],
+          [5, 5, 10, 25, 25, 10, 5, 5],
+          [0, 0, 0, 20, 20, 0, 0, 0],
+          [5, -5, -10, 0, 0, -10, -5, 5],
+          [5, 10, 10, -20, -20, 10, 10, 5],
+          [0, 0, 0, 0, 0, 0, 0, 0]],
+    'N': [[-50, -40, -30, -30, -30, -30, -40, -50],
+          [-40, -20, 0, 0, 0, 0, -20, -40],
+          [-30, 0, 10, 15, 15, 10, 0, -30],
+          [-30, 5, 15, 20, 20, 15, 5, -30],
+          [-30, 0, 15, 20, 20, 15, 0, -30],
+          [-30, 5, 10, 15, 15, 10, 5, -30],
+          [-40, -20, 0, 5, 5, 0, -20, -40],
+          [-50, -40, -30, -30, -30, -30, -40, -50]],
+    'B': [[-20, -10, -10, -10, -10, -10, -10, -20],
+          [-10, 0, 0, 0, 0, 0, 0, -10],
+          [-10, 0, 5, 10, 10, 5, 0, -10],
+          [-10, 5, 5, 10, 10, 5, 5, -10],
+          [-10, 0, 10, 10, 10, 10, 0, -10],
+          [-10, 10, 10, 10, 10, 10, 10, -10],
+          [-10, 5, 0, 0, 0, 0, 5, -10],
+          [-20, -10, -10, -10, -10, -10, -10, -20]],
+    'R': [[0, 0, 0, 0, 0, 0, 0, 0],
+          [5, 10, 10, 10, 10, 10, 10, 5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [-5, 0, 0, 0, 0, 0, 0, -5],
+          [0, 0, 0, 5, 5, 0, 0, 0]],
+    'Q': [[-20, -10, -10, -5, -5, -10, -10, -20],
+          [-10, 0, 0, 0, 0, 0, 0, -10],
+          [-10, 0, 5, 5, 5, 5, 0, -10],
+          [-5, 0, 5, 5, 5, 5, 0, -5],
+          [0, 0, 5, 5, 5, 5, 0, -5],
+          [-10, 5, 5, 5, 5, 5, 0, -10],
+          [-10, 0, 5, 0, 0, 0, 0, -10],
+          [-20, -10, -10, -5, -5, -10, -10, -20]],
+    'K': [[-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-20, -30, -30, -40, -40, -30, -30, -20],
+          [-10, -20, -20, -20, -20, -20, -20, -10],
+          [20, 20, 0, 0, 0, 0, 20, 20],
+          [20, 30, 10, 0, 0, 10, 30, 20]],
+}
+
+
+# SQUARE_SCORES[piece][r * 8 + c]: material plus square bonus of piece on (r, c), from white's
+# point of view (black pieces are negative and read their table upside down)
+def buildSquareScores():
+    scores = {}
+    for type, table in PIECE_SQUARE_TABLES.items():
+        scores['w' + type] = [PIECE_VALUES[type] + table[r][c] for r in range(8) for c in range(8)]
+        scores['b' + type] = [-(PIECE_VALUES[type] + table[7 - r][c]) for r in range(8) for c in range(8)]
+    return scores
+
+
+SQUARE_SCORES = buildSquareScores()
+# value of every piece code, for MVV-LVA ordering
+CODE_VALUES = [PIECE_VALUES[name[1]] if name != "--" else 0 for name in PIECE_NAMES]
+# piece codes of the queens, promoting to one is the only quiet move quiescence searches
+QUEEN_CODES = (ChessEngine.PIECE_CODES['wQ'], ChessEngine.PIECE_CODES['bQ'])
+
+
+# ordering score of a capture or promotion: most valuable victim first, then least valuable
+# attacker, with the value the promotion adds counted like a capture
+def captureScore(move):
+    score = CODE_VALUES[(move >> 16) & 15] * 10 - CODE_VALUES[(move >> 12) & 15]
+    if move & PROMOTION_FLAG:
+        score += (CODE_VALUES[(move >> PROMOTION_SHIFT) & 15] - 100) * 10
+    return score
+
+
+# static evaluation of the position for the side to move
+def evaluate(gs):
+    score = 0
+    sq = 0
+    for row in gs.board:
+        for piece in row:
+            if piece != "--":
+                score += SQUARE_SCORES[piece][sq]
+            sq += 1
+    return score if gs.whiteToMove else -score
+
+
+# mate scores are stored in the transposition table as distance from the stored position rather
+# than from the root, so they stay right when the position is reached at another ply
+def scoreToTable(score, ply):
+    if score > MATE - MAX_DEPTH * 2:
+        return score + ply
+    if score < -MATE + MAX_DEPTH * 2:
+        return score - ply
+    return score
+
+
+def scoreFromTable(score, ply):
+    if score > MATE - MAX_DEPTH * 2:
+        return score - ply
+    if score < -MATE + MAX_DEPTH * 2:
+        return score + ply
+    return score
+
+
+class SearchStopped(Exception):
+    pass
+
+
+# outcome of a search: best move code (0 if there is no legal move), its score for the side
+# to move, the deepest completed iteration and the work done
+class SearchResult():
+    def __init__(self, move=0, score=0, depth=0, nodes=0, seconds=0.0):
+        self.move = move
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.seconds = seconds
+
+    def getMove(self):
+        return ChessEngine.Move.fromCode(self.move) if self.move else None
+
+
+# the transposition table is kept between searches, so one Searcher per game or analysis worker
+# reuses what earlier moves found. hashMb caps its memory
+class Searcher():
+    def __init__(self, hashMb=DEFAULT_HASH_MB):
+        self.table = TranspositionTable(hashMb)
+        self.nodes = 0
+        self.deadline = None
+        self.maxNodes = None
+        self.stopEvent = None  # optional event (anything with is_set()) that stops the search when set
+        self.iterationBest = None
+        self.killers = [[0, 0] for ply in range(MAX_DEPTH + 1)]
+        # history[pieceCode * 64 + endSquare]: how often that quiet move caused a cutoff, weighted by depth
+        self.history = [0] * (len(PIECE_NAMES) * 64)
+        self.buffers = [[] for ply in range(MAX_DEPTH + 64)]  # one move list per ply, reused
+        # optional ChessBook.OpeningBook and ChessTablebase.Tablebase: a root position one of them
+        # has a move for isn't searched
+        self.book = None
+        self.tablebase = None
+
+    # iterative deepening: search depth 1, 2, ... until maxDepth or until the time or node budget
+    # runs out, and return the result of the last completed iteration.
+    # onIteration(result) is called after every completed depth
+    def search(self, gs, timeMs=None, maxDepth=MAX_DEPTH, maxNodes=None, onIteration=None):
+        start = time.perf_counter()
+        self.nodes = 0
+        self.deadline = start + timeMs / 1000.0 if timeMs is not None else None
+        self.maxNodes = maxNodes
+        self.killers = [[0, 0] for ply in range(MAX_DEPTH + 1)]
+        self.history = [0] * len(self.history)
+        self.table.newSearch()
+        result = SearchResult()
+
+        rootMoves = list(gs.getValidMoveCodes())
+        if not rootMoves:
+            return result
+        if self.book is not None:
+            move = self.book.chooseMove(gs)
+            if move is not None:
+                result.move = move
+                result.seconds = time.perf_counter() - start
+                return result
+        if self.tablebase is not None:
+            best = self.tablebase.bestMove(gs)
+            if best is not None:
+                # value is 1, 0 or -1 for a win, draw or loss of the side to move
+                result.move, value, plies = best
+                result.score = value * (MATE - plies)
+                result.depth = 1
+                result.seconds = time.perf_counter() - start
+                if onIteration is not None:
+                    onIteration(result)
+                return result
+        result.move = self.table.bestMove(gs.zobristKey)
+        if result.move not in rootMoves:
+            result.move = rootMoves[0]
+
+        rootLength = len(gs.moveLog)
+        for depth in range(1, min(maxDepth, MAX_DEPTH) + 1):
+            try:
+                move, score = self.searchRoot(gs, rootMoves, depth, result.move)
+            except SearchStopped:
+                # unwind the moves the interrupted iteration left on the board
+                while len(gs.moveLog) > rootLength:
+                    gs.undoMove()
+                # the root moves it finished were searched deeper, the last best one first, so
+                # the best of them is at least as good as the last complete iteration's move
+                if self.iterationBest is not None:
+                    result.move, result.score = self.iterationBest
+                break
+            result.move, result.score, result.depth = move, score, depth
+            self.table.store(gs.zobristKey, move, scoreToTable(score, 0), depth, EXACT)
+            result.nodes = self.nodes
+            result.seconds = time.perf_counter() - start
+            if onIteration is not None:
+                onIteration(result)
+            if abs(score) >= MATE - MAX_DEPTH:
+                break  # found a forced mate, deeper iterations can't improve on it
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def searchRoot(self, gs, moves, depth, previousBest):
+        self.orderMoves(moves, 0, previousBest)
+        alpha = -INFINITY
+        bestMove = moves[0]
+        self.iterationBest = None  # (move, score) of the best root move searched so far
+        for move in moves:
+            score = -self.negamaxAfter(gs, move, depth - 1, -INFINITY, -alpha, 1)
+            if score > alpha:
+                alpha = score
+                bestMove = move
+                self.iterationBest = (move, score)
+        # keep the best move first so the next iteration searches it first
+        moves.remove(bestMove)
+        moves.insert(0, bestMove)
+        return bestMove, alpha
+
+    # score of one root move searched to depth inside (alpha, beta), or None if the time budget
+    # ran out first. used by the parallel search, which splits the root moves between processes
+    def searchMove(self, gs, move, depth, alpha=-INFINITY, beta=INFINITY, timeMs=None):
+        self.nodes = 0
+        self.deadline = time.perf_counter() + timeMs / 1000.0 if timeMs is not None else None
+        self.maxNodes = None
+        rootLength = len(gs.moveLog)
+        try:
+            return -self.negamaxAfter(gs, move, depth - 1, -beta, -alpha, 1)
+        except SearchStopped:
+            while len(gs.moveLog) > rootLength:
+                gs.undoMove()
+            return None
+
+    # make move, search the position after it and take the move back
+    def negamaxAfter(self, gs, move, depth, alpha, beta, ply):
+        gs.makeMove(move)
+        score = self.negamax(gs, depth, alpha, beta, ply)
+        gs.undoMove()
+        return score
+
+    def countNode(self):
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0:
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                raise SearchStopped()
+            if self.stopEvent is not None and self.stopEvent.is_set():
+                raise SearchStopped()
+        if self.maxNodes is not None and self.nodes >= self.maxNodes:
+            raise SearchStopped()
+
+    # true if the current position already occurred earlier with the same side to move
+    def isRepetition(self, gs):
+        history = gs.zobristHistory
+        key = history[-1]
+        for i in range(len(history) - 3, max(-1, len(history) - 1 - REPETITION_WINDOW), -2):
+            if history[i] == key:
+                return True
+        return False
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        self.countNode()
+        if self.isRepetition(gs):
+            return 0
+        if depth <= 0 or ply >= MAX_DEPTH:
+            return self.quiescence(gs, alpha, beta, ply)
+
+        key = gs.zobristKey
+        hashMove = 0
+        entry = self.table.probe(key)
+        if entry is not None:
+            hashMove, score, entryDepth, bound = entry
+            if entryDepth >= depth:
+                score = scoreFromTable(score, ply)
+                if bound == EXACT or (bound == LOWER and score >= beta) or (bound == UPPER and score <= alpha):
+                    return score
+
+        # captures are generated and searched first and the quiet moves only when none of them cut
+        # off. a quiet hash move needs the quiet moves to go first, so then all come in one stage
+        if hashMove and not (hashMove >> 16) & 15 and not hashMove & PROMOTION_FLAG:
+            stages = ALL_STAGES
+        else:
+            stages = SPLIT_STAGES
+        moves = self.buffers[ply]
+        originalAlpha = alpha
+        best = -INFINITY
+        bestMove = 0
+        searched = 0
+        for kinds in stages:
+            gs.getValidMoveCodes(moves, kinds)
+            if kinds == stages[0] and gs.inCheck:
+                depth += 1  # check extension, so mates behind a check aren't pushed past the horizon
+            self.orderMoves(moves, ply, hashMove)
+            for move in moves:
+                if searched == 0:
+                    score = -self.negamaxAfter(gs, move, depth - 1, -beta, -alpha, ply + 1)
+                else:
+                    # principal variation search: prove the later moves are no better with a null window
+                    # and only search again with the full window when one is
+                    score = -self.negamaxAfter(gs, move, depth - 1, -alpha - 1, -alpha, ply + 1)
+                    if alpha < score < beta:
+                        score = -self.negamaxAfter(gs, move, depth - 1, -beta, -alpha, ply + 1)
+                searched += 1
+                if score > best:
+                    best = score
+                    bestMove = move
+                    if score > alpha:
+                        alpha = score
+                        if alpha >= beta:
+                            if not (move >> 16) & 15:  # quiet move: remember it for move ordering
+                                killers = self.killers[ply]
+                                if killers[0] != move:
+                                    killers[1] = killers[0]
+                                    killers[0] = move
+                                self.history[((move >> 12) & 15) * 64 + ((move >> 6) & 63)] += depth * depth
+                            break
+            if best >= beta:
+                break
+        if searched == 0:
+            return -MATE + ply if gs.inCheck else 0
+
+        if best >= beta:
+            bound = LOWER
+        elif best > originalAlpha:
+            bound = EXACT
+        else:
+            bound = UPPER
+            bestMove = 0  # every move failed low, none of them is known to be best
+        self.table.store(key, bestMove, scoreToTable(best, ply), depth, bound)
+        return best
+
+    # search captures only until the position is quiet, so the static evaluation is never taken
+    # in the middle of an exchange. mates are left to negamax
+    def quiescence(self, gs, alpha, beta, ply):
+        self.countNode()
+        # stand pat: the side to move can usually do at least as well as the static evaluation
+        # by not capturing, which often cuts off before any moves are generated
+        standPat = evaluate(gs)
+        if standPat >= beta:
+            return standPat
+        if standPat > alpha:
+            alpha = standPat
+        moves = gs.getValidMoveCodes(self.buffers[ply], CAPTURE_MOVES)
+        # under-promotions without a capture are left out, the queen promotion does better
+        captures = [m for m in moves if (m >> 16) & 15 or (m >> PROMOTION_SHIFT) & 15 in QUEEN_CODES]
+        captures.sort(key=captureScore, reverse=True)
+        if ply + 1 >= len(self.buffers):
+            return alpha  # out of move buffers, stop extending the capture sequence
+        for move in captures:
+            score = -self.quiescenceAfter(gs, move, -beta, -alpha, ply + 1)
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+        return alpha
+
+    def quiescenceAfter(self, gs, move, alpha, beta, ply):
+        gs.makeMove(move)
+        score = self.quiescence(gs, alpha, beta, ply)
+        gs.undoMove()
+        return score
+
+    # best first: the hash move, captures by MVV-LVA, killer moves, then quiet moves by history score
+    def orderMoves(self, moves, ply, hashMove):
+        killers = self.killers[ply] if ply <= MAX_DEPTH else (0, 0)
+        history = self.history
+
+        def score(move):
+            if move == hashMove:
+                return 1 << 30
+            if (move >> 16) & 15 or move & PROMOTION_FLAG:
+                return (1 << 28) + captureScore(move)
+            if move == killers[0]:
+                return 1 << 27
+            if move == killers[1]:
+                return (1 << 27) - 1
+            return history[((move >> 12) & 15) * 64 + ((move >> 6) & 63)]
+
+        moves.sort(key=score, reverse=True)
+
+
+# best Move for the side to move within the budget, or None if there is no legal move.
+# book: optional ChessBook.OpeningBook consulted before searching
+def bestMove(gs, timeMs=1000, maxDepth=MAX_DEPTH, maxNodes=None, hashMb=DEFAULT_HASH_MB, book=None):
+    searcher = Searcher(hashMb)
+    searcher.book = book
+    return searcher.search(gs, timeMs, maxDepth, maxNodes).getMove()
+
+
+# positions searched by the benchmark, as FEN strings
+BENCH_POSITIONS = [
+    ("startpos", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"),
+    ("italian", "r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w KQkq - 4 4"),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"),
+    ("rook-endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"),
+]
+
+
+# search every benchmark position with the same budget and report the depth reached
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="search benchmark: depth reached per position within a fixed budget")
+    parser.add_argument("--time-ms", type=int, default=1000, help="time budget per position in milliseconds")
+    parser.add_argument("--depth", type=int, default=MAX_DEPTH, help="maximum depth")
+    parser.add_argument("--nodes", type=int, default=None, help="node budget per position")
+    parser.add_argument("--hash-mb", type=float, default=DEFAULT_HASH_MB,
+                        help="memory cap of the transposition table in megabytes")
+    parser.add_argument("--backend", choices=ChessEngine.BACKENDS, default="mailbox",
+                        help="position backend behind GameState")
+    parser.add_argument("--epd", metavar="PATH", help="search the positions of an EPD file instead, streamed line by line")
+    args = parser.parse_args(argv)
+
+    positions = BENCH_POSITIONS
+    if args.epd:
+        import ChessEpd
+        positions = ((operations.get("id", "line %d" % number), fen)
+                     for number, fen, operations in ChessEpd.readPositions(args.epd))
+    totalNodes = 0
+    totalSeconds = 0.0
+    for name, fen in positions:
+        gs = ChessEngine.newGameState(args.backend, fen)
+        searcher = Searcher(args.hash_mb)
+        result = searcher.search(gs, args.time_ms, args.depth, args.nodes)
+        totalNodes += result.nodes
+        totalSeconds += result.seconds
+        table = searcher.table
+        print("%-14s depth %2d  score %6d  move %s  %8d nodes  %6.2fs  %7d nps  hash hits %2d%%  full %4d"
+              % (name, result.depth, result.score, ChessEngine.Move.codeNotation(result.move), result.nodes,
+                 result.seconds, result.nodes / result.seconds if result.seconds > 0 else 0,
+                 100 * table.hits // table.probes if table.probes else 0, table.hashFull()))
+    print("total %d nodes, %.2fs, %d nps" % (totalNodes, totalSeconds, totalNodes / totalSeconds if totalSeconds else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,244 @@
+# asyncio game server: one GameState per connection, plain text line protocol over TCP
+# move validation runs on the event loop (it is a single legal move generation), engine replies
+# run in a process pool so a search never blocks the other sessions.
+#
+#   python ChessServer.py --port 8765
+#
+# commands, one per line, every reply is one line starting with "ok" or "error":
+#   new                   start a new game
+#   move <e2e4>           play a move, validated against the legal moves
+#   engine [ms]           let the engine reply with a move (default ENGINE_TIME_MS)
+#   moves                 legal moves in the current position
+#   undo                  take back the last move
+#   state                 side to move, number of moves played and game status
+#   memory                bytes held by this session
+#   stats                 sessions, their total memory and the engine requests served
+#   quit                  close the session
+
+import asyncio
+import concurrent.futures
+import itertools
+import sys
+
+import ChessEngine
+import ChessSearch
+import ChessUCI
+
+DEFAULT_PORT = 8765
+ENGINE_TIME_MS = 200
+MAX_ENGINE_TIME_MS = 10000
+MAX_LINE = 1024  # longest command accepted
+
+# state of an engine worker process
+engineWorker = {}
+
+
+# runs in an engine worker: code of the engine's move in the snapshot position, 0 if there is none.
+# every worker keeps its Searcher, and with it the transposition table, between requests.
+# bookPath: opening book the workers play from, mapped once per worker and shared between them
+def engineMove(snapshot, timeMs, backend, bookPath=None):
+    if "searcher" not in engineWorker:
+        engineWorker["searcher"] = ChessSearch.Searcher()
+        if bookPath is not None:
+            import ChessBook
+
+            engineWorker["searcher"].book = ChessBook.OpeningBook(bookPath)
+    gs = ChessEngine.newGameState(backend).loadSnapshot(snapshot)
+    return engineWorker["searcher"].search(gs, timeMs).move
+
+
+# bytes held by obj and everything it refers to that isn't in seen yet. module level tables
+# and other objects shared by all sessions are passed in seen so they aren't charged to any one
+def deepSizeof(obj, seen):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deepSizeof(key, seen) + deepSizeof(value, seen) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deepSizeof(item, seen) for item in obj)
+    elif hasattr(obj, "__dict__") and not callable(obj):
+        size += deepSizeof(obj.__dict__, seen)
+    return size
+
+
+# objects every session shares: piece names, the empty square string and the small ints
+def sharedObjects():
+    shared = set(id(name) for name in ChessEngine.PIECE_NAMES)
+    shared.update(id(i) for i in range(-5, 257))
+    shared.update(id(value) for value in (True, False, None, ()))
+    return shared
+
+
+class Session():
+    def __init__(self, id, backend):
+        self.id = id
+        self.gs = ChessEngine.newGameState(backend)
+        self.thinking = False  # an engine reply is being computed, moves are refused meanwhile
+        self.memory = None  # bytes held, kept by memoryUsed until a command changes the game
+
+    def memoryUsed(self, shared):
+        if self.memory is None:
+            self.memory = deepSizeof(self.gs, set(shared))
+        return self.memory
+
+
+class ChessServer():
+    def __init__(self, backend="mailbox", engineWorkers=None, bookPath=None):
+        self.backend = backend
+        self.engineWorkers = engineWorkers
+        self.bookPath = bookPath
+        self.executor = None  # process pool for engine replies, started by the first one
+        self.sessions = {}
+        self.ids = itertools.count(1)
+        self.engineRequests = 0
+        self.shared = sharedObjects()
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=DEFAULT_PORT):
+        self.server = await asyncio.start_server(self.handleConnection, host, port, limit=MAX_LINE)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    async def handleConnection(self, reader, writer):
+        session = Session(next(self.ids), self.backend)
+        self.sessions[session.id] = session
+        try:
+            writer.write(("ok session %d\n" % session.id).encode())
+            await writer.drain()
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, asyncio.LimitOverrunError):
+                    writer.write(b"error line too long\n")
+                    break
+                if not line:
+                    break
+                reply = await self.handle(session, line.decode(errors="replace"))
+                if reply is None:
+                    writer.write(b"ok bye\n")
+                    await writer.drain()
+                    break
+                writer.write((reply + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            del self.sessions[session.id]
+            writer.close()
+
+    # reply line to one command, None to close the session
+    async def handle(self, session, line):
+        tokens = line.split()
+        if not tokens:
+            return "error empty command"
+        command = tokens[0]
+        gs = session.gs
+        if command == "quit":
+            return None
+        if command == "memory":
+            return "ok %d" % session.memoryUsed(self.shared)
+        if command == "stats":
+            # only the sessions whose game changed since the last look are measured again, and the
+            # other sessions are served in between, so a stats request never holds up the loop for long
+            memory = 0
+            for other in list(self.sessions.values()):
+                if other.memory is None:
+                    await asyncio.sleep(0)
+                memory += other.memoryUsed(self.shared)
+            return "ok sessions %d memory %d engine %d" % (len(self.sessions), memory, self.engineRequests)
+        session.memory = None  # the other commands may change the game or the buffers behind it
+        if session.thinking:
+            return "error engine is thinking"
+        if command == "new":
+            session.gs = ChessEngine.newGameState(self.backend)
+            return "ok"
+        if command == "move":
+            if len(tokens) != 2:
+                return "error usage: move <e2e4>"
+            code = ChessUCI.parseMove(gs, tokens[1])
+            if code is None:
+                return "error illegal move " + tokens[1]
+            gs.makeMove(code)
+            return "ok " + self.status(gs)
+        if command == "engine":
+            timeMs = ENGINE_TIME_MS
+            if len(tokens) > 1:
+                try:
+                    timeMs = min(max(int(tokens[1]), 1), MAX_ENGINE_TIME_MS)
+                except ValueError:
+                    return "error bad time " + tokens[1]
+            return await self.engineReply(session, timeMs)
+        if command == "moves":
+            return "ok " + " ".join(ChessEngine.Move.codeNotation(code) for code in gs.getValidMoveCodes())
+        if command == "undo":
+            if not gs.moveLog:
+                return "error no move to undo"
+            gs.undoMove()
+            return "ok"
+        if command == "state":
+            return "ok %s %d %s" % ("white" if gs.whiteToMove else "black", len(gs.moveLog), self.status(gs))
+        return "error unknown command " + command
+
+    # game status after a move: checkmate, stalemate, check or playing
+    def status(self, gs):
+        if not gs.hasLegalMove():
+            return "checkmate" if gs.inCheck else "stalemate"
+        return "check" if gs.inCheck else "playing"
+
+    async def engineReply(self, session, timeMs):
+        if self.executor is None:
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.engineWorkers)
+        session.thinking = True
+        self.engineRequests += 1
+        try:
+            loop = asyncio.get_running_loop()
+            code = await loop.run_in_executor(self.executor, engineMove, session.gs.snapshot(), timeMs,
+                                              self.backend, self.bookPath)
+        finally:
+            session.thinking = False
+        if not code:
+            return "error no legal move"
+        session.gs.makeMove(code)
+        session.memory = None
+        return "ok %s %s" % (ChessEngine.Move.codeNotation(code), self.status(session.gs))
+
+
+async def serve(host, port, backend, engineWorkers, bookPath=None):
+    server = ChessServer(backend, engineWorkers, bookPath)
+    port = await server.start(host, port)
+    print("listening on %s:%d" % (host, port), flush=True)
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="asyncio chess game server with a plain text line protocol")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--backend", choices=ChessEngine.BACKENDS, default="mailbox",
+                        help="position backend behind GameState")
+    parser.add_argument("--engine-workers", type=int, default=None,
+                        help="processes computing engine replies (default: one per CPU)")
+    parser.add_argument("--book", metavar="PATH", help="opening book the engine plays from (see ChessBook)")
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port, args.backend, args.engine_workers, args.book))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,10 @@
+# statistics helpers shared by the load test and the match runner.
+# imports nothing, so a worker process importing it pays for nothing else
+
+
+# the value below which fraction (0 to 1) of values lie, by the nearest rank; 0.0 for no values
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
@@ -0,0 +1,647 @@
+# endgame tablebases: win / draw / loss and distance to mate of every position of a material
+# signature (KQvK, KRvKN, KPvK, ...) by retrograde analysis, built with GameState move generation.
+#
+# generation: every indexed position is set up and its legal moves generated (spread over worker
+# processes). captures and promotions leave the table and take the value of a smaller table,
+# which is built first; the other moves are kept as edges to positions of the same table. the
+# values are then spread backwards along those edges one ply at a time, starting from the
+# checkmates: a position is won in n + 1 plies when one move reaches a position lost in n, and
+# lost in n + 1 when every move reaches a won position, the longest win being n.
+#
+# file format (<signature>.ctb), read through mmap so a probe touches one or two pages:
+#   header   HEADER: magic, version, signature, positions per side, offsets of the sections
+#   wdl      2 bits per position, four to a byte: WDL_DRAW, WDL_WIN, WDL_LOSS or WDL_INVALID
+#   dtm      1 byte per position: plies to mate, for the side to move to win or to be mated in
+# positions are indexed by side to move (white first), then the white king square folded by the
+# board's symmetries (10 squares without pawns, 32 with), then every other piece's square.
+# the side with more material is always white in a file, probes of the other color are mirrored.
+# castling rights aren't part of a position, probes with them find nothing. a double pawn push that
+# allows an en passant capture leads out of the table, to a position generated and probed through its moves
+#
+#   python ChessTablebase.py KQvK KRvK KPvK --dir tables      build (and the tables they need)
+#   python ChessTablebase.py --dir tables --probe "<fen>"     value and best move of a position
+
+import array
+import mmap
+import os
+import struct
+import sys
+import time
+
+import ChessEngine
+
+MAGIC = b"CTB1"
+VERSION = 2  # 2: double pawn pushes allowing an en passant capture are generated right
+HEADER = struct.Struct("<4sB16sIII")  # magic, version, signature, positions per side, wdl offset, dtm offset
+EXTENSION = ".ctb"
+MAX_PIECES = 4
+MAX_PLIES = 255  # the longest mate a dtm byte holds
+DEFAULT_CHUNK = 8192  # positions per task sent to a worker
+
+# values of a probe, for the side to move
+WIN = 1
+DRAW = 0
+LOSS = -1
+# 2 bit codes of the wdl section
+WDL_DRAW, WDL_WIN, WDL_LOSS, WDL_INVALID = 0, 1, 2, 3
+WDL_VALUES = {WDL_DRAW: DRAW, WDL_WIN: WIN, WDL_LOSS: LOSS}
+
+# what generation found for a position, plus DRAW_EXIT when a capture or promotion draws
+INVALID, MATED, STALEMATE, NORMAL = 0, 1, 2, 3
+DRAW_EXIT = 4
+
+PIECE_ORDER = "KQRBNP"  # order of the pieces of a side in a signature
+PIECE_STRENGTH = {'K': 0, 'Q': 9, 'R': 5, 'B': 3, 'N': 3, 'P': 1}
+
+# state of a generation worker process
+worker = {}
+
+
+# the 8 symmetries of the board as square -> square tables (row, col swapped and / or mirrored)
+def buildSymmetries():
+    transforms = []
+    for swap in (False, True):
+        for flipRow in (False, True):
+            for flipCol in (False, True):
+                table = []
+                for sq in range(64):
+                    r, c = divmod(sq, 8)
+                    if swap:
+                        r, c = c, r
+                    if flipRow:
+                        r = 7 - r
+                    if flipCol:
+                        c = 7 - c
+                    table.append(r * 8 + c)
+                transforms.append(tuple(table))
+    return transforms
+
+
+# for every white king square: the symmetry moving it into the folded region, and the king
+# squares of the region in index order. without pawns the region is the a1-d1-d4 triangle and
+# every symmetry may be used, with pawns only the file mirror keeps them moving the same way
+def buildKingFolding(transforms, pawns):
+    if pawns:
+        transforms = transforms[:2]  # identity and file mirror
+        region = [sq for sq in range(64) if sq % 8 <= 3]
+    else:
+        region = [sq for sq in range(64) if sq % 8 <= 3 and 7 - sq // 8 <= sq % 8]
+    folding = []
+    for sq in range(64):
+        folding.append(next(transform for transform in transforms if transform[sq] in region))
+    return tuple(folding), tuple(region)
+
+
+SYMMETRIES = buildSymmetries()
+FOLDING = {pawns: buildKingFolding(SYMMETRIES, pawns) for pawns in (False, True)}
+FLIP_COLORS = tuple(sq ^ 56 for sq in range(64))  # mirrors the rows, for swapping the colors
+
+
+# (white pieces, black pieces) of a signature like "KQvKR", every side starting with its king
+def parseSignature(signature):
+    sides = signature.upper().split("V")
+    if len(sides) != 2 or not all(side.startswith("K") and side.count("K") == 1 for side in sides) or \
+            not all(piece in PIECE_ORDER for side in sides for piece in side):
+        raise ValueError("bad material signature '%s', expected something like KQvKR" % signature)
+    return tuple("".join(sorted(side, key=PIECE_ORDER.index)) for side in sides)
+
+
+# (signature with the stronger side as white, whether the colors were swapped to get it)
+def canonicalSignature(white, black):
+    def strength(side):
+        return sum(PIECE_STRENGTH[piece] for piece in side), [-PIECE_ORDER.index(piece) for piece in side]
+
+    if strength(black) > strength(white):
+        return black + "v" + white, True
+    return white + "v" + black, False
+
+
+# how the positions of one signature are indexed
+class TableLayout():
+    def __init__(self, signature):
+        white, black = parseSignature(signature)
+        self.signature, swapped = canonicalSignature(white, black)
+        if swapped:
+            raise ValueError("'%s' has the stronger side as black, use %s" % (signature, self.signature))
+        white, black = self.signature.split("v")
+        if len(white) + len(black) > MAX_PIECES:
+            raise ValueError("%s has more than %d pieces" % (signature, MAX_PIECES))
+        # piece names ("wK", "wQ", ...) in index order, the white king first
+        self.names = tuple("w" + ChessEngine.FEN_PIECES[piece][1] for piece in white) + \
+            tuple("b" + ChessEngine.FEN_PIECES[piece][1] for piece in black)
+        self.pawns = "P" in self.signature
+        self.folding, self.kingSquares = FOLDING[self.pawns]
+        self.kingIndex = {sq: i for i, sq in enumerate(self.kingSquares)}
+        self.positionsPerSide = len(self.kingSquares) * 64 ** (len(self.names) - 1)
+
+    def index(self, squares, whiteToMove):
+        transform = self.folding[squares[0]]
+        index = self.kingIndex[transform[squares[0]]]
+        for sq in squares[1:]:
+            index = index * 64 + transform[sq]
+        return index if whiteToMove else index + self.positionsPerSide
+
+    # (squares, whiteToMove) of an index
+    def position(self, index):
+        whiteToMove = index < self.positionsPerSide
+        index %= self.positionsPerSide
+        squares = []
+        for i in range(len(self.names) - 1):
+            index, sq = divmod(index, 64)
+            squares.append(sq)
+        squares.append(self.kingSquares[index])
+        squares.reverse()
+        return squares, whiteToMove
+
+    # false for overlapping pieces, pawns on the first or last rank, touching kings, or the side
+    # not to move in check
+    def isValid(self, squares, whiteToMove):
+        if len(set(squares)) != len(squares):
+            return False
+        board = {}
+        for name, sq in zip(self.names, squares):
+            if name[1] == "p" and not 8 <= sq < 56:
+                return False
+            board[sq] = name
+        kings = [sq for sq, name in board.items() if name[1] == "K"]
+        if divmod(kings[1], 8) in ChessEngine.KING_TARGETS[kings[0] // 8][kings[0] % 8]:
+            return False
+        attacker = "w" if whiteToMove else "b"
+        target = divmod(next(sq for sq, name in board.items() if name[0] != attacker and name[1] == "K"), 8)
+        for sq, name in board.items():
+            if name[0] == attacker and attacks(board, sq, name, target):
+                return False
+        return True
+
+    def fen(self, squares, whiteToMove):
+        board = ["--"] * 64
+        for name, sq in zip(self.names, squares):
+            board[sq] = name
+        ranks = []
+        for r in range(8):
+            rank = ""
+            empty = 0
+            for piece in board[r * 8:r * 8 + 8]:
+                if piece == "--":
+                    empty += 1
+                else:
+                    rank += (str(empty) if empty else "") + ChessEngine.PIECE_LETTERS[piece]
+                    empty = 0
+            ranks.append(rank + (str(empty) if empty else ""))
+        return "/".join(ranks) + (" w - - 0 1" if whiteToMove else " b - - 0 1")
+
+
+# true if piece (a name like "wR") on sq attacks target (row, col) on board {square: name}
+def attacks(board, sq, piece, target):
+    r, c = divmod(sq, 8)
+    kind = piece[1]
+    if kind == "p":
+        return target in ChessEngine.PAWN_ATTACK_TARGETS[piece[0]][r][c]
+    if kind == "N":
+        return target in ChessEngine.KNIGHT_TARGETS[r][c]
+    if kind == "K":
+        return target in ChessEngine.KING_TARGETS[r][c]
+    rays = ChessEngine.RAYS[r][c]
+    for j in ChessEngine.SLIDER_DIRECTIONS[kind]:
+        for endRow, endCol in rays[j]:
+            if (endRow, endCol) == target:
+                return True
+            if endRow * 8 + endCol in board:
+                break
+    return False
+
+
+# memory mapped tables of a directory, opened when first probed
+class Tablebase():
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}  # signature -> (layout, mmap, wdl offset, dtm offset)
+
+    def close(self):
+        for layout, data, wdlOffset, dtmOffset in self.tables.values():
+            data.close()
+        self.tables = {}
+
+    def path(self, signature):
+        return os.path.join(self.directory, signature + EXTENSION)
+
+    # the table of a canonical signature, None if there is no file for it
+    def table(self, signature):
+        table = self.tables.get(signature)
+        if table is None:
+            try:
+                with open(self.path(signature), "rb") as f:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                return None
+            magic, version, name, perSide, wdlOffset, dtmOffset = HEADER.unpack_from(data)
+            layout = TableLayout(signature)
+            if magic != MAGIC or version != VERSION or name.rstrip(b"\0").decode() != signature or \
+                    perSide != layout.positionsPerSide:
+                data.close()
+                raise ValueError("%s is not a version %d table of %s" % (self.path(signature), VERSION, signature))
+            table = self.tables[signature] = (layout, data, wdlOffset, dtmOffset)
+        return table
+
+    # (WIN / DRAW / LOSS, plies to mate) for the side to move of the position with pieces, a list of
+    # (name, square). None when there is no table for that material
+    def probePieces(self, pieces, whiteToMove):
+        white = "".join(sorted((name[1].upper() for name, sq in pieces if name[0] == "w"), key=PIECE_ORDER.index))
+        black = "".join(sorted((name[1].upper() for name, sq in pieces if name[0] == "b"), key=PIECE_ORDER.index))
+        if white == "K" and black == "K":
+            return DRAW, 0
+        signature, swapped = canonicalSignature(white, black)
+        if swapped:
+            pieces = [(("b" if name[0] == "w" else "w") + name[1], FLIP_COLORS[sq]) for name, sq in pieces]
+            whiteToMove = not whiteToMove
+        table = self.table(signature)
+        if table is None:
+            return None
+        layout, data, wdlOffset, dtmOffset = table
+        squares = []
+        remaining = list(pieces)
+        for name in layout.names:
+            piece = next(piece for piece in remaining if piece[0] == name)
+            remaining.remove(piece)
+            squares.append(piece[1])
+        index = layout.index(squares, whiteToMove)
+        code = (data[wdlOffset + (index >> 2)] >> ((index & 3) * 2)) & 3
+        if code == WDL_INVALID:
+            return None
+        return WDL_VALUES[code], data[dtmOffset + index]
+
+    # probePieces of a GameState, None also when it has castling rights or too many pieces.
+    # a position with an en passant capture isn't in a table, it is probed through its moves
+    def probe(self, gs):
+        if gs.castlingRights:
+            return None
+        pieces = [(piece, r * 8 + c) for r, row in enumerate(gs.board) for c, piece in enumerate(row) if piece != "--"]
+        if len(pieces) > MAX_PIECES:
+            return None
+        if gs.enPassantKey():
+            best = self.searchMoves(gs)
+            return best[1:] if best is not None else None
+        return self.probePieces(pieces, gs.whiteToMove)
+
+    # (move code, value, plies to mate) of the best move by the table: the fastest mate when
+    # winning, the slowest when losing, one keeping the draw otherwise. None without a table
+    def bestMove(self, gs):
+        if self.probe(gs) is None:
+            return None
+        return self.searchMoves(gs)
+
+    # bestMove from the probes of the positions after every move, None when one of them can't be
+    # probed or there is no move
+    def searchMoves(self, gs):
+        best = None
+        for code in gs.getValidMoveCodes():
+            gs.makeMove(code)
+            result = self.probe(gs)
+            gs.undoMove()
+            if result is None:
+                return None
+            value, plies = -result[0], result[1] + 1
+            # wins sort first and the shortest first, losses last and the longest first
+            rank = (value, -plies if value == WIN else plies)
+            if best is None or rank > best[0]:
+                best = (rank, code, value, plies)
+        if best is None:
+            return None
+        return best[1], best[2], best[3] if best[2] != DRAW else 0
+
+
+# the signatures a table needs built first: its material after any capture, promotion or
+# capturing promotion (a bare kings ending is a draw without a table)
+def dependencies(signature):
+    white, black = parseSignature(signature)
+    found = set()
+
+    def add(white, black):
+        if white != "K" or black != "K":
+            found.add(canonicalSignature("".join(sorted(white, key=PIECE_ORDER.index)),
+                                         "".join(sorted(black, key=PIECE_ORDER.index)))[0])
+
+    for mover, other, moverIsWhite in ((white, black, True), (black, white, False)):
+        for i, piece in enumerate(other):
+            if piece != "K":
+                captured = other[:i] + other[i + 1:]
+                add(mover, captured) if moverIsWhite else add(captured, mover)
+        for i, piece in enumerate(mover):
+            if piece != "P":
+                continue
+            for promoted in "QRBN":
+                promotedSide = mover[:i] + promoted + mover[i + 1:]
+                targets = [other] + [other[:j] + other[j + 1:] for j, piece in enumerate(other) if piece != "K"]
+                for target in targets:
+                    add(promotedSide, target) if moverIsWhite else add(target, promotedSide)
+    found.discard(canonicalSignature(white, black)[0])
+    return sorted(found)
+
+
+# the signatures in an order that builds every table after the ones it needs
+def buildOrder(signatures):
+    order = []
+
+    def visit(signature):
+        if signature in order:
+            return
+        for dependency in dependencies(signature):
+            visit(dependency)
+        order.append(signature)
+
+    for signature in signatures:
+        white, black = parseSignature(signature)
+        visit(canonicalSignature(white, black)[0])
+    return order
+
+
+# generation results of the position of the table on gs, its pieces on squares: (flag, the fastest
+# win and slowest loss in plies through a capture or promotion (0 for none), the indices of the
+# positions in the table its other moves lead to).
+# a double pawn push that allows an en passant capture leads to a position the table doesn't hold
+# (the same one with the capture added to its moves), so that position gets generated too, as a
+# virtual position after the ones of the table: its results are appended to virtual and the move
+# leads to index total + its place there. nothing is written to the file for it
+def generatePosition(gs, layout, tablebase, squares, whiteToMove, virtual):
+    names = layout.names
+    children = []
+    moves = gs.getValidMoveCodes()
+    if not moves:
+        return (MATED if gs.inCheck else STALEMATE), 0, 0, children
+    flag = NORMAL
+    win = loss = 0
+    for code in moves:
+        startSq = code & 63
+        endSq = (code >> 6) & 63
+        slot = squares.index(startSq)
+        if (code >> 16) & 15 or code & ChessEngine.PROMOTION_FLAG:
+            # an en passant capture takes the pawn beside the square it lands on
+            capturedSq = (startSq & 56) | (endSq & 7) if code & ChessEngine.ENPASSANT_FLAG else endSq
+            pieces = []
+            for j, sq in enumerate(squares):
+                if j == slot:
+                    promoted = (code >> ChessEngine.PROMOTION_SHIFT) & 15
+                    pieces.append((ChessEngine.PIECE_NAMES[promoted] if promoted else names[j], endSq))
+                elif sq != capturedSq:
+                    pieces.append((names[j], sq))
+            result = tablebase.probePieces(pieces, not whiteToMove)
+            if result is None:
+                raise RuntimeError("%s needs the tables it leads to, build them first" % layout.signature)
+            value, plies = result
+            if value == LOSS:
+                win = plies + 1 if not win else min(win, plies + 1)
+            elif value == WIN:
+                loss = max(loss, plies + 1)
+            else:
+                flag |= DRAW_EXIT
+            continue
+        moved = list(squares)
+        moved[slot] = endSq
+        if names[slot][1] == "p" and abs(endSq - startSq) == 16:
+            gs.makeMove(code)
+            if gs.enPassantKey():
+                virtual.append(generatePosition(gs, layout, tablebase, moved, not whiteToMove, virtual))
+                children.append(2 * layout.positionsPerSide + len(virtual) - 1)
+                gs.undoMove()
+                continue
+            gs.undoMove()
+        children.append(layout.index(moved, not whiteToMove))
+    return flag, win, loss, children
+
+
+# runs in a worker: generation results of the positions start to stop of a table, as arrays:
+# flags (INVALID / MATED / STALEMATE / NORMAL, | DRAW_EXIT), the fastest win and slowest loss in
+# plies through a capture or promotion (0 for none), the number of moves staying in the table
+# and the indices they lead to. plus the generatePosition results of the virtual positions, whose
+# indices count from the end of the table in this chunk
+def generateChunk(signature, directory, backend, start, stop):
+    if worker.get("setup") != (directory, backend):
+        worker["gs"] = ChessEngine.newGameState(backend)
+        worker["tablebase"] = Tablebase(directory)
+        worker["setup"] = (directory, backend)
+    gs = worker["gs"]
+    tablebase = worker["tablebase"]
+    layout = TableLayout(signature)
+    size = stop - start
+    flags = bytearray(size)
+    winExits = array.array("H", bytes(2 * size))
+    lossExits = array.array("H", bytes(2 * size))
+    counts = bytearray(size)
+    children = array.array("I")
+    virtual = []
+    for i in range(size):
+        squares, whiteToMove = layout.position(start + i)
+        if not layout.isValid(squares, whiteToMove):
+            continue
+        gs.loadFen(layout.fen(squares, whiteToMove))
+        flags[i], winExits[i], lossExits[i], positionChildren = \
+            generatePosition(gs, layout, tablebase, squares, whiteToMove, virtual)
+        counts[i] = len(positionChildren)
+        children.extend(positionChildren)
+    return flags, winExits, lossExits, counts, children, virtual
+
+
+# plies to mate of every position from the generation results, -1 for the ones that aren't
+# decided (draws, and invalid positions). a position lost in n plies has n even, won in n odd
+def propagate(flags, winExits, lossExits, counts, children):
+    total = len(flags)
+    offsets = array.array("I", bytes(4 * (total + 1)))
+    for p in range(total):
+        offsets[p + 1] = offsets[p] + counts[p]
+    # the positions every position is reached from, in the same layout as children
+    parentOffsets = array.array("I", bytes(4 * (total + 1)))
+    for child in children:
+        parentOffsets[child + 1] += 1
+    for p in range(total):
+        parentOffsets[p + 1] += parentOffsets[p]
+    parents = array.array("I", bytes(4 * len(children)))
+    fill = array.array("I", parentOffsets)
+    for p in range(total):
+        for k in range(offsets[p], offsets[p + 1]):
+            child = children[k]
+            parents[fill[child]] = p
+            fill[child] += 1
+    del fill
+
+    plies = array.array("h", [-1]) * total
+    remaining = array.array("B", counts)  # moves in the table not yet known to lead to a win
+    longest = array.array("H", lossExits)  # longest win the moves known so far lead to, plus one
+    # buckets[n]: positions decided in n plies (or sooner, those are skipped)
+    buckets = {0: [p for p in range(total) if flags[p] & 3 == MATED]}
+    for p in range(total):
+        if flags[p] & 3 != NORMAL:
+            continue
+        if winExits[p]:
+            buckets.setdefault(winExits[p], []).append(p)
+        elif not counts[p] and not flags[p] & DRAW_EXIT:
+            buckets.setdefault(lossExits[p], []).append(p)
+    n = 0
+    while n <= max(buckets, default=-1):
+        for p in buckets.pop(n, ()):
+            if plies[p] >= 0:
+                continue
+            plies[p] = n
+            for k in range(parentOffsets[p], parentOffsets[p + 1]):
+                parent = parents[k]
+                if plies[parent] >= 0:
+                    continue
+                if n % 2 == 0:  # p is lost, so the parent wins by moving there
+                    buckets.setdefault(n + 1, []).append(parent)
+                else:
+                    remaining[parent] -= 1
+                    if n + 1 > longest[parent]:
+                        longest[parent] = n + 1
+                    if not remaining[parent] and not winExits[parent] and not flags[parent] & DRAW_EXIT:
+                        buckets.setdefault(longest[parent], []).append(parent)
+        n += 1
+    return plies
+
+
+# write the table file of the generation results, returns its size in bytes
+def writeTable(path, layout, flags, plies):
+    total = len(flags)
+    wdl = bytearray((total + 3) // 4)
+    dtm = bytearray(total)
+    for p in range(total):
+        n = plies[p]
+        if flags[p] & 3 == INVALID:
+            code = WDL_INVALID
+        elif n < 0:
+            code = WDL_DRAW
+        else:
+            if n > MAX_PLIES:
+                raise ValueError("%s has a mate in %d plies, more than a table holds" % (layout.signature, n))
+            code = WDL_WIN if n % 2 else WDL_LOSS
+            dtm[p] = n
+        wdl[p >> 2] |= code << ((p & 3) * 2)
+    wdlOffset = HEADER.size
+    dtmOffset = wdlOffset + len(wdl)
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, layout.signature.encode(), layout.positionsPerSide, wdlOffset, dtmOffset))
+        f.write(wdl)
+        f.write(dtm)
+    os.replace(path + ".tmp", path)
+    return dtmOffset + len(dtm)
+
+
+# build the table of one signature into directory, the tables it needs must be there already.
+# pool: executor the positions are generated on (None: in this process).
+# returns {"signature", "positions", "wins", "draws", "losses", "longest", "seconds", "bytes"}
+def buildTable(signature, directory, pool=None, backend="mailbox", chunkSize=DEFAULT_CHUNK):
+    start = time.perf_counter()
+    layout = TableLayout(signature)
+    total = 2 * layout.positionsPerSide
+    ranges = [(first, min(first + chunkSize, total)) for first in range(0, total, chunkSize)]
+    if pool is None:
+        results = [generateChunk(layout.signature, directory, backend, first, last) for first, last in ranges]
+    else:
+        futures = [pool.submit(generateChunk, layout.signature, directory, backend, first, last) for first, last in ranges]
+        results = [future.result() for future in futures]
+    flags = bytearray()
+    winExits = array.array("H")
+    lossExits = array.array("H")
+    counts = bytearray()
+    children = array.array("I")
+    # the virtual positions of all chunks go after the table, renumbered from the chunk's own
+    virtual = []
+    for chunkFlags, chunkWins, chunkLosses, chunkCounts, chunkChildren, chunkVirtual in results:
+        flags += chunkFlags
+        winExits += chunkWins
+        lossExits += chunkLosses
+        counts += chunkCounts
+        offset = len(virtual)
+        if offset:
+            chunkChildren = array.array("I", (child + offset if child >= total else child for child in chunkChildren))
+            chunkVirtual = [(flag, win, loss, [child + offset if child >= total else child for child in virtualChildren])
+                            for flag, win, loss, virtualChildren in chunkVirtual]
+        children += chunkChildren
+        virtual += chunkVirtual
+    del results
+    for flag, win, loss, virtualChildren in virtual:
+        flags.append(flag)
+        winExits.append(win)
+        lossExits.append(loss)
+        counts.append(len(virtualChildren))
+        children.extend(virtualChildren)
+
+    plies = propagate(flags, winExits, lossExits, counts, children)[:total]
+    del flags[total:]
+    size = writeTable(os.path.join(directory, layout.signature + EXTENSION), layout, flags, plies)
+    valid = [p for p in range(total) if flags[p] & 3 != INVALID]
+    return {"signature": layout.signature, "positions": len(valid),
+            "wins": sum(1 for p in valid if plies[p] >= 0 and plies[p] % 2),
+            "losses": sum(1 for p in valid if plies[p] >= 0 and plies[p] % 2 == 0),
+            "draws": sum(1 for p in valid if plies[p] < 0),
+            "longest": max(max(plies), 0), "seconds": time.perf_counter() - start, "bytes": size}
+
+
+# build the tables of signatures and the ones they need over workers processes (0: in this
+# process), skipping the ones already in directory unless force. returns the report of every table built
+def buildTables(signatures, directory, workers=None, backend="mailbox", force=False, out=None):
+    os.makedirs(directory, exist_ok=True)
+    order = buildOrder(signatures)
+    reports = []
+    pool = None
+    if workers != 0:
+        import concurrent.futures  # only building needs it, probing from the engine doesn't pay for it
+
+        pool = concurrent.futures.ProcessPoolExecutor(workers or os.cpu_count() or 1)
+    try:
+        for signature in order:
+            if not force and os.path.exists(os.path.join(directory, signature + EXTENSION)):
+                continue
+            report = buildTable(signature, directory, pool, backend)
+            reports.append(report)
+            if out is not None:
+                out.write("%-8s %9d positions %8d wins %8d draws %8d losses  longest mate %3d plies  %8.2fs %10d bytes\n"
+                          % (report["signature"], report["positions"], report["wins"], report["draws"],
+                             report["losses"], report["longest"], report["seconds"], report["bytes"]))
+                out.flush()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return reports
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="build and probe endgame tablebases")
+    parser.add_argument("signatures", nargs="*", default=["KQvK", "KRvK", "KBvK", "KNvK", "KPvK"],
+                        help="material signatures to build, like KQvK or KRvKN (default: every 3 piece ending)")
+    parser.add_argument("--dir", default="tablebases", help="directory the tables are kept in")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="generation processes (default: one per CPU, 0: generate in this process)")
+    parser.add_argument("--backend", choices=ChessEngine.BACKENDS, default="mailbox",
+                        help="position backend behind GameState")
+    parser.add_argument("--force", action="store_true", help="build again the tables already there")
+    parser.add_argument("--probe", metavar="FEN", help="print the value and best move of a position instead")
+    args = parser.parse_args(argv)
+
+    if args.probe:
+        gs = ChessEngine.newGameState(args.backend, args.probe)
+        tablebase = Tablebase(args.dir)
+        result = tablebase.probe(gs)
+        if result is None:
+            print("no table for this position")
+            return 1
+        value, plies = result
+        print({WIN: "win", DRAW: "draw", LOSS: "loss"}[value] + (" in %d plies" % plies if value != DRAW else ""))
+        best = tablebase.bestMove(gs)
+        if best is not None:
+            print("best move " + gs.moveToSan(best[0]))
+        tablebase.close()
+        return 0
+
+    start = time.perf_counter()
+    try:
+        reports = buildTables(args.signatures, args.dir, args.workers, args.backend, args.force, sys.stdout)
+    except ValueError as e:
+        parser.error(str(e))
+    print("%d tables built in %.2fs, %d bytes" % (len(reports), time.perf_counter() - start,
+                                                  sum(report["bytes"] for report in reports)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+# transposition table for the search
+# a fixed number of two-slot buckets kept in flat typed arrays, so the memory used is set once by
+# the size in megabytes and never grows however long the table is in use.
+# slot 0 of a bucket is depth-preferred, slot 1 is always replaced
+
+# bound types stored with a score
+EXACT = 0
+LOWER = 1  # the search failed high: the real score is at least the stored one
+UPPER = 2  # the search failed low: the real score is at most the stored one
+
+DEFAULT_HASH_MB = 16
+SLOTS = 2
+BYTES_PER_SLOT = 8 + 4 + 4 + 1 + 1  # key, move, score, depth, bound and generation
+GENERATIONS = 64  # generation counter wraps around inside the 6 bits it is given
+
+
+class TranspositionTable():
+    def __init__(self, hashMb=DEFAULT_HASH_MB):
+        self.buckets = max(1, int(hashMb * 1024 * 1024) // (SLOTS * BYTES_PER_SLOT))
+        self.hashMb = hashMb
+        self.clear()
+
+    # bytes held by the arrays of the table
+    def memoryUsed(self):
+        return sum(a.itemsize * len(a) for a in (self.keys, self.moves, self.scores, self.depths, self.flags))
+
+    # empty every slot
+    def clear(self):
+        from array import array  # imported here to keep it (and collections.abc) out of the engine's import time
+        size = self.buckets * SLOTS
+        self.keys = array('Q', [0]) * size
+        self.moves = array('I', [0]) * size
+        self.scores = array('i', [0]) * size
+        self.depths = array('B', [0]) * size
+        self.flags = array('B', [0]) * size  # bound in the low 2 bits, generation above, 0 = empty
+        self.generation = 1
+        self.hits = 0
+        self.probes = 0
+
+    # called at the start of every search, so entries of earlier searches can be told apart
+    # and give way in the depth-preferred slot
+    def newSearch(self):
+        self.generation = self.generation % (GENERATIONS - 1) + 1
+
+    # index of the slot holding key, or -1
+    def find(self, key):
+        self.probes += 1
+        i = (key % self.buckets) * SLOTS
+        keys = self.keys
+        if keys[i] == key and self.flags[i]:
+            self.hits += 1
+            return i
+        if keys[i + 1] == key and self.flags[i + 1]:
+            self.hits += 1
+            return i + 1
+        return -1
+
+    # (move, score, depth, bound) stored for key, or None
+    def probe(self, key):
+        i = self.find(key)
+        if i < 0:
+            return None
+        return self.moves[i], self.scores[i], self.depths[i], self.flags[i] & 3
+
+    def store(self, key, move, score, depth, bound):
+        depth = min(max(depth, 0), 255)
+        i = (key % self.buckets) * SLOTS
+        flags = self.flags
+        if not (flags[i] and self.keys[i] == key):
+            # the depth-preferred slot takes the entry if it is empty, is from an earlier search or
+            # was searched less deeply. otherwise the entry goes to the always-replace slot
+            if flags[i] and flags[i] >> 2 == self.generation and depth < self.depths[i]:
+                i += 1
+            elif flags[i + 1] and self.keys[i + 1] == key:
+                flags[i + 1] = 0  # the position moves up to the depth-preferred slot
+        if not move and flags[i] and self.keys[i] == key:
+            move = self.moves[i]  # keep the best move of an earlier search of this position
+        self.keys[i] = key
+        self.moves[i] = move
+        self.scores[i] = score
+        self.depths[i] = depth
+        flags[i] = (self.generation << 2) | bound
+
+    # best move stored for key, or 0
+    def bestMove(self, key):
+        i = self.find(key)
+        return self.moves[i] if i >= 0 else 0
+
+    # permille of the slots used by the current search, like the UCI hashfull field
+    def hashFull(self, sample=1000):
+        size = min(sample, self.buckets * SLOTS)
+        used = sum(1 for i in range(size) if self.flags[i] and self.flags[i] >> 2 == self.generation)
+        return used * 1000 // size
@@ -0,0 +1,313 @@
+# headless engine entry point speaking a UCI-style protocol on stdin / stdout
+# imports only the engine (no pygame, no images), so a worker can spawn one process per request.
+# anything that costs noticeable time is put off until it's needed: the transposition table is
+# allocated by the first "go", and threading is imported then too, the perft harness by "go perft".
+#
+#   python ChessUCI.py                 read commands from stdin
+#   python ChessUCI.py --import-time   measure import time and startup latency against the budgets
+#
+# supported commands: uci, isready, setoption (Hash, Backend, BookFile, TablebasePath), ucinewgame,
+# position [startpos | fen <fen>] [moves ...], go [movetime | wtime btime winc binc movestogo |
+# depth | nodes | infinite | perft <depth>], stop, d (print the board), quit
+
+import sys
+import time
+
+import ChessEngine
+import ChessSearch
+from ChessTransposition import DEFAULT_HASH_MB
+
+ENGINE_NAME = "Chess-Project"
+ENGINE_AUTHOR = "Chess-Project contributors"
+MAX_HASH_MB = 4096
+MOVE_OVERHEAD_MS = 30  # kept back from the clock for the time it takes to get the move out
+DEFAULT_MOVES_TO_GO = 30  # moves the remaining time is shared between when the GUI doesn't say
+
+# import time of the engine modules in a fresh interpreter, and the time from spawning the
+# process to the "readyok" answer, both in milliseconds
+IMPORT_BUDGET_MS = 15
+STARTUP_BUDGET_MS = 120
+ENGINE_MODULES = ("ChessEngine", "ChessSearch", "ChessTransposition", "ChessUCI")
+
+
+# UCI score field for a search score
+def formatScore(score):
+    if abs(score) >= ChessSearch.MATE - ChessSearch.MAX_DEPTH:
+        plies = ChessSearch.MATE - abs(score)
+        return "mate %d" % ((plies + 1) // 2 if score > 0 else -(plies // 2))
+    return "cp %d" % score
+
+
+# code of the legal move written in coordinate notation (e2e4, e7e8q), or None
+def parseMove(gs, text):
+    for code in gs.getValidMoveCodes():
+        if ChessEngine.Move.codeNotation(code) == text:
+            return code
+    return None
+
+
+class UCIEngine():
+    def __init__(self, out=None, backend="mailbox"):
+        self.out = out if out is not None else sys.stdout
+        self.backend = backend
+        self.hashMb = DEFAULT_HASH_MB
+        self.gs = ChessEngine.newGameState(backend)
+        self.searcher = None  # created by the first go
+        self.book = None  # ChessBook.OpeningBook of the BookFile option
+        self.tablebase = None  # ChessTablebase.Tablebase of the TablebasePath option
+        self.thread = None
+        self.infinite = False
+        self.outputLock = None
+
+    def send(self, line):
+        if self.outputLock is not None:
+            with self.outputLock:
+                self.out.write(line + "\n")
+                self.out.flush()
+        else:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    # handle one command line, False once the engine should quit
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max %d" % (DEFAULT_HASH_MB, MAX_HASH_MB))
+            self.send("option name Backend type combo default %s %s"
+                      % (self.backend, " ".join("var " + b for b in ChessEngine.BACKENDS)))
+            self.send("option name BookFile type string default <empty>")
+            self.send("option name TablebasePath type string default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.setOption(tokens)
+        elif command == "ucinewgame":
+            self.stopSearch()
+            if self.searcher is not None:
+                self.searcher.table.clear()
+        elif command == "position":
+            self.stopSearch()
+            self.setPosition(tokens)
+        elif command == "go":
+            self.stopSearch()
+            self.go(tokens)
+        elif command == "stop":
+            self.stopSearch()
+        elif command == "d":
+            for row in self.gs.board:
+                self.send(" ".join(row))
+            self.send("fen: " + self.gs.getFen())
+            self.send("key: %016x" % self.gs.zobristKey)
+        elif command == "quit":
+            self.stopSearch()
+            return False
+        else:
+            self.send("info string unknown command " + command)
+        return True
+
+    # setoption name <name> value <value>
+    def setOption(self, tokens):
+        if "name" not in tokens:
+            return
+        nameEnd = tokens.index("value") if "value" in tokens else len(tokens)
+        name = " ".join(tokens[tokens.index("name") + 1:nameEnd]).lower()
+        value = " ".join(tokens[nameEnd + 1:])
+        self.stopSearch()
+        if name == "hash":
+            try:
+                self.hashMb = min(max(int(value), 1), MAX_HASH_MB)
+            except ValueError:
+                self.send("info string bad Hash value " + value)
+                return
+            self.searcher = None  # reallocated at the new size by the next go
+        elif name == "backend":
+            if value not in ChessEngine.BACKENDS:
+                self.send("info string unknown backend " + value)
+                return
+            self.backend = value
+            self.gs = ChessEngine.newGameState(value).loadSnapshot(self.gs.snapshot())
+        elif name == "bookfile":
+            if self.book is not None:
+                self.book.close()
+                self.book = None
+            if value and value != "<empty>":
+                import ChessBook  # only engines given a book import it
+
+                try:
+                    self.book = ChessBook.OpeningBook(value)
+                except (OSError, ValueError) as e:
+                    self.send("info string bad BookFile: %s" % e)
+        elif name == "tablebasepath":
+            if self.tablebase is not None:
+                self.tablebase.close()
+                self.tablebase = None
+            if value and value != "<empty>":
+                import ChessTablebase  # only engines given tables import it
+
+                self.tablebase = ChessTablebase.Tablebase(value)
+        else:
+            self.send("info string unknown option " + name)
+
+    # position startpos [moves ...] / position fen <6 fields> [moves ...]
+    # a malformed FEN keeps the previous position
+    def setPosition(self, tokens):
+        moves = tokens.index("moves") if "moves" in tokens else len(tokens)
+        if len(tokens) > 1 and tokens[1] == "fen":
+            try:
+                gs = ChessEngine.newGameState(self.backend, " ".join(tokens[2:moves]))
+            except ValueError as e:
+                self.send("info string bad fen: %s" % e)
+                return
+        else:
+            gs = ChessEngine.newGameState(self.backend)
+        for text in tokens[moves + 1:]:
+            code = parseMove(gs, text)
+            if code is None:
+                self.send("info string illegal move " + text)
+                break
+            gs.makeMove(code)
+        self.gs = gs
+
+    def go(self, tokens):
+        options = {}
+        i = 1
+        while i < len(tokens):
+            if tokens[i] == "infinite":
+                options["infinite"] = True
+                i += 1
+            elif i + 1 < len(tokens):
+                try:
+                    options[tokens[i]] = int(tokens[i + 1])
+                except ValueError:
+                    pass
+                i += 2
+            else:
+                i += 1
+
+        if "perft" in options:
+            import ChessPerft  # only perft runs pay for importing the harness
+
+            counts = ChessPerft.divide(self.gs, options["perft"])
+            for notation, nodes in counts:
+                self.send("%s: %d" % (notation, nodes))
+            self.send("")
+            self.send("Nodes searched: %d" % sum(nodes for notation, nodes in counts))
+            return
+
+        timeMs = None
+        if "movetime" in options:
+            timeMs = options["movetime"]
+        elif ("wtime" if self.gs.whiteToMove else "btime") in options:
+            left = options["wtime" if self.gs.whiteToMove else "btime"]
+            increment = options.get("winc" if self.gs.whiteToMove else "binc", 0)
+            movesToGo = options.get("movestogo", DEFAULT_MOVES_TO_GO)
+            timeMs = min(left / max(movesToGo, 1) + increment * 3 // 4, left - MOVE_OVERHEAD_MS)
+            timeMs = max(timeMs, 1)
+        self.infinite = timeMs is None and "depth" not in options and "nodes" not in options
+        self.startSearch(timeMs, options.get("depth", ChessSearch.MAX_DEPTH), options.get("nodes"))
+
+    # run the search on a thread so stop, isready and quit are still read while it thinks
+    def startSearch(self, timeMs, maxDepth, maxNodes):
+        import threading  # only a searching engine pays for importing it
+
+        if self.searcher is None:
+            self.searcher = ChessSearch.Searcher(self.hashMb)
+            self.searcher.stopEvent = threading.Event()
+            self.outputLock = threading.Lock()
+        searcher = self.searcher
+        searcher.book = self.book
+        searcher.tablebase = self.tablebase
+        searcher.stopEvent.clear()
+        gs = self.gs
+
+        def onIteration(result):
+            nps = int(result.nodes / result.seconds) if result.seconds > 0 else 0
+            self.send("info depth %d score %s nodes %d nps %d time %d hashfull %d pv %s"
+                      % (result.depth, formatScore(result.score), result.nodes, nps, int(result.seconds * 1000),
+                         searcher.table.hashFull(), ChessEngine.Move.codeNotation(result.move)))
+
+        def run():
+            result = searcher.search(gs, timeMs, maxDepth, maxNodes, onIteration)
+            self.send("bestmove " + (ChessEngine.Move.codeNotation(result.move) if result.move else "0000"))
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+
+    def stopSearch(self):
+        if self.thread is not None:
+            self.searcher.stopEvent.set()
+            self.thread.join()
+            self.thread = None
+
+    # end of input: let a search with a limit finish and print its move, stop an infinite one
+    def finish(self):
+        if self.thread is not None and not self.infinite:
+            self.thread.join()
+        self.stopSearch()
+
+
+# import time of the engine modules (from python -X importtime) and process startup latency,
+# medians over runs fresh interpreters
+def measureImportTime(runs=5):
+    import os
+    import subprocess
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    importTimes = []
+    startupTimes = []
+    for run in range(runs):
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import ChessUCI"],
+                                 cwd=here, capture_output=True, text=True)
+        total = 0
+        for line in process.stderr.splitlines():
+            fields = [field.strip() for field in line.split("|")]
+            if len(fields) == 3 and fields[2] in ENGINE_MODULES:
+                total += int(fields[0].split(":")[1])  # self time, so nested modules aren't counted twice
+        importTimes.append(total / 1000.0)
+
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, os.path.join(here, "ChessUCI.py")], cwd=here,
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        process.stdin.write("isready\n")
+        process.stdin.flush()
+        process.stdout.readline()
+        startupTimes.append((time.perf_counter() - start) * 1000.0)
+        process.stdin.write("quit\n")
+        process.stdin.flush()
+        process.wait()
+    importTimes.sort()
+    startupTimes.sort()
+    return importTimes[len(importTimes) // 2], startupTimes[len(startupTimes) // 2]
+
+
+# the arguments are read by hand, importing argparse would cost about as much as the engine itself
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    backend = "mailbox"
+    if "--backend" in argv and argv.index("--backend") + 1 < len(argv):
+        backend = argv[argv.index("--backend") + 1]
+    if "--import-time" in argv:
+        importMs, startupMs = measureImportTime()
+        print("engine import time %.1f ms (budget %d ms), spawn to readyok %.1f ms (budget %d ms)"
+              % (importMs, IMPORT_BUDGET_MS, startupMs, STARTUP_BUDGET_MS))
+        return 0 if importMs <= IMPORT_BUDGET_MS and startupMs <= STARTUP_BUDGET_MS else 1
+
+    engine = UCIEngine(backend=backend)
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            engine.finish()
+            break
+        if not engine.handle(line):
+            break
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())